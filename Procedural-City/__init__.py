@@ -32,9 +32,13 @@ if not dir in sys.path:
 from . import delete
 from . import city
 from . import vehicles
-from crea_copias import crea_copias
+import core
+import modelo
+import tiempos
+from crea_copias import crea_copias_pasos
+from pasos import agota, avanza, escala
 from importlib import reload
-from bpy_extras.io_utils import ImportHelper
+from bpy_extras.io_utils import ExportHelper, ImportHelper
 
 # ------------------------------------------------------------------------------------------------------
 # Reloads (recargar los módulos cada vez que ejecutamos el script user_interface.py que es el principal)
@@ -42,6 +46,8 @@ from bpy_extras.io_utils import ImportHelper
 reload(delete)
 reload(city)
 reload(vehicles)
+reload(core)
+reload(modelo)
 
 # Clase para crear un panel con los diferentes ajustes para la generación de la ciudad desde el viewport 3D
 class ProceduralCityPanel(bpy.types.Panel):
@@ -84,6 +90,18 @@ class ProceduralCityPanel(bpy.types.Panel):
         row = layout.row()
         row.prop(scene, "var_edificios_min")
         row.prop(scene, "var_edificios_max")
+
+        row = layout.row()
+        row.prop(scene, "edificios_unificados")
+
+        row = layout.row()
+        row.prop(scene, "teselas")
+        if scene.teselas:
+            row.prop(scene, "tam_tesela")
+            row = layout.row()
+            row.prop(scene, "radio_teselas")
+            row.operator("object.tesela_ciudad", text="Stream").accion = 'STREAM'
+            row.operator("object.tesela_ciudad", text="Tile...").accion = 'REGENERATE'
         
         # Sección para la configuración de los vehiculos
         row = layout.row()
@@ -99,6 +117,13 @@ class ProceduralCityPanel(bpy.types.Panel):
         
         row = layout.row() 
         row.prop(scene, "n_giros")
+
+        row = layout.row()
+        row.prop(scene, "semilla")
+        row.prop(scene, "n_procesos")
+
+        row = layout.row()
+        row.prop(scene, "modo_animacion")
         
         # Sección para la configuración del vector director
         row = layout.row()
@@ -112,6 +137,18 @@ class ProceduralCityPanel(bpy.types.Panel):
         # Botón para la generación de la ciudad
         row = layout.row()
         row.operator("object.generar_city")
+        row.prop(scene, "generacion_modal")
+
+        # Botón para hornear la animación de los vehículos
+        row = layout.row()
+        row.operator("object.hornear_flota")
+        row.operator("object.exportar_almacen")
+        if scene.ruta_almacen:
+            row = layout.row()
+            row.prop(scene, "ruta_almacen")
+            if vehicles.error_almacen() is not None:
+                row = layout.row()
+                row.label(text=vehicles.error_almacen(), icon='ERROR')
 
         row = layout.row()
         row.label(text="Bank angle (all vehicles)", icon = 'DRIVER_ROTATIONAL_DIFFERENCE')
@@ -127,6 +164,74 @@ class ProceduralCityPanel(bpy.types.Panel):
         
         row = box.row()
         row.prop(scene, "tau_value")
+
+        # Caché en disco de las distribuciones de edificios y las rutas
+        box = layout.box()
+        row = box.row()
+        row.label(text="DISK CACHE", icon='DISK_DRIVE')
+
+        row = box.row()
+        row.prop(scene, "usar_cache")
+        if scene.usar_cache:
+            row.prop(scene, "tam_cache")
+            row = box.row()
+            row.prop(scene, "ruta_cache")
+            # Se muestra el último uso conocido: recorrer el directorio en cada redibujado sería demasiado lento
+            uso = city.cache_escena(scene).ultimo_uso()
+            row = box.row()
+            if uso is None:
+                row.label(text="Usage unknown")
+            else:
+                row.label(text="{} files, {:.1f} MB".format(uso[0], uso[1] / 2**20))
+            row.operator("object.uso_cache", text="", icon='FILE_REFRESH')
+            row.operator("object.vaciar_cache")
+
+        # Tiempos de las etapas de la última generación
+        box = layout.box()
+        row = box.row()
+        row.label(text="TIMING", icon='TIME')
+
+        row = box.row()
+        row.prop(scene, "escribir_traza")
+        if scene.escribir_traza:
+            row = box.row()
+            row.prop(scene, "ruta_traza")
+
+        for grupo in tiempos.resumen(tiempos.ultimos_tramos(), profundidad=4):
+            row = box.row()
+            row.label(text=tiempos.formatea(grupo))
+
+        # Estadísticas del perfilador de drivers
+        box = layout.box()
+        row = box.row()
+        row.label(text="DRIVER PROFILER", icon='DRIVER')
+
+        row = box.row()
+        row.prop(scene, "perfilar_drivers")
+        if scene.perfilar_drivers:
+            perfil = vehicles.perfil_drivers()
+            totales = perfil.totales()
+            row = box.row()
+            row.label(text="{} frames, {:.0f} calls/frame, {:.2f} ms/frame".format(
+                totales['fotogramas'], totales['llamadas_fotograma'], totales['tiempo_fotograma'] * 1000))
+
+            tasas = []
+            for cache in perfil.CACHES:
+                tasa = perfil.tasa_aciertos(cache)
+                tasas.append("{} {}".format(cache, "-" if tasa is None else "{:.0%}".format(tasa)))
+            row = box.row()
+            row.label(text="Cache hits: " + ", ".join(tasas))
+
+            # Vehículos más costosos
+            for coche, total, llamadas in perfil.por_coche()[:5]:
+                atributos = perfil.atributos.get(coche, {})
+                marcas = [nombre for nombre, clave in (("reparam.", 'reparametrizado'), ("bank", 'alabeo')) if atributos.get(clave)]
+                row = box.row()
+                row.label(text="{}: {:.2f} ms, {} calls {}".format(coche, total * 1000, llamadas, " ".join(marcas)))
+
+            row = box.row()
+            row.operator("object.exportar_perfil")
+            row.operator("object.reiniciar_perfil")
         
 class AlabeoPanel(bpy.types.Panel):
     """Creates a Panel in the Object properties window"""
@@ -225,69 +330,379 @@ class GenerateCityOperator(bpy.types.Operator, ImportHelper):
     bl_label = "Create city!"
 
     filter_glob: bpy.props.StringProperty(default="*.obj", options={'HIDDEN'})
+
+    # Solo se activa al llamar al operador desde la interfaz (invoke): las llamadas desde scripts
+    # (bpy.ops.object.generar_city(filepath=...)) generan siempre la ciudad de una sola vez
+    interactivo: bpy.props.BoolProperty(default=False, options={'HIDDEN', 'SKIP_SAVE'})
     
+    # Tiempo máximo en segundos de cada paso de la generación modal antes de devolver el control a la interfaz,
+    # y número de vehículos que se envían juntos a cada proceso para recibir los primeros cuanto antes
+    PRESUPUESTO = 0.1
+    BLOQUE = 32
+
+    def invoke(self, context, event):
+        self.interactivo = True
+        return ImportHelper.invoke(self, context, event)
+
     def execute(self, context):
+        # Se comprueba el modelo de los coches antes de empezar, para no fallar en mitad de la generación
+        if not os.path.isfile(self.filepath):
+            self.report({'ERROR'}, "Car model not found: {}".format(self.filepath))
+            return {'CANCELLED'}
+
+        # Desde la interfaz y con una ventana disponible, la generación se hace por pasos en un operador modal
+        # que no bloquea la interfaz (desde scripts o sin ventana, p. ej. en segundo plano, se hace de una sola
+        # vez, de forma que la ciudad existe cuando el operador devuelve el control)
+        if self.interactivo and context.scene.generacion_modal and context.window is not None:
+            return self.inicia_modal(context)
+
+        # Medimos los tiempos de todas las etapas de la generación (se muestran en el panel)
+        tiempos.inicia()
+        try:
+            with tiempos.tramo('GenerateCity'):
+                agota(self.genera(context))
+        except Exception:
+            self.deshace(context)
+            raise
+        finally:
+            self.escribe_traza(context, tiempos.termina())
+        return {'FINISHED'}
+
+    def inicia_modal(self, context):
+        """
+        Empieza la generación por pasos: un temporizador llama a modal, que avanza la generación durante
+        PRESUPUESTO segundos en cada llamada
+        """
+        tiempos.inicia()
+        self._tramo = tiempos.tramo('GenerateCity')
+        self._tramo.__enter__()
+        self._pasos = self.genera(context, bloque=self.BLOQUE)
+
+        wm = context.window_manager
+        self._temporizador = wm.event_timer_add(0.01, window=context.window)
+        wm.progress_begin(0, 100)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type == 'ESC' and event.value == 'PRESS':
+            self._pasos.close()
+            self.deshace(context)
+            self.termina_modal(context)
+            self.report({'WARNING'}, "City generation cancelled")
+            return {'CANCELLED'}
+
+        # Se deja navegar por la vista 3D mientras se genera, pero no modificar la escena
+        if event.type in {'MIDDLEMOUSE', 'WHEELUPMOUSE', 'WHEELDOWNMOUSE', 'TRACKPADPAN', 'TRACKPADZOOM'}:
+            return {'PASS_THROUGH'}
+        if event.type != 'TIMER':
+            return {'RUNNING_MODAL'}
+
+        try:
+            terminado, avance = avanza(self._pasos, self.PRESUPUESTO)
+        except Exception:
+            self.deshace(context)
+            self.termina_modal(context)
+            raise
+
+        if terminado:
+            self.termina_modal(context)
+            return {'FINISHED'}
+
+        if avance is not None:
+            etapa, fraccion = avance
+            context.window_manager.progress_update(int(fraccion * 100))
+            context.workspace.status_text_set("Generating city: {} {:.0%} (Esc to cancel)".format(etapa, fraccion))
+        return {'RUNNING_MODAL'}
+
+    def termina_modal(self, context):
+        """
+        Elimina el temporizador y el avance de la interfaz, y termina la medición de los tiempos
+        """
+        wm = context.window_manager
+        wm.event_timer_remove(self._temporizador)
+        wm.progress_end()
+        context.workspace.status_text_set(None)
+        self._tramo.__exit__(None, None, None)
+        self.escribe_traza(context, tiempos.termina())
+
+    def escribe_traza(self, context, tramos):
+        """
+        Escribe los tiempos de la generación en un fichero si se ha activado en el panel
+        """
+        scene = context.scene
+        if scene.escribir_traza:
+            ruta = bpy.path.abspath(scene.ruta_traza)
+            tiempos.escribe_traza(tramos, ruta)
+            self.report({'INFO'}, "Timing trace written to {}".format(ruta))
+
+    def genera(self, context, bloque=None):
+        """
+        Genera la ciudad por pasos (ver pasos.py), repitiendo solo las etapas cuyos parámetros han cambiado.
+        Después de cada paso devuelve el nombre de la etapa en curso y el avance de toda la generación
+        """
         # Utilizamos una variable para la escena
         scene = context.scene
 
-        # Eliminamos los objetos y acciones generados con la anterior generación de la ciudad y los vehiculos
-        delete.DeleteCollections('ciudad')
-        delete.DeleteActions()
+        # Comparamos las firmas de los grupos de parámetros con las de la generación anterior para
+        # repetir solo las etapas afectadas
+        parametros = core.Parametros.desde_escena(scene)
+        firmas = parametros.firmas(modelo=modelo.firma_modelo(self.filepath))
+        previas = scene.get('firmas_ciudad')
+        if previas is None or bpy.data.collections.get('ciudad') is None:
+            previas = {}
+        else:
+            previas = previas.to_dict()
+        etapas = core.etapas_modificadas(previas, firmas)
+
+        # Se guardan para deshacer la generación si se cancela
+        self._previas, self._etapas = previas, etapas
+
+        # Los datos de la generación anterior que se sustituyen no se eliminan hasta que termina la nueva: se
+        # apartan (ver delete.Aparta) para restaurarlos si se cancela
+        plan = []
+        if 'cuadricula' in etapas:
+            # Apartamos los objetos y acciones generados con la anterior generación de la ciudad y los vehiculos
+            # (solo los datos marcados por el addon, incluidas sus mallas, materiales y acciones)
+            vehicles.invalidar_trayectorias()
+            delete.Aparta()
+            # Colección de las ciudades generadas con versiones anteriores, que no tienen la marca
+            delete.DeleteCollections('ciudad')
+
+            # Llamamos a la función crearCiudad con las variables del menu.
+            plan.append(("buildings", 'CreateCity', 1, city.CreateCityPasos()))
+            plan.append(("vehicles", 'crea_vehiculos', 3, self.crea_vehiculos(context, bloque)))
+        else:
+            if 'edificios' in etapas:
+                delete.Aparta('edificios')
+                plan.append(("buildings", 'CreateCity', 1, city.CreateCityPasos()))
+
+            if 'vehiculos' in etapas:
+                vehicles.invalidar_trayectorias()
+                delete.Aparta('coches')
+                plan.append(("vehicles", 'crea_vehiculos', 3, self.crea_vehiculos(context, bloque)))
+            elif 'interpolacion' in etapas:
+                # Los coeficientes de las curvas se recalculan solos al cambiar el método o la tensión;
+                # solo hay que volver a medir la distancia recorrida para la reparametrización
+                plan.append(("distances", 'RecalculaDistancias', 1, vehicles.RecalculaDistanciasPasos()))
+
+        total = sum(peso for _, _, peso, _ in plan)
+        hecho = 0
+        for etapa, nombre, peso, pasos in plan:
+            with tiempos.tramo(nombre):
+                for avance in escala(pasos, hecho / total, (hecho + peso) / total):
+                    yield etapa, avance
+            hecho += peso
+
+        # La nueva generación está completa: ya se pueden eliminar los datos apartados
+        delete.DeleteApartados()
+        scene['firmas_ciudad'] = firmas
+        if not etapas:
+            self.report({'INFO'}, "Nothing to rebuild")
+
+    def deshace(self, context):
+        """
+        Deshace una generación interrumpida: elimina los datos a medio crear de las etapas que se estaban
+        repitiendo y restaura los de la generación anterior que se habían apartado, junto con sus firmas. La
+        escena queda como estaba antes de generar
+        """
+        etapas = getattr(self, '_etapas', set())
+        vehicles.invalidar_trayectorias()
+        if 'cuadricula' in etapas:
+            delete.DeleteGenerated()
+        else:
+            if 'edificios' in etapas:
+                delete.DeleteGenerated('edificios')
+            if 'vehiculos' in etapas:
+                delete.DeleteGenerated('coches')
+        delete.DeleteCollections('copias_ModeloCoche')
+        delete.DeleteObjects('ModeloCoche')
+        delete.Restaura()
+        vehicles.invalidar_trayectorias()
+
+        # Las distancias recorridas se recalculan sobre los vehículos existentes, que no se apartan: si se ha
+        # interrumpido ese recálculo, se olvida su firma para que la siguiente generación lo repita
+        previas = dict(getattr(self, '_previas', {}))
+        if 'interpolacion' in etapas and 'vehiculos' not in etapas:
+            previas.pop('interpolacion', None)
+        context.scene['firmas_ciudad'] = previas
+
+    def crea_vehiculos(self, context, bloque=None):
+        """
+        Importa el modelo de los coches, crea los vehículos y prepara su animación. Es un generador de pasos
+        (ver pasos.py): copias de los coches, rutas y distancias de cada vehículo y sus drivers
+        """
+        scene = context.scene
         delete.DeleteCollections('copias_ModeloCoche')
         delete.DeleteObjects('ModeloCoche')
         
-        # Importamos el fichero .obj
-        bpy.ops.import_scene.obj(filepath=self.filepath, axis_forward='-Y', axis_up='Z')
-        obj = bpy.context.selected_objects[0]
-        obj.name = "ModeloCoche"
-        
-        # Llamamos a la función crearCiudad con las variables del menu.
-        city.CreateCity()
+        # Obtenemos la malla del modelo (solo se importa el fichero .obj la primera vez o si ha cambiado) y
+        # marcamos como generado el objeto del modelo (las copias de los coches heredan la marca). La malla
+        # no se marca para que se conserve entre ejecuciones
+        malla = modelo.obtener_malla(self.filepath)
+
+        # En el modo de instancias toda la flota es un único objeto y no se crean copias del modelo
+        if scene.modo_animacion == 'INSTANCES':
+            with tiempos.tramo('CreateFleetInstances'):
+                yield from vehicles.CreateFleetInstancesPasos(malla, bloque)
+            return
+
+        obj = bpy.data.objects.new("ModeloCoche", malla)
+        scene.collection.objects.link(obj)
+        delete.etiqueta('coches', obj)
 
         # Creamos las copias de los coches
-        crea_copias(obj, context)
+        with tiempos.tramo('crea_copias'):
+            delete.etiqueta('coches', (yield from escala(crea_copias_pasos(obj, context), 0.0, 0.1)))
 
         # Llamamos a la función crearVehiculos con las variables del menu
-        vehicles.CreateVehicles()
+        with tiempos.tramo('CreateVehicles'):
+            yield from escala(vehicles.CreateVehiclesPasos(bloque), 0.1, 0.8)
 
         # Eliminamos las colecciones de las copias de los coches y el coche original
         delete.DeleteCollections('copias_ModeloCoche')
         delete.DeleteObjects('ModeloCoche') 
                 
-        for obj in bpy.data.objects:
-                if obj.name.startswith('coche') and obj.type!='EMPTY':
-                    
-                    drv_z = obj.driver_add('location', 2).driver
-                    drv_z.use_self = True
-                    drv_z.expression = "get_pos(self, frame, 2)"
-                    
-                    drv_y = obj.driver_add('location', 1).driver
-                    drv_y.use_self = True
-                    drv_y.expression = "get_pos(self, frame, 1)"
-                    
-                    drv_x = obj.driver_add('location', 0).driver
-                    drv_x.use_self = True
-                    drv_x.expression = "get_pos(self, frame, 0)"
+        # Animación de los vehículos: con drivers por vehículo o con el handler de toda la flota
+        with tiempos.tramo('configura_animacion'):
+            coches = [obj for obj in bpy.data.objects if obj.name.startswith('coche') and obj.type!='EMPTY']
+            for i, obj in enumerate(coches):
+                if scene.modo_animacion == 'DRIVERS':
+                    vehicles.CreateDrivers(obj)
+                else:
                     obj.rotation_mode = 'QUATERNION'
-                
-                    drv_r_0 = obj.driver_add('rotation_quaternion', 0).driver
-                    drv_r_0.use_self = True
-                    drv_r_0.expression = "get_quat(self, frame, 0)"
-                    
-                    drv_r_1 = obj.driver_add('rotation_quaternion', 1).driver
-                    drv_r_1.use_self = True
-                    drv_r_1.expression = "get_quat(self, frame, 1)"
-                    
-                    drv_r_2 = obj.driver_add('rotation_quaternion', 2).driver
-                    drv_r_2.use_self = True
-                    drv_r_2.expression = "get_quat(self, frame, 2)"
-                    
-                    drv_r_3 = obj.driver_add('rotation_quaternion', 3).driver
-                    drv_r_3.use_self = True
-                    drv_r_3.expression = "get_quat(self, frame, 3)"
-        
-        return{'FINISHED'}
+                    vehicles.silencia_curvas_posicion(obj, True)
+                yield 0.8 + 0.2 * (i + 1) / len(coches)
+
+            if scene.modo_animacion == 'HANDLER':
+                vehicles.actualiza_flota(scene)
     
+class BakeFleetOperator(bpy.types.Operator):
+    """
+    Hornea la animación de todos los vehículos en fcurves y elimina sus drivers
+    """
+    bl_idname = "object.hornear_flota"
+    bl_label = "Bake fleet"
+
+    def execute(self, context):
+        vehicles.BakeFleet()
+        if vehicles.error_almacen() is not None:
+            self.report({'WARNING'}, vehicles.error_almacen())
+        return {'FINISHED'}
+
+class ExportTrajectoryStoreOperator(bpy.types.Operator, ExportHelper):
+    """
+    Exporta la animación de la flota a un almacén de trayectorias externo y elimina las curvas de los vehículos
+    """
+    bl_idname = "object.exportar_almacen"
+    bl_label = "Export trajectory store"
+
+    filename_ext = ".pctraj"
+    filter_glob: bpy.props.StringProperty(default="*.pctraj", options={'HIDDEN'})
+
+    def execute(self, context):
+        n = vehicles.ExportTrajectoryStore(self.filepath)
+        if n == 0:
+            self.report({'WARNING'}, "There are no animated vehicles to export")
+            return {'CANCELLED'}
+
+        # La ruta se guarda relativa al fichero .blend si está guardado, para poder mover ambos juntos
+        context.scene.ruta_almacen = bpy.path.relpath(self.filepath) if bpy.data.filepath else self.filepath
+        vehicles.actualiza_flota(context.scene)
+        self.report({'INFO'}, "{} vehicles exported to {}".format(n, self.filepath))
+        return {'FINISHED'}
+
+class ExportDriverProfileOperator(bpy.types.Operator, ExportHelper):
+    """
+    Exporta las estadísticas del perfilador de drivers a un fichero CSV
+    """
+    bl_idname = "object.exportar_perfil"
+    bl_label = "Export CSV"
+
+    filename_ext = ".csv"
+    filter_glob: bpy.props.StringProperty(default="*.csv", options={'HIDDEN'})
+
+    def execute(self, context):
+        vehicles.perfil_drivers().escribe_csv(self.filepath)
+        return {'FINISHED'}
+
+class ClearCacheOperator(bpy.types.Operator):
+    """
+    Elimina todos los ficheros de la caché en disco
+    """
+    bl_idname = "object.vaciar_cache"
+    bl_label = "Clear cache"
+
+    def execute(self, context):
+        cache = city.cache_escena(context.scene)
+        if cache is not None:
+            cache.vacia()
+        return {'FINISHED'}
+
+class CacheUsageOperator(bpy.types.Operator):
+    """
+    Recorre el directorio de la caché en disco para actualizar su uso en el panel
+    """
+    bl_idname = "object.uso_cache"
+    bl_label = "Refresh cache usage"
+
+    def execute(self, context):
+        cache = city.cache_escena(context.scene)
+        if cache is not None:
+            cache.tamano()
+        return {'FINISHED'}
+
+class ResetDriverProfileOperator(bpy.types.Operator):
+    """
+    Descarta las estadísticas recogidas por el perfilador de drivers
+    """
+    bl_idname = "object.reiniciar_perfil"
+    bl_label = "Reset"
+
+    def execute(self, context):
+        vehicles.perfil_drivers().reinicia()
+        return {'FINISHED'}
+
+class TileOperator(bpy.types.Operator):
+    """
+    Gestiona las teselas de la ciudad: vuelve a generar una tesela, la carga o la descarga de la capa de vista,
+    o deja cargadas solo las teselas cercanas al cursor
+    """
+    bl_idname = "object.tesela_ciudad"
+    bl_label = "City tile"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    accion: bpy.props.EnumProperty(name="Action",
+                                   items=[("REGENERATE", "Regenerate", "Generate the tile again with the current parameters"),
+                                          ("LOAD", "Load", "Include the tile in the view layer"),
+                                          ("UNLOAD", "Unload", "Exclude the tile from the view layer"),
+                                          ("STREAM", "Stream", "Keep only the tiles around the 3D cursor in the view layer")],
+                                   default="REGENERATE")
+    ti: bpy.props.IntProperty(name="Tile X", min=0)
+    tj: bpy.props.IntProperty(name="Tile Y", min=0)
+
+    def invoke(self, context, event):
+        if self.accion == 'STREAM':
+            return self.execute(context)
+        return context.window_manager.invoke_props_dialog(self)
+
+    def execute(self, context):
+        scene = context.scene
+        if self.accion == 'STREAM':
+            incluidas = city.StreamTiles(scene.cursor.location.x, scene.cursor.location.y, scene.radio_teselas)
+            self.report({'INFO'}, "{} tiles loaded".format(incluidas))
+            return {'FINISHED'}
+
+        if self.accion == 'REGENERATE':
+            city.RegenerateTile(self.ti, self.tj)
+
+        capa = city.capa_tesela(self.ti, self.tj)
+        if capa is None:
+            self.report({'WARNING'}, "Tile {} does not exist".format(city.nombre_tesela(self.ti, self.tj)))
+            return {'CANCELLED'}
+        capa.exclude = self.accion == 'UNLOAD'
+        return {'FINISHED'}
+
 class Recalc_Dist_RecOperator(bpy.types.Operator):
     bl_idname = "object.recalc_dist_rec"
     bl_label = "Recalculate distance traveled"
@@ -354,6 +769,24 @@ def register():
                                                                 default = 0.2,
                                                                 max=1)
                                                           
+    bpy.types.Scene.edificios_unificados = bpy.props.BoolProperty(name = "Merge buildings",
+                                                                  description="Create all the buildings as a single mesh instead of one object per building",
+                                                                  default = False)
+
+    bpy.types.Scene.teselas = bpy.props.BoolProperty(name = "Tiled",
+                                                     description="Split the buildings into square tiles, each one a single mesh in its own collection with its own seed, that can be regenerated or excluded from the view layer one by one",
+                                                     default = False)
+
+    bpy.types.Scene.tam_tesela = bpy.props.IntProperty(name = "Tile size (streets)",
+                                                       description="Number of blocks per side of each tile",
+                                                       min = 1,
+                                                       default = 50)
+
+    bpy.types.Scene.radio_teselas = bpy.props.IntProperty(name = "Streaming radius",
+                                                          description="Number of tiles kept loaded around the tile of the 3D cursor when streaming",
+                                                          min = 0,
+                                                          default = 1)
+
     bpy.types.Scene.tam_calles = bpy.props.FloatProperty(name= "Width of streets (w)",
                                                          description="Width of streets (w)",
                                                          min = 0,
@@ -384,7 +817,32 @@ def register():
                                                     min = 0, 
                                                     default = 20)
 
+    bpy.types.Scene.semilla = bpy.props.IntProperty(name = "Seed",
+                                                    description="Master seed for the random generation of the buildings and the vehicles",
+                                                    min = 0,
+                                                    default = 0)
+
+    bpy.types.Scene.n_procesos = bpy.props.IntProperty(name = "Workers",
+                                                       description="Number of processes used to generate the vehicles. 1 generates them in Blender's own process; 0 uses all the cores (worth it for large fleets, as starting the processes takes a while)",
+                                                       min = 0,
+                                                       default = 1)
+
+    bpy.types.Scene.generacion_modal = bpy.props.BoolProperty(name = "In background",
+                                                              description="When started from the panel, generate the city in small steps without blocking the interface, showing the progress in the status bar (Esc cancels the generation and restores the previous city). Calls from scripts always generate in one go",
+                                                              default = True)
+
     
+    bpy.types.Scene.modo_animacion = bpy.props.EnumProperty(
+                                            name="Playback",
+                                            description="How the vehicles are animated during playback",
+                                            items=[
+                                                ("DRIVERS", "Drivers", "One Python driver per vehicle channel"),
+                                                ("HANDLER", "Fleet handler", "A single frame change handler animates the whole fleet"),
+                                                ("INSTANCES", "Point instances", "The fleet is a single point cloud with the car model instanced on its points (regenerate the vehicles after switching)")
+                                            ],
+                                            default="DRIVERS",
+                                            update=vehicles.cambia_modo_animacion)
+
     bpy.types.Scene.tau_value = bpy.props.FloatProperty(name= "Tau",
                                                         description="Tau",
                                                         min = 0,
@@ -411,6 +869,34 @@ def register():
                                                        description="Active the bank angle",
                                                        default = False)
     
+    bpy.types.Scene.usar_cache = bpy.props.BoolProperty(name = "Disk cache",
+                                                        description="Store the computed building layouts and vehicle routes on disk, and reuse them when generating again with the same parameters",
+                                                        default = False)
+
+    bpy.types.Scene.ruta_cache = bpy.props.StringProperty(name = "Cache directory",
+                                                          description="Directory of the disk cache (the system temporary directory if empty)",
+                                                          subtype = 'DIR_PATH',
+                                                          default = "")
+
+    bpy.types.Scene.tam_cache = bpy.props.IntProperty(name = "Size (MB)",
+                                                      description="Maximum size of the disk cache. The least recently used results are removed when it is exceeded",
+                                                      min = 1,
+                                                      default = 1024)
+
+    bpy.types.Scene.escribir_traza = bpy.props.BoolProperty(name = "Write timing trace",
+                                                       description="Write the timing of every stage of the generation as a Chrome trace (JSON)",
+                                                       default = False)
+
+    bpy.types.Scene.perfilar_drivers = bpy.props.BoolProperty(name = "Profile drivers",
+                                                       description="Measure the calls to the vehicle drivers during playback",
+                                                       default = False,
+                                                       update=vehicles.cambia_perfil)
+
+    bpy.types.Scene.ruta_traza = bpy.props.StringProperty(name = "Trace file",
+                                                       description="File for the Chrome trace of the generation",
+                                                       subtype='FILE_PATH',
+                                                       default = "//procedural_city_trace.json")
+
     bpy.types.Object.utilizar = bpy.props.BoolProperty(name = "Use",
                                                        description="Use reparameterization",
                                                     default = False)
@@ -422,10 +908,33 @@ def register():
     bpy.types.Object.dist_recorrida = bpy.props.FloatProperty(name = "Distance traveled",
                                                     description="Distance traveled with interpolation")
 
+    # Propiedad del objeto que indica que la animación del vehículo está horneada en fcurves
+    bpy.types.Object.horneado = bpy.props.BoolProperty(name = "Baked",
+                                                       description="The vehicle animation is baked into fcurves",
+                                                       default = False)
+
+    # Fila del vehículo en el almacén de trayectorias (-1 si no se anima desde el almacén)
+    bpy.types.Object.fila_almacen = bpy.props.IntProperty(name = "Store row",
+                                                          description="Row of the vehicle in the trajectory store (-1 if it is not animated from the store)",
+                                                          default = -1)
+
+    bpy.types.Scene.ruta_almacen = bpy.props.StringProperty(name = "Trajectory store",
+                                                            description="External file with the poses of the exported vehicles",
+                                                            subtype = 'FILE_PATH',
+                                                            default = "")
+
     # Se registra el driver                                                    
     bpy.app.driver_namespace['get_pos'] = vehicles.get_posicion
     bpy.app.driver_namespace['get_quat'] = vehicles.get_quaternion
 
+    # Se registran los handlers que mantienen actualizadas la caché de trayectorias y la memoria de poses,
+    # y el handler que anima la flota cuando no se utilizan drivers
+    bpy.app.handlers.depsgraph_update_post.append(vehicles.actualiza_caches)
+    bpy.app.handlers.frame_change_pre.append(vehicles.limpia_memo_poses)
+    bpy.app.handlers.frame_change_pre.append(vehicles.actualiza_flota)
+    bpy.app.handlers.load_post.append(vehicles.limpia_cache_trayectorias)
+    bpy.app.handlers.load_post.append(vehicles.restaura_perfil)
+
     # Se registran los operadores                
                                                                                    
     bpy.utils.register_class(ProceduralCityPanel)
@@ -434,7 +943,14 @@ def register():
     bpy.utils.register_class(AlabeoPanel)
     
     bpy.utils.register_class(GenerateCityOperator)
+    bpy.utils.register_class(BakeFleetOperator)
+    bpy.utils.register_class(ExportTrajectoryStoreOperator)
+    bpy.utils.register_class(ExportDriverProfileOperator)
+    bpy.utils.register_class(ResetDriverProfileOperator)
+    bpy.utils.register_class(ClearCacheOperator)
+    bpy.utils.register_class(CacheUsageOperator)
 
+    bpy.utils.register_class(TileOperator)
     bpy.utils.register_class(Recalc_Dist_RecOperator)
     bpy.utils.register_class(Recalc_Dist_DesOperator)
 
@@ -450,10 +966,25 @@ def unregister():
     la función register(). 
     Esta función es llamada cuando se desactiva o se elimina el complemento desde Blender.
     """
+    # Se eliminan los handlers de la caché de trayectorias, de la memoria de poses y de la flota
+    for handlers, handler in ((bpy.app.handlers.depsgraph_update_post, vehicles.actualiza_caches),
+                              (bpy.app.handlers.frame_change_pre, vehicles.limpia_memo_poses),
+                              (bpy.app.handlers.frame_change_pre, vehicles.actualiza_flota),
+                              (bpy.app.handlers.load_post, vehicles.limpia_cache_trayectorias),
+                              (bpy.app.handlers.load_post, vehicles.restaura_perfil)):
+        if handler in handlers:
+            handlers.remove(handler)
+
     # Se desregistran clases y operadores cuando el complemento se desactive o elimine
     
     bpy.utils.unregister_class(ProceduralCityPanel)
     bpy.utils.unregister_class(GenerateCityOperator)
+    bpy.utils.unregister_class(BakeFleetOperator)
+    bpy.utils.unregister_class(ExportTrajectoryStoreOperator)
+    bpy.utils.unregister_class(ExportDriverProfileOperator)
+    bpy.utils.unregister_class(ResetDriverProfileOperator)
+    bpy.utils.unregister_class(ClearCacheOperator)
+    bpy.utils.unregister_class(CacheUsageOperator)
     bpy.utils.unregister_class(DirectorXOperator)
     bpy.utils.unregister_class(DirectorYOperator)
     bpy.utils.unregister_class(DirectorZOperator)
@@ -461,6 +992,7 @@ def unregister():
     bpy.utils.unregister_class(ReparametrizacionPanel)
     bpy.utils.unregister_class(AlabeoPanel)
 
+    bpy.utils.unregister_class(TileOperator)
     bpy.utils.unregister_class(Recalc_Dist_RecOperator)
     bpy.utils.unregister_class(Recalc_Dist_DesOperator)
 
@@ -472,20 +1004,37 @@ def unregister():
     del bpy.types.Scene.alt_edificios_max
     del bpy.types.Scene.var_edificios_min
     del bpy.types.Scene.var_edificios_max
+    del bpy.types.Scene.edificios_unificados
+    del bpy.types.Scene.teselas
+    del bpy.types.Scene.tam_tesela
+    del bpy.types.Scene.radio_teselas
     del bpy.types.Scene.tam_calles
     del bpy.types.Scene.n_coches
     del bpy.types.Scene.v_coches
     del bpy.types.Scene.a_desplazamiento
     del bpy.types.Scene.f_desplazamiento
     del bpy.types.Scene.n_giros
+    del bpy.types.Scene.semilla
+    del bpy.types.Scene.n_procesos
+    del bpy.types.Scene.generacion_modal
     del bpy.types.Scene.v_director
+    del bpy.types.Scene.modo_animacion
     del bpy.types.Scene.tau_value
     del bpy.types.Scene.interpolation_method
     del bpy.types.Scene.activar_alabeo
+    del bpy.types.Scene.usar_cache
+    del bpy.types.Scene.ruta_cache
+    del bpy.types.Scene.tam_cache
+    del bpy.types.Scene.escribir_traza
+    del bpy.types.Scene.ruta_traza
+    del bpy.types.Scene.perfilar_drivers
     del bpy.types.Object.utilizar_alabeo
     del bpy.types.Object.utilizar
     del bpy.types.Object.dist_deseada
     del bpy.types.Object.dist_recorrida
+    del bpy.types.Object.horneado
+    del bpy.types.Object.fila_almacen
+    del bpy.types.Scene.ruta_almacen
 
 # Este bucle if impide que se ejecute la orden register() si se esta ejecutando el fichero mediante un import desde otro programa.
 if __name__ == "__main__":
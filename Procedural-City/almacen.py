@@ -0,0 +1,144 @@
+# Autores: Alberto Jativa, Jordi Beltran, Carlos Izquierdo, Enrique Alcover
+# version ='1.0'
+# -------------------------------------------------------------------------------
+""" Script que contiene el almacén externo de trayectorias de los vehiculos (fichero proyectado en memoria)"""
+# -------------------------------------------------------------------------------
+# Imports
+# -------------------------------------------------------------------------------
+import os
+
+import numpy as np
+# -------------------------------------------------------------------------------
+
+# Cabecera del fichero (64 bytes): identificador, versión, dimensiones de los datos y primer fotograma
+CABECERA = np.dtype([('magia', 'S8'), ('version', '<i4'), ('n_frames', '<i4'), ('n_coches', '<i4'),
+                     ('n_canales', '<i4'), ('frame_inicio', '<f8'), ('reservado', 'V32')])
+MAGIA = b'PCTRAJ'
+VERSION = 1
+
+class AlmacenTrayectorias:
+    """
+    Almacén de las poses de una flota en un fichero externo: una cabecera y un array float32 de forma
+    (fotogramas, vehículos, canales) con la posición (3 canales) y el cuaternion de rotación (4 canales) de
+    cada vehículo en cada fotograma. El array se abre con numpy.memmap, de forma que solo se leen del disco
+    las páginas de los fotogramas que se reproducen: los datos de cada fotograma son contiguos.
+    """
+
+    CANALES = 7
+
+    def __init__(self, ruta, datos, frame_inicio):
+        """
+        Args:
+            ruta (String): Ruta del fichero
+            datos (memmap): Array (fotogramas, vehículos, canales) proyectado en memoria
+            frame_inicio (float): Fotograma de la primera fila del array
+        """
+        self.ruta = ruta
+        self.datos = datos
+        self.frame_inicio = frame_inicio
+
+    @classmethod
+    def crea(cls, ruta, frame_inicio, n_frames, n_coches):
+        """
+        Crea un almacén vacío (sustituye el fichero si existe) que se rellena escribiendo en datos.
+        Args:
+            ruta (String): Ruta del fichero
+            frame_inicio (float): Primer fotograma
+            n_frames (int): Número de fotogramas
+            n_coches (int): Número de vehículos
+        Returns:
+            almacen (AlmacenTrayectorias): Almacén abierto para escritura
+        """
+        cabecera = np.zeros(1, dtype=CABECERA)
+        cabecera[0] = (MAGIA, VERSION, n_frames, n_coches, cls.CANALES, frame_inicio, b'')
+        with open(ruta, 'wb') as fichero:
+            fichero.write(cabecera.tobytes())
+            fichero.truncate(CABECERA.itemsize + n_frames * n_coches * cls.CANALES * 4)
+        datos = np.memmap(ruta, dtype='<f4', mode='r+', offset=CABECERA.itemsize,
+                          shape=(n_frames, n_coches, cls.CANALES))
+        return cls(ruta, datos, float(frame_inicio))
+
+    @classmethod
+    def abre(cls, ruta):
+        """
+        Abre un almacén para leerlo.
+        Args:
+            ruta (String): Ruta del fichero
+        Returns:
+            almacen (AlmacenTrayectorias): Almacén abierto para lectura
+        """
+        cabecera = np.fromfile(ruta, dtype=CABECERA, count=1)
+        if len(cabecera) == 0 or cabecera[0]['magia'] != MAGIA or cabecera[0]['version'] != VERSION:
+            raise ValueError("Not a trajectory store: {}".format(ruta))
+        n_frames, n_coches, n_canales = (int(cabecera[0][nombre]) for nombre in ('n_frames', 'n_coches', 'n_canales'))
+        if n_canales != cls.CANALES or os.path.getsize(ruta) < CABECERA.itemsize + n_frames * n_coches * n_canales * 4:
+            raise ValueError("Truncated trajectory store: {}".format(ruta))
+        datos = np.memmap(ruta, dtype='<f4', mode='r', offset=CABECERA.itemsize, shape=(n_frames, n_coches, n_canales))
+        return cls(ruta, datos, float(cabecera[0]['frame_inicio']))
+
+    @property
+    def frames(self):
+        """
+        Fotogramas del almacén.
+        """
+        return self.frame_inicio + np.arange(self.datos.shape[0], dtype=np.float64)
+
+    def escribe(self, inicio, pos, q):
+        """
+        Escribe las poses de todos los vehículos en varios fotogramas consecutivos.
+        Args:
+            inicio (int): Fila (fotograma - frame_inicio) del primer fotograma
+            pos (array): Array (fotogramas, vehículos, 3) con las posiciones
+            q (array): Array (fotogramas, vehículos, 4) con los cuaterniones
+        """
+        fin = inicio + len(pos)
+        self.datos[inicio:fin, :, :3] = pos
+        self.datos[inicio:fin, :, 3:] = q
+
+    def poses(self, frame, filas=None):
+        """
+        Lee las poses de los vehículos en un fotograma. En los subfotogramas (p. ej. con desenfoque de
+        movimiento) se interpola entre los dos fotogramas más cercanos, y fuera del intervalo del almacén
+        se mantiene la pose del primer o del último fotograma.
+        Args:
+            frame (float): Fotograma
+            filas (array): Vehículos que se leen (todos si no se indica)
+        Returns:
+            pos (array): Array (vehículos, 3) con las posiciones
+            q (array): Array (vehículos, 4) con los cuaterniones
+        """
+        n_frames = self.datos.shape[0]
+        f = min(max(frame - self.frame_inicio, 0.0), n_frames - 1.0)
+        i = min(int(f), n_frames - 2) if n_frames > 1 else 0
+        t = f - i
+
+        pose = self.lee(i, filas)
+        if t > 0:
+            siguiente = self.lee(i + 1, filas)
+            # Interpolación lineal de los cuaterniones por el camino más corto (q y -q son la misma rotación)
+            signo = np.where(np.einsum('ij,ij->i', pose[:, 3:], siguiente[:, 3:]) < 0, -1.0, 1.0)
+            siguiente[:, 3:] *= signo[:, None]
+            pose = pose + t * (siguiente - pose)
+
+        q = pose[:, 3:]
+        q /= np.linalg.norm(q, axis=1, keepdims=True)
+        return pose[:, :3], q
+
+    def lee(self, fila, filas=None):
+        """
+        Lee del disco las poses de un fotograma del almacén en precisión doble.
+        """
+        datos = self.datos[fila]
+        if filas is not None:
+            datos = datos[filas]
+        return np.array(datos, dtype=np.float64)
+
+    def cierra(self):
+        """
+        Escribe en el disco los datos pendientes y suelta la proyección del fichero (se libera cuando no quedan
+        arrays que la utilicen).
+        """
+        if self.datos is not None:
+            if self.datos.mode != 'r':
+                self.datos.flush()
+            self.datos = None
@@ -0,0 +1,176 @@
+# Autores: Alberto Jativa, Jordi Beltran, Carlos Izquierdo, Enrique Alcover
+# version ='1.0'
+# -------------------------------------------------------------------------------
+""" Script que contiene la caché en disco de las distribuciones de edificios y de las rutas de los vehiculos"""
+# -------------------------------------------------------------------------------
+# Imports
+# -------------------------------------------------------------------------------
+import hashlib
+import os
+import zipfile
+
+import numpy as np
+
+from tiempos import cuenta
+# -------------------------------------------------------------------------------
+
+# Versión del contenido de la caché. Forma parte de todas las claves, de forma que al cambiar cómo se calcula
+# o se guarda un resultado basta con aumentarla para que no se lean los ficheros anteriores
+VERSION = 1
+
+# Último uso conocido de cada directorio de caché: (número de ficheros, tamaño en bytes). Se actualiza cada vez
+# que se recorre el directorio, de forma que la interfaz lo puede mostrar sin volver a recorrerlo
+_uso = {}
+
+def clave(*partes):
+    """
+    Función que calcula la clave de un resultado a partir de todos los valores de los que depende.
+    Args:
+        partes: Valores de los que depende el resultado (números, cadenas o tuplas de ellos)
+    Returns:
+        clave (String): Resumen hexadecimal (sha1) de los valores
+    """
+    return hashlib.sha1(repr((VERSION,) + partes).encode('utf-8')).hexdigest()
+
+
+class CacheDisco:
+    """
+    Caché de resultados en disco: cada resultado es un diccionario de arrays de NumPy que se guarda comprimido
+    en un fichero .npz cuyo nombre es su clave. Cuando el tamaño de la caché supera el límite se eliminan los
+    ficheros usados hace más tiempo (la fecha de modificación de cada fichero se actualiza al leerlo).
+    """
+
+    def __init__(self, directorio, limite):
+        """
+        Args:
+            directorio (String): Directorio de la caché (se crea si no existe)
+            limite (int): Tamaño máximo de la caché en bytes
+        """
+        self.directorio = directorio
+        self.limite = limite
+
+    def ruta(self, clave):
+        """
+        Devuelve la ruta del fichero de un resultado.
+        """
+        return os.path.join(self.directorio, clave + '.npz')
+
+    def lee(self, clave):
+        """
+        Lee un resultado de la caché.
+        Args:
+            clave (String): Clave del resultado (ver clave)
+        Returns:
+            arrays (dict): Arrays del resultado (None si no está en la caché o el fichero está dañado)
+        """
+        ruta = self.ruta(clave)
+        try:
+            with np.load(ruta) as datos:
+                arrays = {nombre: datos[nombre] for nombre in datos.files}
+        except FileNotFoundError:
+            cuenta('fallos_cache')
+            return None
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            # Fichero incompleto o dañado: se descarta y se vuelve a calcular
+            self.elimina(ruta)
+            cuenta('fallos_cache')
+            return None
+
+        # Se marca como usado recientemente
+        try:
+            os.utime(ruta)
+        except OSError:
+            pass
+        cuenta('aciertos_cache')
+        return arrays
+
+    def escribe(self, clave, arrays):
+        """
+        Guarda un resultado en la caché y elimina los resultados más antiguos si se supera el límite. El fichero
+        se escribe con otro nombre y se renombra al terminar, para que nunca se lea un fichero a medio escribir.
+        Args:
+            clave (String): Clave del resultado (ver clave)
+            arrays (dict): Arrays del resultado
+        """
+        os.makedirs(self.directorio, exist_ok=True)
+        ruta = self.ruta(clave)
+        temporal = '{}.{}.tmp'.format(ruta, os.getpid())
+        try:
+            with open(temporal, 'wb') as fichero:
+                np.savez_compressed(fichero, **arrays)
+            os.replace(temporal, ruta)
+        except OSError:
+            # Sin espacio o sin permisos: el resultado simplemente no se guarda
+            self.elimina(temporal)
+            return
+        self.recorta()
+
+    def ficheros(self):
+        """
+        Devuelve los ficheros de la caché.
+        Returns:
+            ficheros (List): Tuplas (fecha de modificación, tamaño, ruta), de la más antigua a la más reciente
+        """
+        ficheros = []
+        try:
+            entradas = list(os.scandir(self.directorio))
+        except OSError:
+            return ficheros
+        for entrada in entradas:
+            if entrada.name.endswith('.npz'):
+                try:
+                    estado = entrada.stat()
+                except OSError:
+                    continue
+                ficheros.append((estado.st_mtime, estado.st_size, entrada.path))
+        ficheros.sort()
+        return ficheros
+
+    def tamano(self):
+        """
+        Devuelve el tamaño total de la caché en bytes (y actualiza su último uso conocido).
+        """
+        ficheros = self.ficheros()
+        total = sum(tam for _, tam, _ in ficheros)
+        _uso[self.directorio] = (len(ficheros), total)
+        return total
+
+    def ultimo_uso(self):
+        """
+        Devuelve el último uso conocido de la caché sin recorrer el directorio.
+        Returns:
+            uso (tuple): Número de ficheros y tamaño en bytes (None si aún no se ha recorrido)
+        """
+        return _uso.get(self.directorio)
+
+    def recorta(self):
+        """
+        Elimina los ficheros usados hace más tiempo hasta que el tamaño de la caché no supera el límite.
+        """
+        ficheros = self.ficheros()
+        total = sum(tam for _, tam, _ in ficheros)
+        for _, tam, ruta in ficheros:
+            if total <= self.limite:
+                break
+            self.elimina(ruta)
+            total -= tam
+            ficheros = ficheros[1:]
+        _uso[self.directorio] = (len(ficheros), total)
+
+    def vacia(self):
+        """
+        Elimina todos los ficheros de la caché.
+        """
+        for _, _, ruta in self.ficheros():
+            self.elimina(ruta)
+        _uso[self.directorio] = (0, 0)
+
+    @staticmethod
+    def elimina(ruta):
+        """
+        Elimina un fichero si existe.
+        """
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
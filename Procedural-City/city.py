@@ -5,11 +5,41 @@
 # --------------------------------------------------------------------------------
 # Imports
 # --------------------------------------------------------------------------------
+import os
+import tempfile
+
 import bpy
-import math
-import random
+import numpy as np
+
+from cache_disco import CacheDisco
+from core import Parametros, calcula_ciudad, calcula_tesela, tesela_punto, teselas
+from delete import etiqueta
+from jerarquia import crea_vacio, emparenta, enlaza
+from pasos import agota
+from tiempos import cuenta, medido, tramo
 # --------------------------------------------------------------------------------
 
+def cache_escena(scene):
+    """
+    Función que obtiene la caché en disco de las distribuciones de edificios y de las rutas configurada en el
+    panel. Por defecto se guarda en el directorio temporal del sistema.
+
+    Args:
+        scene (Scene): Escena
+
+    Returns:
+        cache (CacheDisco): Caché en disco (None si está desactivada)
+    """
+    if not scene.usar_cache:
+        return None
+    if scene.ruta_cache:
+        directorio = bpy.path.abspath(scene.ruta_cache)
+    else:
+        directorio = os.path.join(tempfile.gettempdir(), 'procedural_city_cache')
+    return CacheDisco(directorio, scene.tam_cache * 2**20)
+
+
+@medido
 def CreateBuilding(pos_x, pos_y, pos_z, l, h, material, city):
     """
     Función que toma 7 valores para generar un edificio en nuestra ciudad. Para generar un edificio utilizamos 
@@ -29,23 +59,230 @@ def CreateBuilding(pos_x, pos_y, pos_z, l, h, material, city):
     bpy.ops.mesh.primitive_cube_add(enter_editmode=False, align='WORLD', location=(pos_x, pos_y, pos_z), scale=(l/2, l/2, h))
     obj = bpy.context.active_object
     obj.name = 'edificio'
+    etiqueta('edificios', obj, obj.data)
+    cuenta('objetos')
 
     # Asignación del material
     if material != -1:
         obj.data.materials.append(material)
     
     # Enlazar objeto a objeto vacío
-    buildings = bpy.data.objects.get('edificios')
-    bpy.context.view_layer.objects.active = buildings
-    buildings.select_set(True)
-    bpy.ops.object.parent_set(type='OBJECT')
-    bpy.ops.object.select_all(action='DESELECT')
-    obj.select_set(True)
-    bpy.ops.object.parent_set(type='OBJECT', keep_transform=True)
+    emparenta(obj, bpy.data.objects.get('edificios'))
 
     # Enlazar objeto a coleccion
+    enlaza(obj, city)
+
+
+@medido
+def CreateBuildingsMesh(centros, l, alturas, materiales, indices_material, city, nombre='edificio'):
+    """
+    Función que genera todos los edificios de la ciudad en una única malla. En lugar de crear un cubo
+    por edificio mediante operadores, se construyen directamente los arrays de vértices y caras de todas
+    las cajas y se escriben en la malla de una sola vez. Cada edificio conserva su material mediante el
+    índice de material de sus caras.
+
+    Args:
+        centros (array): Array (n, 3) con las coordenadas de los centros de los edificios
+        l (float): Ancho de los edificios
+        alturas (array): Array (n,) con la mitad de la altura de cada edificio (escala en z del cubo)
+        materiales (List): Materiales que se añaden a la malla
+        indices_material (array): Array (n,) con el índice del material de cada edificio
+        city ('bpy_types.Collection'): Colección a la que se añade el objeto con los edificios
+        nombre (String): Nombre del objeto y de la malla
+
+    Returns:
+        obj (Object): Objeto que contiene la malla con todos los edificios
+    """
+    centros = np.asarray(centros, dtype=np.float64).reshape(-1, 3)
+    alturas = np.asarray(alturas, dtype=np.float64)
+    n = len(alturas)
+
+    # Esquinas y caras de un cubo unitario (las mismas que primitive_cube_add con tamaño 2)
+    esquinas = np.array([[-1, -1, -1], [1, -1, -1], [1, 1, -1], [-1, 1, -1],
+                         [-1, -1, 1], [1, -1, 1], [1, 1, 1], [-1, 1, 1]], dtype=np.float64)
+    caras = np.array([[0, 3, 2, 1], [4, 5, 6, 7], [0, 1, 5, 4],
+                      [1, 2, 6, 5], [2, 3, 7, 6], [3, 0, 4, 7]], dtype=np.int32)
+
+    # Las coordenadas se guardan relativas al objeto vacío 'edificios', que hará de padre
+    buildings = bpy.data.objects.get('edificios')
+    origen = np.array(buildings.location) if buildings else np.zeros(3)
+
+    # Escalamos y desplazamos las esquinas de cada caja
+    escala = np.column_stack([np.full(n, l/2), np.full(n, l/2), alturas])
+    vertices = (centros - origen)[:, None, :] + esquinas[None, :, :] * escala[:, None, :]
+    indices = caras[None, :, :] + 8 * np.arange(n, dtype=np.int32)[:, None, None]
+
+    # Escritura de la malla con foreach_set (sin operadores)
+    mesh = bpy.data.meshes.new(nombre)
+    mesh.vertices.add(n * 8)
+    mesh.vertices.foreach_set('co', vertices.astype(np.float32).ravel())
+    mesh.loops.add(n * 24)
+    mesh.loops.foreach_set('vertex_index', indices.ravel())
+    mesh.polygons.add(n * 6)
+    mesh.polygons.foreach_set('loop_start', np.arange(0, n * 24, 4, dtype=np.int32))
+    mesh.polygons.foreach_set('loop_total', np.full(n * 6, 4, dtype=np.int32))
+
+    # Asignación de los materiales por cara
+    for material in materiales:
+        mesh.materials.append(material)
+    if len(materiales) > 0:
+        mesh.polygons.foreach_set('material_index', np.repeat(np.asarray(indices_material, dtype=np.int32), 6))
+
+    mesh.update(calc_edges=True)
+    mesh.validate()
+
+    # Creación del objeto y enlace directo a la colección y al objeto vacío
+    obj = bpy.data.objects.new(nombre, mesh)
+    etiqueta('edificios', obj, mesh)
+    cuenta('objetos')
+    cuenta('edificios', n)
     city.objects.link(obj)
-    bpy.context.collection.objects.unlink(obj)
+    obj.parent = buildings
+
+    return obj
+
+
+def nombre_tesela(ti, tj):
+    """
+    Función que devuelve el nombre de la colección (y del objeto) de una tesela.
+    """
+    return 'tesela_{}_{}'.format(ti, tj)
+
+
+@medido
+def CreateTile(parametros, ti, tj, materiales, city):
+    """
+    Función que genera los edificios de una tesela en una única malla, dentro de su propia colección hija
+    de la colección de la ciudad. Cada tesela usa una semilla derivada de la semilla maestra y de su
+    posición (ver core.semilla_tesela), por lo que se puede volver a generar por separado y el resultado
+    no depende del resto de teselas. Al tener su propia colección, la tesela se puede excluir de la capa
+    de vista para que Blender no la evalúe.
+
+    Args:
+        parametros (Parametros): Parámetros de la ciudad
+        ti (int): Índice de la tesela en x
+        tj (int): Índice de la tesela en y
+        materiales (List): Materiales de los edificios
+        city ('bpy_types.Collection'): Colección de la ciudad
+
+    Returns:
+        coleccion (Collection): Colección de la tesela
+    """
+    nombre = nombre_tesela(ti, tj)
+    coleccion = bpy.data.collections.new(nombre)
+    coleccion['tesela'] = (ti, tj)
+    etiqueta('edificios', coleccion)
+    city.children.link(coleccion)
+    cuenta('teselas')
+
+    with tramo('calcula_tesela'):
+        centros, alturas, indices_material = calcula_tesela(parametros, len(materiales), ti, tj,
+                                                            cache_escena(bpy.context.scene))
+    if len(alturas) > 0:
+        CreateBuildingsMesh(centros, parametros.tam_manzana, alturas, materiales, indices_material, coleccion, nombre)
+
+    return coleccion
+
+
+@medido
+def DeleteTile(ti, tj):
+    """
+    Función que elimina una tesela: su colección, sus objetos y sus mallas.
+
+    Args:
+        ti (int): Índice de la tesela en x
+        tj (int): Índice de la tesela en y
+    """
+    coleccion = bpy.data.collections.get(nombre_tesela(ti, tj))
+    if coleccion is None:
+        return
+    ids = [coleccion] + list(coleccion.objects) + [obj.data for obj in coleccion.objects if obj.data is not None]
+    cuenta('eliminados', len(ids))
+    bpy.data.batch_remove(ids)
+
+
+def capa_tesela(ti, tj, view_layer=None):
+    """
+    Función que busca la colección de una tesela en la capa de vista (para excluirla o incluirla).
+
+    Args:
+        ti (int): Índice de la tesela en x
+        tj (int): Índice de la tesela en y
+        view_layer (ViewLayer): Capa de vista (por defecto la activa)
+
+    Returns:
+        capa (LayerCollection): Colección de la tesela en la capa de vista (None si no existe)
+    """
+    if view_layer is None:
+        view_layer = bpy.context.view_layer
+    pendientes = [view_layer.layer_collection]
+    nombre = nombre_tesela(ti, tj)
+    while pendientes:
+        capa = pendientes.pop()
+        if capa.name == nombre:
+            return capa
+        pendientes.extend(capa.children)
+    return None
+
+
+def parametros_teselas(scene):
+    """
+    Función que obtiene los parámetros con los que se generan las teselas. El origen es la posición del
+    objeto vacío 'edificios' y no la del cursor, para que las teselas que se vuelven a generar queden en su
+    sitio aunque se haya movido el cursor.
+
+    Args:
+        scene (Scene): Escena
+
+    Returns:
+        parametros (Parametros): Parámetros de la ciudad
+    """
+    parametros = Parametros.desde_escena(scene)
+    buildings = bpy.data.objects.get('edificios')
+    if buildings is not None:
+        parametros.origen = tuple(buildings.location)
+    return parametros
+
+
+def RegenerateTile(ti, tj):
+    """
+    Función que vuelve a generar una tesela con los parámetros actuales de la escena, sin tocar el resto de
+    la ciudad.
+
+    Args:
+        ti (int): Índice de la tesela en x
+        tj (int): Índice de la tesela en y
+    """
+    city = bpy.data.collections.get('ciudad')
+    if city is None:
+        return
+    DeleteTile(ti, tj)
+    CreateTile(parametros_teselas(bpy.context.scene), ti, tj, Materials('building'), city)
+
+
+def StreamTiles(x, y, radio):
+    """
+    Función que deja en la capa de vista solo las teselas cercanas a un punto (p. ej. el cursor o la cámara)
+    y excluye el resto, de forma que Blender solo evalúa y dibuja la zona de la ciudad en la que se trabaja.
+
+    Args:
+        x (float): Coordenada x del punto
+        y (float): Coordenada y del punto
+        radio (int): Número de teselas que se mantienen alrededor de la tesela del punto (0 para solo esa)
+
+    Returns:
+        incluidas (int): Número de teselas que quedan en la capa de vista
+    """
+    parametros = parametros_teselas(bpy.context.scene)
+    ci, cj = tesela_punto(parametros, x, y)
+    incluidas = 0
+    for ti, tj in teselas(parametros):
+        capa = capa_tesela(ti, tj)
+        if capa is None:
+            continue
+        capa.exclude = max(abs(ti - ci), abs(tj - cj)) > radio
+        incluidas += not capa.exclude
+    return incluidas
 
 
 def Materials(tipo):
@@ -66,25 +303,7 @@ def Materials(tipo):
     return mat
 
 
-def probabilidad_edificio(x, y):
-    """
-    Función que calcula la probabilidad de que un edificio aparezca dada la proximidad de dicho edificio al centro de la ciudad
-
-    Args:
-        x (float): Coordenada x del punto del que queremos calcular una probabilidad
-        y (float): Coordenada y del punto del que queremos calcular una probabilidad
-
-    Returns:
-        prob (float): Probabilidad calculada
-    """
-    # Calculamos la distancia al origen del punto (x,y)
-    dist = math.sqrt(x**2 + y**2)
-
-    # Calculamos y devolvemos la probabilidad de aparición del edificio para ese punto
-    prob = math.tanh(-0.4 * (dist-12)) * 0.45 + 0.5
-    return prob
-
-
+@medido
 def CreateCity():
     """
     Función para crear una ciudad procedural en Blender. Esta función obtiene los valores
@@ -94,66 +313,70 @@ def CreateCity():
     de los edificios, cuanto mas alejados estemos del centro, habrá menos probabilidad de 
     que aparezca un edificio.
 
-    Mediante bucles for, ubicamos los edificios y llamamos a la función CreateBuilding con
-    los parámetros necesarios. Creamos la matriz de edificios comprobando su probabilidad de
-    aparición, en el caso de que se cree el edificio por estar dentro de los valores de variación
-    calculamos una altura acorde con su distancia al centro.
+    La distribución de los edificios se calcula de forma vectorizada con core.calcula_ciudad: se crea
+    la matriz de edificios comprobando su probabilidad de aparición y, en el caso de que se cree el
+    edificio por estar dentro de los valores de variación, se calcula una altura acorde con su distancia
+    al centro. Después se escriben los edificios en la escena, en una única malla o con CreateBuilding.
     """
-    # Asignación de variables desde la interfaz
-    nx = bpy.context.scene.calles_x
-    ny = bpy.context.scene.calles_y
-    l = bpy.context.scene.tam_manzana
-    w = bpy.context.scene.tam_calles
-    p = bpy.context.scene.cursor.location
-
-    # Creacion de un objeto vacio para agrupar los objetos y tener la escena organizada
-    bpy.ops.object.empty_add(location=p)
-    obj = bpy.context.active_object
-    obj.name = 'edificios'
+    agota(CreateCityPasos())
 
-    # Creacion de coleccion para agrupar los objetos y tener la escena organizada
-    city = bpy.data.collections.new('ciudad')
-    bpy.context.scene.collection.children.link(city)
 
-    # Asignacion de objeto vacio a coleccion
-    city.objects.link(obj)
-    bpy.context.collection.objects.unlink(obj)
+def CreateCityPasos(lote=50):
+    """
+    Versión por pasos de CreateCity (ver pasos.py): devuelve el avance después de cada tesela o de cada lote
+    de edificios creados con CreateBuilding. La malla unificada se escribe en un solo paso.
 
-    # Posición inicial de la matriz de edificios
-    pos_x = p[0] + l/2
-    pos_y = p[1] + l/2
+    Args:
+        lote (int): Número de edificios que se crean en cada paso con CreateBuilding
+    """
+    # Asignación de variables desde la interfaz
+    scene = bpy.context.scene
+    parametros = Parametros.desde_escena(scene)
+    l = parametros.tam_manzana
+    p = scene.cursor.location
 
-    # Cálculo del centro de la matriz de edificios
-    cx = p[0]+ ( (nx + 1) * l + nx * w) / 2
-    cy = p[1]+ ((ny + 1) * l + ny * w) / 2
+    # Creacion de coleccion para agrupar los objetos y tener la escena organizada (si solo se vuelven a
+    # generar los edificios se reutiliza la colección existente)
+    city = bpy.data.collections.get('ciudad')
+    if city is None:
+        city = bpy.data.collections.new('ciudad')
+        etiqueta('ciudad', city)
+        bpy.context.scene.collection.children.link(city)
+
+    # Creacion de un objeto vacio en la coleccion para agrupar los objetos y tener la escena organizada
+    obj = crea_vacio('edificios', city, p)
+    etiqueta('edificios', obj)
 
     # Obtención de materiales a aplicar a los edificios (deben existir con anterioridad en la escena materiales cuyo nombre empiece con 'edificio')
     building_materials = Materials('building')
 
-    # Bucles for para la creación de la matriz de edificios
-    for row in range(nx+1):
-        for col in range(ny+1):
-            # Filtramos edificios por probabilidad
-            if random.uniform(bpy.context.scene.var_edificios_min, bpy.context.scene.var_edificios_max) < probabilidad_edificio(pos_x - cx, pos_y - cy):
-
-                # Asignamos altura por posición respectiva al centro
-                if 0.94 < probabilidad_edificio(pos_x - cx, pos_y - cy):
-                    h = random.uniform((bpy.context.scene.alt_edificios_min+bpy.context.scene.alt_edificios_max) / 2, bpy.context.scene.alt_edificios_max)  # 10.0, 16.0
-                else:
-                    h = random.uniform(bpy.context.scene.alt_edificios_min, (bpy.context.scene.alt_edificios_min+bpy.context.scene.alt_edificios_max) / 2)
-
-                # Desplazamos los edificios un poco por debajo del suelo
-                pos_z = p[2]+h-1
+    # En el modo por teselas cada tesela se calcula con su propia semilla, por lo que no se usa calcula_ciudad
+    if parametros.teselas:
+        lista = teselas(parametros)
+        for i, (ti, tj) in enumerate(lista):
+            CreateTile(parametros, ti, tj, building_materials, city)
+            yield (i + 1) / len(lista)
+        return
 
-                # Asignamos material si existe
-                if (len(building_materials) > 0):
-                    material = building_materials[random.randint(0, len(building_materials) - 1)]
-                else:
-                    material = -1
+    # Cálculo vectorizado de la distribución de los edificios
+    with tramo('calcula_ciudad'):
+        centros, alturas, indices_material = calcula_ciudad(parametros, len(building_materials),
+                                                            cache=cache_escena(scene))
 
-                CreateBuilding(pos_x, pos_y, pos_z, l, h, material, city)
+    # Escritura de los edificios en la escena
+    if len(alturas) == 0:
+        return
 
-            pos_y += l + w
+    if parametros.edificios_unificados:
+        CreateBuildingsMesh(centros, l, alturas, building_materials, indices_material, city)
+    else:
+        for i, ((pos_x, pos_y, pos_z), h, ind_material) in enumerate(zip(centros.tolist(), alturas.tolist(), indices_material.tolist())):
+            # Asignamos material si existe
+            if (len(building_materials) > 0):
+                material = building_materials[ind_material]
+            else:
+                material = -1
 
-        pos_y = p[1] + l / 2
-        pos_x += l + w
\ No newline at end of file
+            CreateBuilding(pos_x, pos_y, pos_z, l, h, material, city)
+            if (i + 1) % lote == 0:
+                yield (i + 1) / len(alturas)
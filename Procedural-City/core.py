@@ -0,0 +1,587 @@
+# Autores: Alberto Jativa, Jordi Beltran, Carlos Izquierdo, Enrique Alcover
+# version ='1.0'
+# -------------------------------------------------------------------------------
+"""
+Script con el núcleo de cálculo de la ciudad y los vehiculos, independiente de Blender. Recibe los parámetros
+del panel en un objeto Parametros y devuelve arrays de NumPy, de forma que se puede ejecutar, medir y
+paralelizar fuera de Blender. Los scripts city.py y vehicles.py solo traducen entre la escena y este núcleo.
+"""
+# -------------------------------------------------------------------------------
+# Imports
+# -------------------------------------------------------------------------------
+import hashlib
+
+import numpy as np
+
+from cache_disco import clave
+from rutas import itera_coches, semillas_coches
+from trayectoria import TablaFlota
+from orientacion import orientaciones
+# -------------------------------------------------------------------------------
+
+class Parametros:
+    """
+    Parámetros de la generación y la animación de la ciudad. Tiene los mismos campos que las propiedades
+    de la escena registradas en __init__.register, más la posición del cursor (origen) y el intervalo de
+    fotogramas de la escena.
+    """
+
+    # Campos y valores por defecto (los mismos que las propiedades de la escena)
+    CAMPOS = {
+        'calles_x': 40,
+        'calles_y': 40,
+        'tam_manzana': 4.0,
+        'tam_calles': 4.0,
+        'alt_edificios_min': 2.0,
+        'alt_edificios_max': 40.0,
+        'var_edificios_min': 0.0,
+        'var_edificios_max': 0.2,
+        'edificios_unificados': False,
+        'teselas': False,
+        'tam_tesela': 50,
+        'n_coches': 400,
+        'v_coches': 1.6,
+        'a_desplazamiento': 2.0,
+        'f_desplazamiento': 1.0,
+        'n_giros': 20,
+        'semilla': 0,
+        'n_procesos': 1,
+        'modo_animacion': 'DRIVERS',
+        'v_director': (0, 1, 0),
+        'tau_value': 0.1,
+        'interpolation_method': 'LINEAL',
+        'activar_alabeo': False,
+        'origen': (0.0, 0.0, 0.0),
+        'frame_start': 1,
+        'frame_end': 250,
+    }
+
+    # Grupos de campos de los que depende cada etapa de la generación (los vehículos vuelan hasta la altura
+    # máxima de los edificios). El número de procesos y los campos de la reproducción no cambian el resultado.
+    GRUPOS = {
+        'cuadricula': ('calles_x', 'calles_y', 'tam_manzana', 'tam_calles', 'origen'),
+        'edificios': ('alt_edificios_min', 'alt_edificios_max', 'var_edificios_min', 'var_edificios_max',
+                      'edificios_unificados', 'teselas', 'tam_tesela', 'semilla'),
+        'vehiculos': ('n_coches', 'v_coches', 'a_desplazamiento', 'f_desplazamiento', 'n_giros', 'semilla',
+                      'alt_edificios_max', 'frame_start', 'frame_end'),
+        'interpolacion': ('interpolation_method', 'tau_value'),
+    }
+
+    def __init__(self, **valores):
+        """
+        Args:
+            valores: Valores de los campos que no toman su valor por defecto
+        """
+        desconocidos = set(valores) - set(self.CAMPOS)
+        if desconocidos:
+            raise TypeError("Unknown parameters: {}".format(", ".join(sorted(desconocidos))))
+        for nombre, defecto in self.CAMPOS.items():
+            setattr(self, nombre, valores.get(nombre, defecto))
+
+    @classmethod
+    def desde_escena(cls, scene):
+        """
+        Crea los parámetros a partir de las propiedades de una escena de Blender.
+
+        Args:
+            scene (Scene): Escena con las propiedades del panel
+
+        Returns:
+            parametros (Parametros): Parámetros de la escena
+        """
+        valores = {nombre: getattr(scene, nombre) for nombre in cls.CAMPOS if nombre != 'origen'}
+        valores['v_director'] = tuple(valores['v_director'])
+        valores['origen'] = tuple(scene.cursor.location)
+        return cls(**valores)
+
+    def firmas(self, modelo=None):
+        """
+        Calcula un resumen (hash) de los valores de cada grupo de campos, para detectar qué etapas de la
+        generación hay que repetir cuando cambian los parámetros.
+
+        Args:
+            modelo: Valor que identifica el modelo de los vehículos (forma parte del grupo de los vehículos, igual
+                    que el uso del modo de instancias)
+
+        Returns:
+            firmas (dict): Resumen hexadecimal de cada grupo
+        """
+        firmas = {}
+        for grupo, campos in self.GRUPOS.items():
+            valores = tuple(getattr(self, nombre) for nombre in campos)
+            if grupo == 'vehiculos':
+                # Al pasar de objetos a instancias (o al revés) cambia la representación de los vehículos
+                valores += (modelo, self.modo_animacion == 'INSTANCES')
+            firmas[grupo] = hashlib.sha1(repr(valores).encode('utf-8')).hexdigest()
+        return firmas
+
+    def valores(self, *grupos):
+        """
+        Devuelve los valores de los campos de varios grupos, por ejemplo para formar la clave de un resultado
+        en la caché en disco.
+
+        Args:
+            grupos (String): Grupos de GRUPOS
+
+        Returns:
+            valores (tuple): Valores de los campos de los grupos, en orden
+        """
+        return tuple(getattr(self, nombre) for grupo in grupos for nombre in self.GRUPOS[grupo])
+
+    def __repr__(self):
+        return "Parametros({})".format(", ".join("{}={!r}".format(nombre, getattr(self, nombre)) for nombre in self.CAMPOS))
+
+
+def etapas_modificadas(previas, firmas):
+    """
+    Función que obtiene las etapas de la generación que hay que repetir comparando las firmas de los
+    parámetros con las de la generación anterior. Si cambia la cuadrícula se repite toda la generación, y al
+    repetir los vehículos también se recalculan sus curvas, de forma que la interpolación queda incluida.
+
+    Args:
+        previas (dict): Firmas de la generación anterior (vacío si no hay ciudad)
+        firmas (dict): Firmas de los parámetros actuales (ver Parametros.firmas)
+
+    Returns:
+        etapas (set): Grupos de Parametros.GRUPOS que hay que volver a generar
+    """
+    etapas = {grupo for grupo, firma in firmas.items() if previas.get(grupo) != firma}
+    if 'cuadricula' in etapas:
+        return set(firmas)
+    if 'vehiculos' in etapas:
+        etapas.add('interpolacion')
+    return etapas
+
+
+def probabilidad_edificio(x, y):
+    """
+    Función que calcula la probabilidad de que un edificio aparezca dada la proximidad de dicho edificio al centro de la ciudad
+
+    Args:
+        x (float o array): Coordenada x del punto del que queremos calcular una probabilidad
+        y (float o array): Coordenada y del punto del que queremos calcular una probabilidad
+
+    Returns:
+        prob (float o array): Probabilidad calculada
+    """
+    # Calculamos la distancia al origen del punto (x,y)
+    dist = np.sqrt(np.square(x) + np.square(y))
+
+    # Calculamos y devolvemos la probabilidad de aparición del edificio para ese punto
+    prob = np.tanh(-0.4 * (dist-12)) * 0.45 + 0.5
+    return prob
+
+
+def calcula_edificios(nx, ny, l, w, p, var_min, var_max, alt_min, alt_max, n_materiales, rng=None, rango=None):
+    """
+    Función que calcula la distribución de los edificios de la ciudad en una única pasada vectorizada
+    con NumPy, sin acceder a la escena de Blender. Se calculan los centros de la matriz de edificios,
+    la probabilidad de aparición de cada uno, los edificios que se conservan, sus alturas y sus materiales.
+
+    Args:
+        nx (int): Número de calles en x
+        ny (int): Número de calles en y
+        l (float): Tamaño de las manzanas
+        w (float): Ancho de las calles
+        p (Vector): Posición de origen de la ciudad (cursor)
+        var_min (float): Variabilidad mínima de aparición de los edificios
+        var_max (float): Variabilidad máxima de aparición de los edificios
+        alt_min (float): Altura mínima de los edificios
+        alt_max (float): Altura máxima de los edificios
+        n_materiales (int): Número de materiales disponibles para los edificios
+        rng (Generator): Generador de números aleatorios de NumPy (opcional)
+        rango (tuple): Filas y columnas de la matriz de edificios que se calculan ((i0, i1), (j0, j1)), por
+                       ejemplo las de una tesela. La densidad se sigue calculando respecto al centro de
+                       toda la ciudad (por defecto toda la matriz)
+
+    Returns:
+        centros (array): Array (n, 3) con los centros de los edificios que aparecen
+        alturas (array): Array (n,) con la altura (escala en z) de cada edificio
+        indices_material (array): Array (n,) con el índice del material de cada edificio
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    if rango is None:
+        rango = ((0, nx + 1), (0, ny + 1))
+    (i0, i1), (j0, j1) = rango
+
+    # Centros de la matriz de edificios (filas en x, columnas en y)
+    xs = p[0] + l/2 + np.arange(i0, i1) * (l + w)
+    ys = p[1] + l/2 + np.arange(j0, j1) * (l + w)
+    pos_x, pos_y = np.meshgrid(xs, ys, indexing='ij')
+    pos_x = pos_x.ravel()
+    pos_y = pos_y.ravel()
+
+    # Centro de la matriz de edificios y campo de densidad
+    cx = p[0] + ((nx + 1) * l + nx * w) / 2
+    cy = p[1] + ((ny + 1) * l + ny * w) / 2
+    prob = probabilidad_edificio(pos_x - cx, pos_y - cy)
+
+    # Filtramos edificios por probabilidad
+    conservar = rng.uniform(var_min, var_max, size=prob.shape) < prob
+    pos_x = pos_x[conservar]
+    pos_y = pos_y[conservar]
+    prob = prob[conservar]
+
+    # Asignamos altura por posición respectiva al centro
+    alt_media = (alt_min + alt_max) / 2
+    centro = 0.94 < prob
+    alturas = rng.uniform(np.where(centro, alt_media, alt_min), np.where(centro, alt_max, alt_media))
+
+    # Desplazamos los edificios un poco por debajo del suelo
+    pos_z = p[2] + alturas - 1
+
+    # Asignamos material si existe
+    if n_materiales > 0:
+        indices_material = rng.integers(0, n_materiales, size=alturas.shape)
+    else:
+        indices_material = np.zeros(alturas.shape, dtype=np.int64)
+
+    centros = np.column_stack([pos_x, pos_y, pos_z])
+    return centros, alturas, indices_material
+
+
+def calcula_ciudad(parametros, n_materiales, rng=None, cache=None):
+    """
+    Función que calcula la distribución de los edificios de la ciudad a partir de los parámetros.
+
+    Args:
+        parametros (Parametros): Parámetros de la ciudad
+        n_materiales (int): Número de materiales disponibles para los edificios
+        rng (Generator): Generador de números aleatorios de NumPy (por defecto se crea a partir de la semilla
+            de los parámetros)
+        cache (CacheDisco): Caché en disco en la que se busca y se guarda la distribución (opcional). Solo se
+                            utiliza si no se indica rng: la clave depende de la semilla de los parámetros, y no
+                            se puede saber de qué semilla procede un generador dado
+
+    Returns:
+        centros (array): Array (n, 3) con los centros de los edificios que aparecen
+        alturas (array): Array (n,) con la altura (escala en z) de cada edificio
+        indices_material (array): Array (n,) con el índice del material de cada edificio
+    """
+    if rng is None:
+        rng = np.random.default_rng(parametros.semilla)
+    else:
+        cache = None
+    return cachea_edificios(cache, clave('ciudad', parametros.valores('cuadricula', 'edificios'), n_materiales),
+                            lambda: calcula_edificios(parametros.calles_x, parametros.calles_y, parametros.tam_manzana,
+                                                      parametros.tam_calles, parametros.origen,
+                                                      parametros.var_edificios_min, parametros.var_edificios_max,
+                                                      parametros.alt_edificios_min, parametros.alt_edificios_max,
+                                                      n_materiales, rng))
+
+
+def cachea_edificios(cache, clave_edificios, calcula):
+    """
+    Función que lee una distribución de edificios de la caché en disco o, si no está, la calcula y la guarda.
+
+    Args:
+        cache (CacheDisco): Caché en disco (None para calcular siempre la distribución)
+        clave_edificios (String): Clave de la distribución en la caché
+        calcula (function): Función sin argumentos que calcula la distribución
+
+    Returns:
+        centros (array): Array (n, 3) con los centros de los edificios que aparecen
+        alturas (array): Array (n,) con la altura (escala en z) de cada edificio
+        indices_material (array): Array (n,) con el índice del material de cada edificio
+    """
+    if cache is None:
+        return calcula()
+    datos = cache.lee(clave_edificios)
+    if datos is not None:
+        return datos['centros'], datos['alturas'], datos['indices_material']
+    centros, alturas, indices_material = calcula()
+    cache.escribe(clave_edificios, {'centros': centros, 'alturas': alturas, 'indices_material': indices_material})
+    return centros, alturas, indices_material
+
+
+def teselas(parametros):
+    """
+    Función que obtiene las teselas en las que se divide la matriz de edificios en el modo por teselas. Cada
+    tesela tiene tam_tesela x tam_tesela edificios (las del borde pueden ser más pequeñas).
+
+    Args:
+        parametros (Parametros): Parámetros de la ciudad
+
+    Returns:
+        teselas (List): Índices (ti, tj) de las teselas
+    """
+    t = max(1, parametros.tam_tesela)
+    return [(ti, tj) for ti in range(-(-(parametros.calles_x + 1) // t))
+            for tj in range(-(-(parametros.calles_y + 1) // t))]
+
+
+def tesela_punto(parametros, x, y):
+    """
+    Función que obtiene la tesela que contiene un punto de la escena.
+
+    Args:
+        parametros (Parametros): Parámetros de la ciudad
+        x (float): Coordenada x del punto
+        y (float): Coordenada y del punto
+
+    Returns:
+        tesela (tuple): Índices (ti, tj) de la tesela (pueden quedar fuera de la ciudad)
+    """
+    lado = max(1, parametros.tam_tesela) * (parametros.tam_manzana + parametros.tam_calles)
+    return (int(np.floor((x - parametros.origen[0]) / lado)), int(np.floor((y - parametros.origen[1]) / lado)))
+
+
+def semilla_tesela(semilla, ti, tj):
+    """
+    Función que deriva de la semilla maestra la semilla de una tesela. Solo depende de la posición de la
+    tesela, de forma que cada tesela se puede volver a generar por separado con el mismo resultado.
+
+    Args:
+        semilla (int): Semilla maestra
+        ti (int): Índice de la tesela en x
+        tj (int): Índice de la tesela en y
+
+    Returns:
+        semilla (int): Semilla de la tesela
+    """
+    return int(np.random.SeedSequence(semilla, spawn_key=(ti, tj)).generate_state(1)[0])
+
+
+def calcula_tesela(parametros, n_materiales, ti, tj, cache=None):
+    """
+    Función que calcula la distribución de los edificios de una tesela, con su propia semilla.
+
+    Args:
+        parametros (Parametros): Parámetros de la ciudad
+        n_materiales (int): Número de materiales disponibles para los edificios
+        ti (int): Índice de la tesela en x
+        tj (int): Índice de la tesela en y
+        cache (CacheDisco): Caché en disco en la que se busca y se guarda la distribución (opcional)
+
+    Returns:
+        centros (array): Array (n, 3) con los centros de los edificios que aparecen
+        alturas (array): Array (n,) con la altura (escala en z) de cada edificio
+        indices_material (array): Array (n,) con el índice del material de cada edificio
+    """
+    t = max(1, parametros.tam_tesela)
+    rango = ((ti * t, min((ti + 1) * t, parametros.calles_x + 1)),
+             (tj * t, min((tj + 1) * t, parametros.calles_y + 1)))
+    rng = np.random.default_rng(semilla_tesela(parametros.semilla, ti, tj))
+    return cachea_edificios(cache, clave('tesela', parametros.valores('cuadricula', 'edificios'), n_materiales, ti, tj),
+                            lambda: calcula_edificios(parametros.calles_x, parametros.calles_y, parametros.tam_manzana,
+                                                      parametros.tam_calles, parametros.origen,
+                                                      parametros.var_edificios_min, parametros.var_edificios_max,
+                                                      parametros.alt_edificios_min, parametros.alt_edificios_max,
+                                                      n_materiales, rng, rango))
+
+
+def calcula_flota(parametros, n_materiales, n=None, distancias=True, cache=None, modelo=None):
+    """
+    Función que genera los vehículos (posición inicial, tamaño, material, ruta y distancia recorrida) en
+    paralelo, con una semilla por vehículo derivada de la semilla de los parámetros.
+
+    Args:
+        parametros (Parametros): Parámetros de la ciudad
+        n_materiales (int): Número de materiales disponibles para los vehículos
+        n (int): Número de vehículos (por defecto n_coches)
+        distancias (bool): Si se calcula la curva de distancia recorrida de cada vehículo
+        cache (CacheDisco): Caché en disco en la que se busca y se guarda la flota (opcional)
+        modelo: Valor que identifica el modelo de los vehículos (ver modelo.firma_malla), que forma parte de
+                la clave de la flota en la caché
+
+    Returns:
+        coches (List): Vehículos generados (ver rutas.genera_coche)
+    """
+    return list(itera_flota(parametros, n_materiales, n, distancias, cache=cache, modelo=modelo))
+
+
+def itera_flota(parametros, n_materiales, n=None, distancias=True, bloque=None, cache=None, modelo=None):
+    """
+    Generador que devuelve los vehículos de calcula_flota a medida que se generan, para procesarlos sin esperar
+    a que se genere toda la flota.
+
+    Args:
+        parametros (Parametros): Parámetros de la ciudad
+        n_materiales (int): Número de materiales disponibles para los vehículos
+        n (int): Número de vehículos (por defecto n_coches)
+        distancias (bool): Si se calcula la curva de distancia recorrida de cada vehículo
+        bloque (int): Número de vehículos que se envían juntos a cada proceso (ver rutas.itera_coches)
+        cache (CacheDisco): Caché en disco en la que se busca y se guarda la flota (opcional). Si está en la
+                            caché no se crea ningún proceso
+        modelo: Valor que identifica el modelo de los vehículos (ver modelo.firma_malla), que forma parte de
+                la clave de la flota en la caché
+
+    Returns:
+        coche (dict): Cada vehículo generado (ver rutas.genera_coche)
+    """
+    if n is None:
+        n = parametros.n_coches
+    coches = itera_coches(parametros, semillas_coches(parametros.semilla, n), n_materiales, parametros.n_procesos,
+                          distancias, bloque)
+    if cache is None:
+        return coches
+
+    # La distancia recorrida depende además de la interpolación
+    grupos = ('cuadricula', 'vehiculos', 'interpolacion') if distancias else ('cuadricula', 'vehiculos')
+    return cachea_flota(cache, clave('flota', parametros.valores(*grupos), modelo, n_materiales, n,
+                                       distancias), coches, n)
+
+
+def cachea_flota(cache, clave_flota, coches, n):
+    """
+    Generador que lee una flota de la caché en disco o, si no está, devuelve los vehículos a medida que se
+    generan y guarda la flota al llegar el último.
+
+    Args:
+        cache (CacheDisco): Caché en disco
+        clave_flota (String): Clave de la flota en la caché
+        coches (Generator): Generador de los vehículos (no se utiliza si la flota está en la caché)
+        n (int): Número de vehículos
+
+    Returns:
+        coche (dict): Cada vehículo (ver rutas.genera_coche)
+    """
+    datos = cache.lee(clave_flota)
+    if datos is not None:
+        coches.close()
+        yield from desempaqueta_flota(datos)
+        return
+
+    # La flota se guarda antes de devolver el último vehículo porque quien itera puede no pedir más
+    generados = []
+    for coche in coches:
+        generados.append(coche)
+        if len(generados) == n:
+            cache.escribe(clave_flota, empaqueta_flota(generados))
+        yield coche
+
+
+def empaqueta_flota(coches):
+    """
+    Función que guarda los vehículos generados en arrays planos para escribirlos en la caché en disco: los
+    fotogramas clave de cada eje de todos los vehículos se concatenan, con el inicio de los de cada vehículo.
+
+    Args:
+        coches (List): Vehículos generados (ver rutas.genera_coche)
+
+    Returns:
+        arrays (dict): Arrays de la flota (ver desempaqueta_flota)
+    """
+    arrays = {'pos_ini': np.array([coche['pos_ini'] for coche in coches], dtype=np.float64).reshape(-1, 3),
+              'tam_coche': np.array([coche['tam_coche'] for coche in coches], dtype=np.float64),
+              'material': np.array([coche['material'] for coche in coches], dtype=np.int64)}
+    for eje in range(3):
+        frames = [coche['claves'][eje][0] for coche in coches]
+        valores = [coche['claves'][eje][1] for coche in coches]
+        arrays['inicio_{}'.format(eje)] = np.concatenate([[0], np.cumsum([len(f) for f in frames])]).astype(np.int64)
+        arrays['frames_{}'.format(eje)] = np.concatenate([np.zeros(0)] + frames)
+        arrays['valores_{}'.format(eje)] = np.concatenate([np.zeros(0)] + valores)
+
+    # Todos los vehículos miden la distancia recorrida en los mismos fotogramas
+    if coches and coches[0]['distancias'] is not None:
+        arrays['frames'] = coches[0]['frames']
+        arrays['distancias'] = np.array([coche['distancias'] for coche in coches], dtype=np.float64)
+    return arrays
+
+
+def desempaqueta_flota(arrays):
+    """
+    Función que reconstruye los vehículos guardados con empaqueta_flota.
+
+    Args:
+        arrays (dict): Arrays de la flota
+
+    Returns:
+        coches (List): Vehículos, con el mismo formato que rutas.genera_coche
+    """
+    coches = []
+    for i, (pos_ini, tam_coche, material) in enumerate(zip(arrays['pos_ini'].tolist(), arrays['tam_coche'].tolist(),
+                                                           arrays['material'].tolist())):
+        claves = []
+        for eje in range(3):
+            inicio = arrays['inicio_{}'.format(eje)]
+            claves.append((arrays['frames_{}'.format(eje)][inicio[i]:inicio[i + 1]],
+                           arrays['valores_{}'.format(eje)][inicio[i]:inicio[i + 1]]))
+        coches.append({'pos_ini': pos_ini, 'tam_coche': tam_coche, 'material': material, 'claves': claves,
+                       'frames': arrays['frames'] if 'frames' in arrays else None,
+                       'distancias': arrays['distancias'][i] if 'distancias' in arrays else None})
+    return coches
+
+
+def tabla_coches(coches):
+    """
+    Función que crea la tabla de trayectorias de una flota directamente a partir de los vehículos generados,
+    sin leer las fcurves de ningún objeto (en el modo de instancias los vehículos no son objetos) ni crear una
+    trayectoria por vehículo.
+
+    Args:
+        coches (List): Vehículos generados (ver rutas.genera_coche)
+
+    Returns:
+        tabla (TablaFlota): Tabla de trayectorias de la flota, con una fila por vehículo
+    """
+    return TablaFlota.desde_claves([coche['claves'] for coche in coches])
+
+
+def calcula_poses(parametros, tabla, frames, alabeo, reparametrizacion=None):
+    """
+    Función que evalúa de forma vectorizada las posiciones y orientaciones de toda la flota en varios
+    fotogramas. Cada posición de la trayectoria se evalúa una sola vez aunque la utilicen varios
+    fotogramas (como posición actual, anterior o para el alabeo).
+
+    Args:
+        parametros (Parametros): Parámetros de la animación
+        tabla (TablaFlota): Tabla de trayectorias de la flota
+        frames (array): Fotogramas que se quieren evaluar
+        alabeo (array): Indica para cada vehículo si se aplica el ángulo de alabeo
+        reparametrizacion (dict): Para los vehículos reparametrizados, función que convierte un array de
+                                  fotogramas de la animación en fotogramas de la trayectoria (opcional)
+
+    Returns:
+        pos (array): Array (fotogramas, vehículos, 3) con las posiciones
+        q (array): Array (fotogramas, vehículos, 4) con los cuaterniones de rotación
+    """
+    frames = np.atleast_1d(np.asarray(frames, dtype=np.float64))
+    n = tabla.n_vehiculos
+    start = parametros.frame_start
+
+    # Fotogramas que forman el vector tangente (en el primer fotograma se usa el siguiente)
+    inicio = frames == start
+    f0 = np.where(inicio, frames, frames - 1)
+    f1 = np.where(inicio, frames + 1, frames)
+
+    # Si hay alabeo se necesita el vector tangente anterior
+    alabeo = np.asarray(alabeo, dtype=bool) | parametros.activar_alabeo
+    con_anterior = ~inicio & (frames != start + 1)
+    muestras = [f0, f1]
+    if alabeo.any():
+        muestras.append(frames[con_anterior] - 2)
+    muestras = np.unique(np.concatenate(muestras))
+
+    # Fotogramas de la trayectoria de cada vehículo (reparametrizados si lo usan)
+    filas = np.tile(np.arange(n), len(muestras))
+    frames_tray = np.repeat(muestras, n)
+    for fila, frame_trayectoria in (reparametrizacion or {}).items():
+        frames_tray[fila::n] = frame_trayectoria(muestras)
+
+    # Evaluación vectorizada de todas las posiciones necesarias
+    P = tabla.posiciones(filas, frames_tray, parametros.interpolation_method, parametros.tau_value).reshape(len(muestras), n, 3)
+    v0 = P[np.searchsorted(muestras, f0)]
+    v1 = P[np.searchsorted(muestras, f1)]
+
+    t_anterior = np.zeros_like(v0)
+    if alabeo.any() and con_anterior.any():
+        anteriores = frames[con_anterior]
+        t_anterior[con_anterior] = P[np.searchsorted(muestras, anteriores - 1)] - P[np.searchsorted(muestras, anteriores - 2)]
+
+    # Orientación de todos los vehículos en todos los fotogramas
+    corregir_y = parametros.a_desplazamiento == 0 or parametros.f_desplazamiento == 0
+    _, q, _ = orientaciones(v0.reshape(-1, 3), v1.reshape(-1, 3), parametros.v_director, corregir_y,
+                            np.tile(alabeo, len(frames)), t_anterior.reshape(-1, 3))
+
+    pos = np.where(inicio[:, None, None], v0, v1)
+    return pos, q.reshape(len(frames), n, 4)
+
+
+if __name__ == "__main__":
+    # Generación de una ciudad con los parámetros por defecto, sin Blender
+    parametros = Parametros(n_procesos=1)
+    centros, alturas, indices_material = calcula_ciudad(parametros, 0, np.random.default_rng(parametros.semilla))
+    coches = calcula_flota(parametros, 0)
+    print(len(alturas), "buildings,", len(coches), "vehicles")
@@ -1,9 +1,22 @@
 import bpy
 
+from pasos import agota
+from tiempos import cuenta, medido
 
+
+@medido
 def crea_copias(obj, context, copy_action = False):
     """ Crea varias copias de un objeto y elimina las fcurves de posición
 
+    Devuelve: colección con las copias creadas
+    """
+    return agota(crea_copias_pasos(obj, context, copy_action))
+
+
+def crea_copias_pasos(obj, context, copy_action = False, lote = 100):
+    """ Versión por pasos de crea_copias (ver pasos.py): devuelve el avance
+    después de cada lote de copias
+
     Devuelve: colección con las copias creadas
     """
 
@@ -41,6 +54,10 @@ def crea_copias(obj, context, copy_action = False):
         if copy_action and original_action is not None:
             new_obj.animation_data.action = original_action.copy()
         #
+
+        cuenta('objetos')
+        if (i + 1) % lote == 0:
+            yield (i + 1) / n
     #
 
     return copies_collection
@@ -6,8 +6,114 @@
 # Imports
 # ---------------------------------------------------------------------------------------------
 import bpy
+
+from tiempos import cuenta, medido
 # ---------------------------------------------------------------------------------------------
 
+# Propiedad personalizada con la que se marcan los datos creados por el addon. Su valor es el grupo
+# de la generación al que pertenecen: 'ciudad' (la colección), 'edificios' o 'coches'
+ETIQUETA = 'procedural_city'
+
+# Propiedad con la que se marcan los datos apartados por una generación en curso (ver Aparta). Su valor guarda
+# el grupo, el nombre y la visibilidad que tenían, para restaurarlos si la generación se cancela. Los nombres
+# apartados empiezan por un punto, de forma que Blender no los muestra en las listas de datos
+APARTADO = 'procedural_city_apartado'
+PREFIJO_APARTADO = '.apartado.'
+
+def datos_addon():
+    """
+    Función que devuelve las colecciones de datos de Blender en las que el addon crea datos
+    """
+    return (bpy.data.objects, bpy.data.meshes, bpy.data.materials, bpy.data.actions, bpy.data.node_groups,
+            bpy.data.collections)
+
+def etiqueta(grupo, *ids):
+    """
+    Función para marcar datos de Blender (objetos, mallas, materiales, acciones, grupos de nodos o colecciones) como creados
+    por el addon, de forma que DeleteGenerated los pueda eliminar sin tocar el resto del fichero
+
+    Args:
+        grupo (String): grupo de la generación al que pertenecen los datos
+        ids (ID): datos que se marcan
+    """
+    for id in ids:
+        id[ETIQUETA] = grupo
+
+
+@medido
+def DeleteGenerated(*grupos):
+    """
+    Función para eliminar de una sola vez con batch_remove todos los datos creados por el addon (o solo los
+    de los grupos indicados): objetos, mallas, materiales, acciones, grupos de nodos y colecciones. Al eliminar también las
+    mallas y las acciones, no quedan datos huérfanos ocupando memoria tras cada generación
+
+    Args:
+        grupos (String): grupos que se eliminan (todos si no se indica ninguno)
+    """
+    ids = [id for coleccion in datos_addon() for id in coleccion
+           if id.get(ETIQUETA) is not None and (not grupos or id.get(ETIQUETA) in grupos)]
+    if ids:
+        cuenta('eliminados', len(ids))
+        bpy.data.batch_remove(ids)
+
+
+@medido
+def Aparta(*grupos):
+    """
+    Función que aparta los datos creados por el addon (o solo los de los grupos indicados) en lugar de
+    eliminarlos, para poder restaurarlos si se cancela la generación que los sustituye: se cambia su marca
+    por la de apartados (DeleteGenerated ya no los encuentra), se añade un prefijo a su nombre (las búsquedas
+    por nombre de la nueva generación no los encuentran) y se ocultan los objetos y las colecciones.
+    Al terminar la generación se eliminan con DeleteApartados o se restauran con Restaura
+
+    Args:
+        grupos (String): grupos que se apartan (todos si no se indica ninguno)
+    """
+    ids = [id for coleccion in datos_addon() for id in coleccion
+           if id.get(ETIQUETA) is not None and (not grupos or id.get(ETIQUETA) in grupos)]
+    for id in ids:
+        estado = {'grupo': id[ETIQUETA], 'nombre': id.name}
+        if isinstance(id, (bpy.types.Object, bpy.types.Collection)):
+            estado['ocultos'] = [int(id.hide_viewport), int(id.hide_render)]
+            id.hide_viewport = id.hide_render = True
+        del id[ETIQUETA]
+        id[APARTADO] = estado
+        id.name = PREFIJO_APARTADO + id.name
+
+
+def apartados():
+    """
+    Función que devuelve los datos apartados con Aparta
+    """
+    return [id for coleccion in datos_addon() for id in coleccion if id.get(APARTADO) is not None]
+
+
+@medido
+def Restaura():
+    """
+    Función que deshace Aparta: devuelve a los datos apartados su nombre, su marca y su visibilidad
+    """
+    for id in apartados():
+        estado = id[APARTADO]
+        id.name = estado['nombre']
+        if 'ocultos' in estado:
+            id.hide_viewport, id.hide_render = (bool(oculto) for oculto in estado['ocultos'])
+        id[ETIQUETA] = estado['grupo']
+        del id[APARTADO]
+
+
+@medido
+def DeleteApartados():
+    """
+    Función que elimina de una sola vez los datos apartados con Aparta, cuando ya se han sustituido
+    """
+    ids = apartados()
+    if ids:
+        cuenta('eliminados', len(ids))
+        bpy.data.batch_remove(ids)
+
+
+@medido
 def DeleteObjects(nameObject):
     """
     Función para eliminar todos los objetos con un nombre determinado
@@ -16,11 +122,13 @@ def DeleteObjects(nameObject):
         nameObject (String): nombre de los objetos a eliminar
     """
     bpy.ops.object.select_all(action='DESELECT')
-    for obj in bpy.data.objects:
-        if obj.name.startswith(nameObject):
-            bpy.data.objects.remove(obj, do_unlink=True)
+    objetos = [obj for obj in bpy.data.objects if obj.name.startswith(nameObject)]
+    if objetos:
+        cuenta('eliminados', len(objetos))
+        bpy.data.batch_remove(objetos)
 
 
+@medido
 def DeleteCollections(nameCollection):
     """
     Función para eliminar una colección con un nombre determinado
@@ -28,14 +136,17 @@ def DeleteCollections(nameCollection):
     Args:
         nameCollection (String): nombre de la colección
     """
-    for collection in bpy.data.collections:
-        if collection.name.startswith(nameCollection):
-            bpy.data.collections.remove(collection)
+    colecciones = [collection for collection in bpy.data.collections if collection.name.startswith(nameCollection)]
+    if colecciones:
+        bpy.data.batch_remove(colecciones)
 
 
+@medido
 def DeleteActions():
     """
-    Función para eliminar las acciones tras cada ejecución de crearVehiculos
+    Función para eliminar las acciones creadas por el addon tras cada ejecución de crearVehiculos
+    (el resto de acciones del fichero se conservan)
     """
-    for action in bpy.data.actions:
-        bpy.data.actions.remove(action)
\ No newline at end of file
+    acciones = [action for action in bpy.data.actions if action.get(ETIQUETA) is not None]
+    if acciones:
+        bpy.data.batch_remove(acciones)
@@ -1,7 +1,12 @@
 # Autores: Alberto Jativa, Jordi Beltran, Carlos Izquierdo, Enrique Alcover
 # version ='1.0'
 # --------------------------------------------------------------------------------------
-""" Script que contiene las funciones de interpolación lineal, Hermite y Catmull-Rom """
+""" 
+Script que contiene las funciones de interpolación lineal, Hermite y Catmull-Rom.
+Todas las funciones aceptan tanto escalares como arrays de NumPy (que se combinan elemento a elemento),
+de forma que se pueden evaluar miles de tramos en una sola llamada. El resultado de la versión con arrays
+es idéntico bit a bit al de la versión escalar.
+"""
 # --------------------------------------------------------------------------------------
 # Imports
 # --------------------------------------------------------------------------------------
@@ -14,14 +19,14 @@ def interpola_lineal(t0, t1, x0, x1, t):
     dos puntos conocidos y sus tiempos en una trayectoria.
 
     Args:
-        t0: inicio del tramo
-        t1: fin del tramo
-        x0: posicion al inicio del tramo
-        x1: posición al final del tramo
-        t: tiempo entre t0 y t1 en el que queremos la posición
+        t0 (float o array): inicio del tramo
+        t1 (float o array): fin del tramo
+        x0 (float o array): posicion al inicio del tramo
+        x1 (float o array): posición al final del tramo
+        t (float o array): tiempo entre t0 y t1 en el que queremos la posición
 
     Returns:
-        x: Estimación de la posición en el tiempo t.
+        x (float o array): Estimación de la posición en el tiempo t.
 
     """
     # Calcula la duración del tramo
@@ -41,16 +46,16 @@ def interpola_hermite(t0, t1, x0, x1, v0, v1, t):
     en una trayectoria, teniendo en cuenta las velocidades iniciales y finales.
 
     Args:
-        t0: inicio del tramo
-        t1: fin del tramo
-        x0: posicion al inicio del tramo
-        x1: posición al final del tramo
-        v0: velocidad al inicio del tramo
-        v1: velocidad al final del tramo
-        t: tiempo entre t0 y t1 en el que queremos la posición
+        t0 (float o array): inicio del tramo
+        t1 (float o array): fin del tramo
+        x0 (float o array): posicion al inicio del tramo
+        x1 (float o array): posición al final del tramo
+        v0 (float o array): velocidad al inicio del tramo
+        v1 (float o array): velocidad al final del tramo
+        t (float o array): tiempo entre t0 y t1 en el que queremos la posición
 
     Returns:
-        pos: Estimación de la posición en el tiempo t.
+        pos (float o array): Estimación de la posición en el tiempo t.
 
     """
     # Calcula la duración del tramo
@@ -59,11 +64,16 @@ def interpola_hermite(t0, t1, x0, x1, v0, v1, t):
     # Calcula la proporción de tiempo transcurrido entre t0 y t1 en el tiempo t.
     u = (t - t0) / duracion
 
+    # Potencias de u calculadas con productos (la potencia de NumPy sobre arrays puede diferir
+    # en el último bit de la potencia escalar de Python)
+    u2 = u * u
+    u3 = u2 * u
+
     # Calculo de los coeficientes del polinomio de Hermite
-    H00 = 2 * u**3 - 3 * u**2 + 1
-    H10 = u**3 - 2 * u**2 + u
-    H01 = -2 * u**3 + 3 * u**2
-    H11 = u**3 - u**2
+    H00 = 2 * u3 - 3 * u2 + 1
+    H10 = u3 - 2 * u2 + u
+    H01 = -2 * u3 + 3 * u2
+    H11 = u3 - u2
 
     # Aplicamos el polinomio de Hermite para obtener una estimación de la posición dado el tiempo
     pos = x0 * H00 + x1 * H01 + v0 * H10 + v1 * H11
@@ -79,6 +89,8 @@ def interpola_catmull_rom(tau, t1, t2, x0, x1, x2, x3, t):
     a medida que el valor de tau aumenta, la suavidad de las curvas se incrementa, 
     mientras que un valor menor de tau resulta en curvas más abruptas.
 
+    Todos los argumentos salvo tau pueden ser arrays de NumPy.
+
     Args:
         tau: Parámetro que marca la tensión del tramo (tau > 0.5 aporta i)
         t0: tiempo del primer punto de control
@@ -104,21 +116,203 @@ def interpola_catmull_rom(tau, t1, t2, x0, x1, x2, x3, t):
 
     return pos
 
-# Casos de prueba para interpola_lineal
-print(interpola_lineal(0, 1, 0, 1, 0.5))  # Debería imprimir 0.5
-print(interpola_lineal(0, 2, 0, 1, 1))    # Debería imprimir 0.5
-print(interpola_lineal(1, 2, 1, 2, 1.5))  # Debería imprimir 1.5
 
-# Casos de prueba para interpola_hermite
-print(interpola_hermite(0, 1, 0, 1, 0, 0, 0.5))  # Debería imprimir 0.5
-print(interpola_hermite(0, 2, 0, 1, 0, 0, 1))    # Debería imprimir 0.5
-print(interpola_hermite(1, 2, 1, 2, 1, 1, 1.5))  # Debería imprimir 1.5
+def interpola_tramos(metodo, tiempos, valores, a, i, n, t, velocidades=None, tau=0.0):
+    """
+    Evalúa de una sola vez muchos tramos de una o varias curvas guardadas de forma consecutiva en los
+    arrays de tiempos y valores. Cada tramo está formado por el fotograma clave a y el siguiente (a + 1).
+    En Catmull-Rom, los puntos de control que no existen en la curva del tramo se sustituyen por el
+    anterior o el siguiente, como en get_posicion.
+
+    Args:
+        metodo: Método de interpolación ('LINEAL', 'HERMITE' o 'CATMULL')
+        tiempos (array): tiempos de los fotogramas clave
+        valores (array): valores de los fotogramas clave
+        a (array): índice en los arrays del fotograma clave al inicio de cada tramo
+        i (array): índice del fotograma clave al final de cada tramo dentro de su curva (entre 1 y n-1)
+        n (int o array): número de fotogramas clave de la curva de cada tramo
+        t (array): tiempo en el que se evalúa cada tramo
+        velocidades (array): velocidades de los fotogramas clave (solo Hermite)
+        tau: tensión de la curva (solo Catmull-Rom)
+
+    Returns:
+        pos (array): Estimación de la posición en cada tramo.
+    """
+    b = a + 1
+    if metodo == 'CATMULL':
+        previo, siguiente = vecinos_catmull_rom(valores, a, i, n)
+        return interpola_catmull_rom(tau, tiempos[a], tiempos[b], previo, valores[a], valores[b], siguiente, t)
+    elif metodo == 'HERMITE':
+        return interpola_hermite(tiempos[a], tiempos[b], valores[a], valores[b], velocidades[a], velocidades[b], t)
+    return interpola_lineal(tiempos[a], tiempos[b], valores[a], valores[b], t)
+
+
+def vecinos_catmull_rom(valores, a, i, n):
+    """
+    Obtiene los puntos de control exteriores de los tramos Catmull-Rom: el fotograma anterior al inicio
+    del tramo y el posterior al final. Si no existen en la curva del tramo se repite el anterior o el
+    siguiente, con los mismos casos que get_posicion.
+
+    Args:
+        valores (array): valores de los fotogramas clave
+        a (array): índice en el array del fotograma clave al inicio de cada tramo
+        i (array): índice del fotograma clave al final de cada tramo dentro de su curva
+        n (int o array): número de fotogramas clave de la curva de cada tramo
+
+    Returns:
+        previo (array): valor del punto de control anterior de cada tramo
+        siguiente (array): valor del punto de control posterior de cada tramo
+    """
+    b = a + 1
+    ultimo = len(valores) - 1
+    # Fotograma anterior del anterior (o el anterior si no existe)
+    previo = np.where(i < 2, valores[a], valores[np.maximum(a - 1, 0)])
+    # Fotograma siguiente del siguiente (o el siguiente si no existe)
+    siguiente = np.where((i < 2) & (n > 2), valores[np.minimum(b + 1, ultimo)],
+                         np.where(i > n - 3, valores[b], valores[np.minimum(b + 1, ultimo)]))
+    return previo, siguiente
+
+
+def coeficientes_tramos(metodo, valores, a, i, n, velocidades=None, tau=0.0):
+    """
+    Convierte cada tramo en los coeficientes de su polinomio cúbico en la base de potencias del parámetro
+    normalizado u = (t - t0) / (t1 - t0), con la tensión y el tratamiento de los extremos ya aplicados:
+
+        pos(u) = c0 + c1*u + c2*u^2 + c3*u^3
+
+    Los coeficientes se calculan una sola vez por tramo y después cada evaluación es un único paso de Horner
+    (evalua_polinomio).
+
+    Args:
+        metodo: Método de interpolación ('LINEAL', 'HERMITE' o 'CATMULL')
+        valores (array): valores de los fotogramas clave
+        a (array): índice en el array del fotograma clave al inicio de cada tramo
+        i (array): índice del fotograma clave al final de cada tramo dentro de su curva
+        n (int o array): número de fotogramas clave de la curva de cada tramo
+        velocidades (array): velocidades de los fotogramas clave (solo Hermite)
+        tau: tensión de la curva (solo Catmull-Rom)
+
+    Returns:
+        coef (array): Array (m, 4) con los coeficientes c0, c1, c2 y c3 de cada tramo
+    """
+    b = a + 1
+    x0 = valores[a]
+    x1 = valores[b]
+    coef = np.zeros((len(x0), 4), dtype=np.float64)
+    coef[:, 0] = x0
+    if metodo == 'LINEAL':
+        coef[:, 1] = x1 - x0
+        return coef
+
+    # Velocidades al inicio y al final de cada tramo
+    if metodo == 'CATMULL':
+        previo, siguiente = vecinos_catmull_rom(valores, a, i, n)
+        v0 = tau * (x1 - previo)
+        v1 = tau * (siguiente - x0)
+    else:
+        v0 = velocidades[a]
+        v1 = velocidades[b]
+
+    # Base de Hermite expresada en potencias de u
+    coef[:, 1] = v0
+    coef[:, 2] = -3 * x0 + 3 * x1 - 2 * v0 - v1
+    coef[:, 3] = 2 * x0 - 2 * x1 + v0 + v1
+    return coef
+
+
+def coeficientes_curva(metodo, valores, velocidades=None, tau=0.0):
+    """
+    Calcula los coeficientes de todos los tramos de una curva. La fila k contiene el tramo entre los
+    fotogramas clave k y k+1; la última fila es el valor constante del último fotograma clave, de forma
+    que el array tiene una fila por fotograma clave.
+
+    Args:
+        metodo: Método de interpolación ('LINEAL', 'HERMITE' o 'CATMULL')
+        valores (array): valores de los fotogramas clave
+        velocidades (array): velocidades de los fotogramas clave (solo Hermite)
+        tau: tensión de la curva (solo Catmull-Rom)
+
+    Returns:
+        coef (array): Array (n, 4) de coeficientes
+    """
+    valores = np.asarray(valores, dtype=np.float64)
+    n = len(valores)
+    coef = np.zeros((n, 4), dtype=np.float64)
+    if n > 1:
+        a = np.arange(n - 1)
+        coef[:-1] = coeficientes_tramos(metodo, valores, a, a + 1, n, velocidades, tau)
+    if n > 0:
+        coef[-1, 0] = valores[-1]
+    return coef
+
+
+def evalua_polinomio(coef, t0, t1, t):
+    """
+    Evalúa con el método de Horner el polinomio cúbico de uno o varios tramos.
+
+    Args:
+        coef (array): coeficientes c0, c1, c2 y c3 de los tramos (último eje de tamaño 4)
+        t0 (float o array): inicio de los tramos
+        t1 (float o array): fin de los tramos
+        t (float o array): tiempo en el que se evalúa cada tramo
+
+    Returns:
+        pos (float o array): Estimación de la posición en el tiempo t.
+    """
+    u = (t - t0) / (t1 - t0)
+    return coef[..., 0] + u * (coef[..., 1] + u * (coef[..., 2] + u * coef[..., 3]))
+
+
+def interpola_curva(metodo, tiempos, valores, t, velocidades=None, tau=0.0):
+    """
+    Evalúa una curva definida por sus fotogramas clave en un array de tiempos, con el mismo tratamiento
+    de los extremos que get_posicion: antes del primer fotograma clave se toma su valor, después del
+    último se toma el valor del último y en Catmull-Rom se repiten los puntos de control que no existen.
+
+    Args:
+        metodo: Método de interpolación ('LINEAL', 'HERMITE' o 'CATMULL')
+        tiempos (array): tiempos de los fotogramas clave (ordenados)
+        valores (array): valores de los fotogramas clave
+        t (float o array): tiempos en los que se evalúa la curva
+        velocidades (array): velocidades de los fotogramas clave (solo Hermite)
+        tau: tensión de la curva (solo Catmull-Rom)
+
+    Returns:
+        pos (array): Estimación de la posición en cada tiempo de t.
+    """
+    tiempos = np.asarray(tiempos, dtype=np.float64)
+    valores = np.asarray(valores, dtype=np.float64)
+    if velocidades is not None:
+        velocidades = np.asarray(velocidades, dtype=np.float64)
+    t = np.asarray(t, dtype=np.float64)
+    n = len(valores)
+
+    # Búsqueda binaria del par de fotogramas clave entre los que se encuentra cada tiempo
+    i = np.searchsorted(tiempos, t, side='left')
+    pos = np.where(i <= 0, valores[0], valores[n - 1])
+    tramo = (i > 0) & (i < n)
+    if not tramo.any():
+        return pos
+
+    pos[tramo] = interpola_tramos(metodo, tiempos, valores, i[tramo] - 1, i[tramo], n, t[tramo], velocidades, tau)
+    return pos
+
+if __name__ == "__main__":
+    # Casos de prueba para interpola_lineal
+    print(interpola_lineal(0, 1, 0, 1, 0.5))  # Debería imprimir 0.5
+    print(interpola_lineal(0, 2, 0, 1, 1))    # Debería imprimir 0.5
+    print(interpola_lineal(1, 2, 1, 2, 1.5))  # Debería imprimir 1.5
+
+    # Casos de prueba para interpola_hermite
+    print(interpola_hermite(0, 1, 0, 1, 0, 0, 0.5))  # Debería imprimir 0.5
+    print(interpola_hermite(0, 2, 0, 1, 0, 0, 1))    # Debería imprimir 0.5
+    print(interpola_hermite(1, 2, 1, 2, 1, 1, 1.5))  # Debería imprimir 1.5
 
-# Casos de prueba para interpola_catmull_rom
-# Debería imprimir un valor entre 1 y 2
-print(interpola_catmull_rom(0.5, 0, 1, 0, 1, 2, 3, 0.5))
-# Debería imprimir un valor entre 2 y 3
-print(interpola_catmull_rom(0.5, 1, 2, 1, 2, 3, 4, 1.5))
-print(interpola_catmull_rom(0.5, 0, 2, 0, 1, 2, 3, 1))    # Debería imprimir 1.0
+    # Casos de prueba para interpola_catmull_rom
+    # Debería imprimir un valor entre 1 y 2
+    print(interpola_catmull_rom(0.5, 0, 1, 0, 1, 2, 3, 0.5))
+    # Debería imprimir un valor entre 2 y 3
+    print(interpola_catmull_rom(0.5, 1, 2, 1, 2, 3, 4, 1.5))
+    print(interpola_catmull_rom(0.5, 0, 2, 0, 1, 2, 3, 1))    # Debería imprimir 1.0
 
-print(interpola_lineal(0, 1.5, 0, 3, 0.5))
\ No newline at end of file
+    print(interpola_lineal(0, 1.5, 0, 3, 0.5))
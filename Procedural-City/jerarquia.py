@@ -0,0 +1,66 @@
+# Autores: Alberto Jativa, Jordi Beltran, Carlos Izquierdo, Enrique Alcover
+# version ='1.0'
+# -------------------------------------------------------------------------------
+""" Script que contiene las funciones para enlazar objetos a colecciones y a sus padres sin operadores"""
+# -------------------------------------------------------------------------------
+# Imports
+# -------------------------------------------------------------------------------
+import bpy
+# -------------------------------------------------------------------------------
+
+def matriz_mundo(obj):
+    """
+    Calcula la matriz de transformación global de un objeto a partir de sus propiedades y las de sus padres.
+    No se usa matrix_world porque en los objetos recién creados no se actualiza hasta que se evalúa la escena.
+    Args:
+        obj (Object): Objeto
+    Returns:
+        matriz (Matrix): Matriz de transformación global del objeto
+    """
+    if obj.parent is None:
+        return obj.matrix_basis.copy()
+    return matriz_mundo(obj.parent) @ obj.matrix_parent_inverse @ obj.matrix_basis
+
+def emparenta(obj, padre):
+    """
+    Asigna el padre de un objeto conservando su posición en la escena, igual que
+    bpy.ops.object.parent_set(type='OBJECT', keep_transform=True) pero sin cambiar la selección ni el objeto
+    activo.
+    Args:
+        obj (Object): Objeto hijo
+        padre (Object): Objeto padre
+    """
+    # Con la inversa de la matriz del padre como matrix_parent_inverse, la matriz global del hijo es su
+    # matrix_basis, que toma el valor de la matriz global que tenía antes de asignar el padre
+    mundo = matriz_mundo(obj)
+    obj.parent = padre
+    obj.matrix_parent_inverse = matriz_mundo(padre).inverted_safe()
+    obj.matrix_basis = mundo
+
+def enlaza(obj, coleccion):
+    """
+    Enlaza un objeto a una colección y lo desenlaza del resto de colecciones en las que estuviera.
+    Args:
+        obj (Object): Objeto
+        coleccion (Collection): Colección de destino
+    """
+    for anterior in list(obj.users_collection):
+        if anterior != coleccion:
+            anterior.objects.unlink(obj)
+    if coleccion not in obj.users_collection:
+        coleccion.objects.link(obj)
+
+def crea_vacio(nombre, coleccion, location=(0, 0, 0)):
+    """
+    Crea un objeto vacío directamente en una colección, sin bpy.ops.object.empty_add.
+    Args:
+        nombre (String): Nombre del objeto
+        coleccion (Collection): Colección a la que se enlaza
+        location (List): Posición del objeto
+    Returns:
+        obj (Object): Objeto vacío creado
+    """
+    obj = bpy.data.objects.new(nombre, None)
+    obj.location = location
+    coleccion.objects.link(obj)
+    return obj
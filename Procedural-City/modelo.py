@@ -0,0 +1,167 @@
+# Autores: Alberto Jativa, Jordi Beltran, Carlos Izquierdo, Enrique Alcover
+# version ='1.0'
+# -------------------------------------------------------------------------------
+""" Script que contiene la caché de la malla del modelo de los vehiculos"""
+# -------------------------------------------------------------------------------
+# Imports
+# -------------------------------------------------------------------------------
+import os
+
+import bpy
+import numpy as np
+
+from tiempos import medido
+# -------------------------------------------------------------------------------
+
+def firma_modelo(ruta):
+    """
+    Función que obtiene el valor que identifica el fichero del modelo: su ruta absoluta y su fecha de
+    modificación (si se modifica el fichero se vuelve a importar).
+    Args:
+        ruta (String): Ruta del fichero .obj
+    Returns:
+        firma (tuple): Ruta absoluta y fecha de modificación del fichero
+    """
+    ruta = os.path.abspath(ruta)
+    return (ruta, os.path.getmtime(ruta))
+
+def firma_malla(mesh):
+    """
+    Función que obtiene el valor que identifica el fichero del que se importó una malla del modelo (ver
+    obtener_malla), por ejemplo para formar la clave de la flota en la caché en disco.
+    Args:
+        mesh (Mesh): Malla del modelo
+    Returns:
+        firma (tuple): Ruta absoluta y fecha de modificación del fichero (None si no se conocen)
+    """
+    return (mesh.get('modelo_ruta'), mesh.get('modelo_mtime'))
+
+def lee_obj(ruta):
+    """
+    Lector de ficheros .obj con NumPy, sin utilizar el importador de Blender. Lee los vértices, las caras
+    (solo los índices de los vértices, admitiendo índices negativos) y los materiales de las caras. Los
+    ejes no se convierten, igual que al importar con axis_forward='-Y' y axis_up='Z'.
+    Args:
+        ruta (String): Ruta del fichero .obj
+    Returns:
+        vertices (array): Array (n, 3) con las coordenadas de los vértices
+        bucles (array): Índices de los vértices de todas las caras, concatenados
+        total (array): Número de vértices de cada cara
+        indices_material (array): Índice del material de cada cara
+        materiales (List): Nombres de los materiales (usemtl) en orden de aparición
+    """
+    vertices = []
+    bucles = []
+    total = []
+    indices_material = []
+    materiales = []
+    actual = 0
+
+    with open(ruta, encoding='utf-8', errors='replace') as fichero:
+        for linea in fichero:
+            if linea.startswith('v '):
+                vertices.append(linea.split()[1:4])
+            elif linea.startswith('f '):
+                n = len(vertices)
+                cara = [int(token.split('/')[0]) for token in linea.split()[1:]]
+                bucles.extend(i - 1 if i > 0 else n + i for i in cara)
+                total.append(len(cara))
+                indices_material.append(actual)
+            elif linea.startswith('usemtl'):
+                nombre = linea[6:].strip()
+                if nombre not in materiales:
+                    materiales.append(nombre)
+                actual = materiales.index(nombre)
+
+    return (np.array(vertices, dtype=np.float32).reshape(-1, 3), np.array(bucles, dtype=np.int32),
+            np.array(total, dtype=np.int32), np.array(indices_material, dtype=np.int32), materiales)
+
+@medido
+def crea_malla_obj(ruta, nombre):
+    """
+    Función que crea una malla a partir de un fichero .obj leído con lee_obj, escribiendo los arrays con
+    foreach_set. Los materiales se buscan por nombre en el fichero y se crean si no existen.
+    Args:
+        ruta (String): Ruta del fichero .obj
+        nombre (String): Nombre de la malla
+    Returns:
+        mesh (Mesh): Malla creada
+    """
+    vertices, bucles, total, indices_material, materiales = lee_obj(ruta)
+
+    mesh = bpy.data.meshes.new(nombre)
+    mesh.vertices.add(len(vertices))
+    mesh.vertices.foreach_set('co', vertices.ravel())
+    mesh.loops.add(len(bucles))
+    mesh.loops.foreach_set('vertex_index', bucles)
+    mesh.polygons.add(len(total))
+    mesh.polygons.foreach_set('loop_start', (np.cumsum(total) - total).astype(np.int32))
+    mesh.polygons.foreach_set('loop_total', total)
+
+    for material in materiales:
+        mesh.materials.append(bpy.data.materials.get(material) or bpy.data.materials.new(material))
+    if len(materiales) > 0:
+        mesh.polygons.foreach_set('material_index', indices_material)
+
+    mesh.update(calc_edges=True)
+    mesh.validate()
+    return mesh
+
+@medido
+def importa_malla(ruta, nombre):
+    """
+    Función que importa la malla de un fichero .obj con el importador de Blender y elimina los objetos
+    importados, junto con las mallas y los materiales creados por el importador que no utiliza la malla
+    devuelta. Si el importador no está disponible (se eliminó en versiones recientes de Blender) se lee
+    el fichero con crea_malla_obj.
+    Args:
+        ruta (String): Ruta del fichero .obj
+        nombre (String): Nombre de la malla
+    Returns:
+        mesh (Mesh): Malla importada
+    """
+    mallas_previas = set(bpy.data.meshes)
+    materiales_previos = set(bpy.data.materials)
+    try:
+        bpy.ops.import_scene.obj(filepath=ruta, axis_forward='-Y', axis_up='Z')
+    except (AttributeError, RuntimeError):
+        return crea_malla_obj(ruta, nombre)
+
+    importados = list(bpy.context.selected_objects)
+    mesh = importados[0].data if importados and importados[0].type == 'MESH' else None
+    if importados:
+        bpy.data.batch_remove(importados)
+
+    # Datos creados por el importador que no forman parte de la malla que se conserva
+    conservados = {mesh} | set(mesh.materials) if mesh is not None else set()
+    sobrantes = [dato for dato in set(bpy.data.meshes) - mallas_previas if dato not in conservados]
+    sobrantes += [dato for dato in set(bpy.data.materials) - materiales_previos if dato not in conservados]
+    if sobrantes:
+        bpy.data.batch_remove(sobrantes)
+
+    if mesh is None:
+        return crea_malla_obj(ruta, nombre)
+    mesh.name = nombre
+    return mesh
+
+@medido
+def obtener_malla(ruta):
+    """
+    Devuelve la malla del modelo de los vehículos. La malla se guarda como un dato persistente (con usuario
+    falso) identificado por la ruta y la fecha de modificación del fichero, de forma que solo se importa
+    la primera vez o cuando cambia el fichero.
+    Args:
+        ruta (String): Ruta del fichero .obj
+    Returns:
+        mesh (Mesh): Malla del modelo
+    """
+    ruta, mtime = firma_modelo(ruta)
+    for mesh in bpy.data.meshes:
+        if mesh.get('modelo_ruta') == ruta and mesh.get('modelo_mtime') == mtime:
+            return mesh
+
+    mesh = importa_malla(ruta, 'ModeloCoche')
+    mesh['modelo_ruta'] = ruta
+    mesh['modelo_mtime'] = mtime
+    mesh.use_fake_user = True
+    return mesh
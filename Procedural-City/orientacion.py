@@ -0,0 +1,170 @@
+# Autores: Alberto Jativa, Jordi Beltran
+# version ='1.0'
+# --------------------------------------------------------------------------------------
+""" Script que contiene el cálculo vectorizado de la orientación de los vehiculos """
+# --------------------------------------------------------------------------------------
+# Imports
+# --------------------------------------------------------------------------------------
+import numpy as np
+# --------------------------------------------------------------------------------------
+
+def normaliza(v):
+    """
+    Normaliza un array de vectores. Los vectores nulos se mantienen nulos (como en mathutils).
+    Args:
+        v (array): Array (n, 3) de vectores
+    Returns:
+        v (array): Array (n, 3) de vectores normalizados
+    """
+    norma = np.linalg.norm(v, axis=-1, keepdims=True)
+    return np.divide(v, norma, out=np.zeros_like(v), where=norma > 1.0e-35)
+
+def cuaternion_eje_angulo(eje, angulo):
+    """
+    Calcula los cuaterniones (w, x, y, z) de rotación de un ángulo alrededor de un eje.
+    Si el eje es nulo se devuelve el cuaternion identidad (como en mathutils).
+    Args:
+        eje (array): Array (n, 3) de ejes de rotación
+        angulo (array): Array (n,) de ángulos en radianes
+    Returns:
+        q (array): Array (n, 4) de cuaterniones
+    """
+    eje = np.broadcast_to(eje, np.broadcast_shapes(np.shape(eje), np.shape(angulo) + (3,)))
+    angulo = np.broadcast_to(angulo, eje.shape[:-1])
+    norma = np.linalg.norm(eje, axis=-1)
+    unitario = normaliza(eje)
+    q = np.empty(eje.shape[:-1] + (4,), dtype=np.float64)
+    q[..., 0] = np.cos(angulo / 2)
+    q[..., 1:] = np.sin(angulo / 2)[..., None] * unitario
+    q[norma <= 1.0e-35] = (1.0, 0.0, 0.0, 0.0)
+    return q
+
+def multiplica(q1, q2):
+    """
+    Producto de cuaterniones q1 @ q2 (aplica primero q2 y después q1).
+    Args:
+        q1 (array): Array (n, 4) de cuaterniones
+        q2 (array): Array (n, 4) de cuaterniones
+    Returns:
+        q (array): Array (n, 4) con el producto
+    """
+    w1, x1, y1, z1 = np.moveaxis(np.asarray(q1), -1, 0)
+    w2, x2, y2, z2 = np.moveaxis(np.asarray(q2), -1, 0)
+    return np.stack([w1*w2 - x1*x2 - y1*y2 - z1*z2,
+                     w1*x2 + x1*w2 + y1*z2 - z1*y2,
+                     w1*y2 - x1*z2 + y1*w2 + z1*x2,
+                     w1*z2 + x1*y2 - y1*x2 + z1*w2], axis=-1)
+
+def rota(q, v):
+    """
+    Rota un array de vectores con un array de cuaterniones.
+    Args:
+        q (array): Array (n, 4) de cuaterniones
+        v (array): Array (n, 3) de vectores
+    Returns:
+        v (array): Array (n, 3) de vectores rotados
+    """
+    w = q[..., :1]
+    u = q[..., 1:]
+    c = np.cross(u, v) + w * v
+    return v + 2 * np.cross(u, c)
+
+def euler_xyz(q):
+    """
+    Convierte un array de cuaterniones en ángulos de Euler en el orden XYZ (el orden por defecto de
+    rotation_euler en Blender).
+    Args:
+        q (array): Array (n, 4) de cuaterniones
+    Returns:
+        euler (array): Array (n, 3) con los ángulos en radianes
+    """
+    w, x, y, z = np.moveaxis(q / np.linalg.norm(q, axis=-1, keepdims=True), -1, 0)
+    return np.stack([np.arctan2(2*(w*x + y*z), 1 - 2*(x*x + y*y)),
+                     np.arcsin(np.clip(2*(w*y - z*x), -1, 1)),
+                     np.arctan2(2*(w*z + x*y), 1 - 2*(y*y + z*z))], axis=-1)
+
+def cuaternion_entre(e, t):
+    """
+    Versión vectorizada de get_quat_from_vecs: cuaterniones que alinean los vectores e y t.
+    Args:
+        e (array): Vectores directores
+        t (array): Vectores tangentes
+    Returns:
+        q (array): Array (n, 4) de cuaterniones
+    """
+    eje = normaliza(np.cross(e, t))
+    angulo = np.arccos(np.clip(np.sum(e * t, axis=-1), -1, 1))
+    return cuaternion_eje_angulo(eje, angulo)
+
+def vector_lateral(t):
+    """
+    Versión vectorizada de get_lat_vec: vectores laterales de las tangentes t.
+    Args:
+        t (array): Array (n, 3) de vectores tangentes
+    Returns:
+        l (array): Array (n, 3) de vectores laterales
+    """
+    return normaliza(np.cross(np.array([0.0, 0.0, 1.0]), t))
+
+def angulo_alabeo(t, t_anterior):
+    """
+    Versión vectorizada de get_angulo_alabeo.
+    Args:
+        t (array): Array (n, 3) de vectores tangentes
+        t_anterior (array): Array (n, 3) de vectores tangentes anteriores
+    Returns:
+        angulo (array): Array (n,) de ángulos de alabeo en radianes
+    """
+    l = vector_lateral(t)
+    deltaT = 1 / 24
+    n = (t - t_anterior) / deltaT
+    angulo = np.linalg.norm(n, axis=-1)
+    angulo = np.where(np.sum(l * normaliza(n), axis=-1) > 0, -angulo, angulo)
+    return np.radians(np.clip(angulo, -45, 45))
+
+def orientaciones(v0, v1, director, corregir_y, alabeo, t_anterior):
+    """
+    Versión vectorizada de calcula_orientacion para un conjunto de vehículos: calcula la orientación
+    a partir de las posiciones anterior (v0) y actual (v1) de cada vehículo.
+    Args:
+        v0 (array): Array (n, 3) de posiciones anteriores
+        v1 (array): Array (n, 3) de posiciones actuales
+        director (array): Vector director inicial de los vehículos
+        corregir_y (bool): Si se aplica la corrección del eje y (sin desplazamiento vertical)
+        alabeo (array): Array (n,) de booleanos que indica los vehículos con alabeo
+        t_anterior (array): Array (n, 3) de vectores tangentes anteriores (sin normalizar)
+    Returns:
+        tangente (array): Array (n, 3) de vectores tangentes normalizados
+        q (array): Array (n, 4) de cuaterniones (w, x, y, z)
+        angulos (array): Array (n,) de ángulos de alabeo aplicados en radianes
+    """
+    tangente = normaliza(np.asarray(v1, dtype=np.float64) - v0)
+    e = np.broadcast_to(np.asarray(director, dtype=np.float64), tangente.shape)
+
+    # Alineación con el tangente y ajuste de la dirección lateral
+    q_alineacion = cuaternion_entre(e, tangente)
+    el = rota(q_alineacion, vector_lateral(e))
+    q_rot = cuaternion_entre(el, vector_lateral(tangente))
+    q = multiplica(q_rot, q_alineacion)
+
+    # Corrección para que el eje z sea siempre positivo
+    z = rota(q, np.broadcast_to(np.array([0.0, 0.0, 1.0]), tangente.shape))
+    invertidos = z[:, 2] < 0
+    if invertidos.any():
+        q180z = cuaternion_eje_angulo(np.array([0.0, 1.0, 0.0]), np.radians(180))
+        q[invertidos] = multiplica(q[invertidos], q180z)
+
+    # Corrección para que el eje y este alineado
+    if corregir_y:
+        invertidos = tangente[:, 1] == -1
+        if invertidos.any():
+            q180y = cuaternion_eje_angulo(np.array([0.0, 0.0, 1.0]), np.radians(180))
+            q[invertidos] = multiplica(q180y, q[invertidos])
+
+    # Aplicación del alabeo
+    angulos = np.zeros(len(tangente))
+    alabeo = np.asarray(alabeo, dtype=bool)
+    if alabeo.any():
+        angulos[alabeo] = angulo_alabeo(tangente[alabeo], np.asarray(t_anterior)[alabeo])
+        q[alabeo] = multiplica(cuaternion_eje_angulo(tangente[alabeo], angulos[alabeo]), q[alabeo])
+    return tangente, q, angulos
@@ -0,0 +1,71 @@
+# Autores: Alberto Jativa, Jordi Beltran, Carlos Izquierdo, Enrique Alcover
+# version ='1.0'
+# -------------------------------------------------------------------------------
+""" Script que contiene las funciones para ejecutar la generación por pasos (sin bloquear la interfaz)"""
+# -------------------------------------------------------------------------------
+# Imports
+# -------------------------------------------------------------------------------
+import time
+# -------------------------------------------------------------------------------
+
+# Las etapas largas de la generación (p. ej. CreateCityPasos) son generadores de pasos: hacen un lote de
+# trabajo, devuelven con yield el avance de la etapa (entre 0 y 1) y esperan a que se les pida el siguiente
+# lote. Al terminar pueden devolver un valor con return. Las funciones de este script los ejecutan de una
+# sola vez, los combinan en un avance global o los avanzan durante un tiempo máximo (en el operador modal)
+
+def agota(pasos):
+    """
+    Función que ejecuta todos los pasos de un generador de una sola vez.
+    Args:
+        pasos (Generator): Generador de pasos
+    Returns:
+        valor: Valor devuelto por el generador al terminar
+    """
+    while True:
+        try:
+            next(pasos)
+        except StopIteration as final:
+            return final.value
+
+def escala(pasos, inicio, fin):
+    """
+    Generador que ejecuta los pasos de otro generador y convierte su avance (entre 0 y 1) al intervalo
+    [inicio, fin], para incluir una etapa en el avance de otra mayor. Si se cierra (p. ej. al cancelar la
+    generación), también se cierra el generador de la etapa.
+    Args:
+        pasos (Generator): Generador de pasos de la etapa
+        inicio (float): Avance global al empezar la etapa
+        fin (float): Avance global al terminar la etapa
+    Returns:
+        valor: Valor devuelto por el generador de la etapa al terminar
+    """
+    try:
+        while True:
+            try:
+                avance = next(pasos)
+            except StopIteration as final:
+                return final.value
+            yield inicio + (fin - inicio) * avance
+    finally:
+        pasos.close()
+
+def avanza(pasos, presupuesto):
+    """
+    Función que ejecuta pasos de un generador hasta que termina o se supera un tiempo máximo. Un paso no se
+    interrumpe, por lo que el tiempo máximo se puede superar en la duración de un paso.
+    Args:
+        pasos (Generator): Generador de pasos
+        presupuesto (float): Tiempo máximo en segundos
+    Returns:
+        terminado (bool): Si el generador ha terminado
+        avance: Último valor devuelto por el generador (None si no ha devuelto ninguno)
+    """
+    limite = time.perf_counter() + presupuesto
+    avance = None
+    while True:
+        try:
+            avance = next(pasos)
+        except StopIteration:
+            return True, avance
+        if time.perf_counter() >= limite:
+            return False, avance
@@ -0,0 +1,131 @@
+# Autores: Alberto Jativa, Jordi Beltran, Carlos Izquierdo, Enrique Alcover
+# version ='1.0'
+# -------------------------------------------------------------------------------
+""" Script que contiene el perfilador de los drivers de los vehiculos durante la reproducción"""
+# -------------------------------------------------------------------------------
+# Imports
+# -------------------------------------------------------------------------------
+import csv
+
+import numpy as np
+# -------------------------------------------------------------------------------
+
+class PerfilDrivers:
+    """
+    Estadísticas de las llamadas a los drivers de los vehículos: número de llamadas y tiempos de cada vehículo
+    y canal (p. ej. 'location[0]'), aciertos de la memoria de poses y aciertos y fallos de las cachés.
+    """
+
+    # Cachés cuyos aciertos y fallos se cuentan
+    CACHES = ('poses', 'trayectorias', 'distancias')
+
+    def __init__(self):
+        self.reinicia()
+
+    def reinicia(self):
+        """
+        Descarta todas las estadísticas recogidas.
+        """
+        self.tiempos = {}
+        self.aciertos_memo = {}
+        self.atributos = {}
+        self.fotogramas = set()
+        self.cache = {nombre: [0, 0] for nombre in self.CACHES}
+
+    def registra(self, coche, canal, frame, duracion, acierto_memo):
+        """
+        Registra una llamada a un driver.
+        Args:
+            coche (String): Nombre del vehículo
+            canal (String): Canal animado por el driver
+            frame (float): Fotograma evaluado
+            duracion (float): Duración de la llamada en segundos
+            acierto_memo (bool): Si la pose ya estaba en la memoria de poses
+        """
+        clave = (coche, canal)
+        tiempos = self.tiempos.get(clave)
+        if tiempos is None:
+            tiempos = self.tiempos[clave] = []
+            self.aciertos_memo[clave] = 0
+        tiempos.append(duracion)
+        self.aciertos_memo[clave] += acierto_memo
+        self.fotogramas.add(frame)
+        self.cuenta('poses', acierto_memo)
+
+    def cuenta(self, cache, acierto):
+        """
+        Cuenta un acierto o un fallo de una caché.
+        Args:
+            cache (String): Nombre de la caché (ver CACHES)
+            acierto (bool): True si es un acierto y False si es un fallo
+        """
+        self.cache[cache][0 if acierto else 1] += 1
+
+    def tasa_aciertos(self, cache):
+        """
+        Devuelve la proporción de aciertos de una caché (None si no se ha consultado).
+        """
+        aciertos, fallos = self.cache[cache]
+        return aciertos / (aciertos + fallos) if aciertos + fallos else None
+
+    def filas(self):
+        """
+        Calcula las estadísticas de cada vehículo y canal, ordenadas de mayor a menor tiempo total.
+        Returns:
+            filas (List): Diccionarios con el vehículo, el canal, sus atributos (ver atributos), el número de
+                          llamadas, los aciertos de la memoria de poses y los tiempos total, medio, mediano,
+                          de los percentiles 95 y 99 y máximo
+        """
+        filas = []
+        for (coche, canal), tiempos in self.tiempos.items():
+            t = np.asarray(tiempos)
+            p50, p95, p99 = np.percentile(t, [50, 95, 99])
+            fila = {'coche': coche, 'canal': canal}
+            fila.update(self.atributos.get(coche, {}))
+            fila.update({'llamadas': len(t), 'aciertos_memo': self.aciertos_memo[(coche, canal)],
+                         'total': t.sum(), 'media': t.mean(), 'p50': p50, 'p95': p95, 'p99': p99, 'maximo': t.max()})
+            filas.append(fila)
+        filas.sort(key=lambda fila: fila['total'], reverse=True)
+        return filas
+
+    def por_coche(self):
+        """
+        Calcula el tiempo total y el número de llamadas de cada vehículo (todos sus canales).
+        Returns:
+            coches (List): Tuplas (vehículo, tiempo total, llamadas) ordenadas de mayor a menor tiempo
+        """
+        totales = {}
+        for (coche, canal), tiempos in self.tiempos.items():
+            total, llamadas = totales.get(coche, (0.0, 0))
+            totales[coche] = (total + sum(tiempos), llamadas + len(tiempos))
+        return sorted(((coche, total, llamadas) for coche, (total, llamadas) in totales.items()),
+                      key=lambda fila: fila[1], reverse=True)
+
+    def totales(self):
+        """
+        Calcula el número total de llamadas y el tiempo total, y sus valores medios por fotograma.
+        Returns:
+            totales (dict): Fotogramas distintos evaluados, llamadas, tiempo total y valores por fotograma
+        """
+        llamadas = sum(len(tiempos) for tiempos in self.tiempos.values())
+        total = sum(sum(tiempos) for tiempos in self.tiempos.values())
+        n = max(len(self.fotogramas), 1)
+        return {'fotogramas': len(self.fotogramas), 'llamadas': llamadas, 'total': total,
+                'llamadas_fotograma': llamadas / n, 'tiempo_fotograma': total / n}
+
+    def escribe_csv(self, ruta):
+        """
+        Escribe las estadísticas de cada vehículo y canal en un fichero CSV (tiempos en microsegundos).
+        Args:
+            ruta (String): Ruta del fichero
+        """
+        tiempos = ('total', 'media', 'p50', 'p95', 'p99', 'maximo')
+        columnas = ['coche', 'canal', 'reparametrizado', 'alabeo', 'llamadas', 'aciertos_memo']
+        columnas += [nombre + '_us' for nombre in tiempos]
+        with open(ruta, 'w', newline='') as fichero:
+            escritor = csv.DictWriter(fichero, fieldnames=columnas, extrasaction='ignore')
+            escritor.writeheader()
+            for fila in self.filas():
+                escritor.writerow({nombre + '_us' if nombre in tiempos else nombre:
+                                   round(valor * 1e6, 3) if nombre in tiempos else valor
+                                   for nombre, valor in fila.items()})
@@ -0,0 +1,296 @@
+# Autores: Alberto Jativa, Jordi Beltran, Carlos Izquierdo, Enrique Alcover
+# version ='1.0'
+# -------------------------------------------------------------------------------
+""" Script que contiene el planificador de las rutas de los vehiculos de nuestra ciudad"""
+# -------------------------------------------------------------------------------
+# Imports
+# -------------------------------------------------------------------------------
+import random
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from trayectoria import Trayectoria, velocidades_manejadores
+# -------------------------------------------------------------------------------
+
+def planifica_ruta(pos_ini, start, v_coches, calles_x, calles_y, tam_manzana, tam_calles, origen_x,
+                   n_giros, A, freq, rng=random):
+    """
+    Función que calcula la ruta de un vehículo: la entrada en la ciudad, los giros aleatorios alternando
+    los ejes X e Y y el movimiento vertical. No modifica ningún objeto de Blender, sino que devuelve los
+    fotogramas clave de cada eje para que se escriban de una sola vez en las fcurves.
+
+    Si se añaden dos fotogramas clave de un eje en el mismo fotograma se conserva el último, igual que
+    al sustituir un fotograma clave con keyframe_insert.
+
+    Args:
+        pos_ini (List): Posición inicial del vehículo
+        start (int): Fotograma inicial de la animación
+        v_coches (float): Velocidad de los vehículos (calles por segundo)
+        calles_x (int): Número de calles en el eje X
+        calles_y (int): Número de calles en el eje Y
+        tam_manzana (float): Tamaño de las manzanas
+        tam_calles (float): Tamaño de las calles
+        origen_x (float): Coordenada X del origen de la ciudad (posición del cursor)
+        n_giros (int): Número de giros del vehículo
+        A (float): Amplitud del desplazamiento vertical
+        freq (float): Frecuencia del desplazamiento vertical
+        rng: Generador de números aleatorios con randint (por defecto el módulo random)
+
+    Returns:
+        claves (List): Para cada eje, una tupla (frames, valores) de arrays ordenados por fotograma
+    """
+    x, y, z = pos_ini
+    aux_z = z
+    claves = [{}, {}, {}]
+
+    def inserta(ejes, frame):
+        # Fotograma clave de los ejes indicados con la posición actual del vehículo
+        for eje in ejes:
+            claves[eje][frame] = (x, y, z)[eje]
+
+    # Si la frecuencia es distinta de 0 se calcula la cantidad de fotogramas que
+    # deben insertarse en la animación para completar un ciclo de movimiento en
+    # función de la frecuencia
+    if freq != 0:
+        paso_kf = int(24/freq)
+    else:
+        paso_kf = 0
+
+    # Creamos el primer fotograma de la escena
+    frm = start
+    inserta((0, 1), start)
+
+    pos_ini_x = x
+
+    # Calculamos el inicio y final de la ciudad en el eje X
+    ini_ciudad_x = origen_x - tam_calles/2
+    fin_ciudad_x = origen_x + ((calles_x + 1) * (tam_manzana + tam_calles))
+
+    # Si en el panel de las propiedades asignamos un numero de giros igual a 0, los coches se moverán en linea recta
+    if n_giros == 0:
+        #Los que están fuera de la ciudad que entren y la crucen por ambos lados (if y elif)
+        if pos_ini_x > fin_ciudad_x:
+            # Establecemos la posición final del vehiculo y calculamos el último fotograma de la animación
+            # usando la fórmula de la velocidad en el MRU (x/t)
+            x = pos_ini_x-(fin_ciudad_x - ini_ciudad_x)*1.25
+            frm += calles_x*1.25/v_coches*24
+            inserta((0,), frm)
+        elif pos_ini_x < ini_ciudad_x:
+            x = pos_ini_x+(fin_ciudad_x - ini_ciudad_x)*1.25
+            frm += calles_x*1.25/v_coches*24
+            inserta((0,), frm)
+        # Los que están dentro de la ciudad, que se muevan a uno de los lados
+        else:
+            # Decidir a que lado moverse de forma aleatoria
+            band = rng.randint(1, 2)
+            #Derecha
+            if band == 1:
+                x = pos_ini_x+(fin_ciudad_x - ini_ciudad_x)*1.25
+                frm += calles_x*1.25/v_coches*24
+                inserta((0,), frm)
+            #Izquierda (como en la versión original, no se inserta el fotograma clave final)
+            else:
+                x = pos_ini_x-(fin_ciudad_x - ini_ciudad_x)*1.25
+                frm += calles_x*1.25/v_coches*24
+
+    # Si el número de giros es distinto de 0, los coches se moveran realizando giros
+    else:
+        #Si no están dentro de la ciudad, les hacemos entrar antes de que giren
+        if ini_ciudad_x > pos_ini_x:
+            x = ini_ciudad_x
+            calles_recorridas = (ini_ciudad_x - pos_ini_x)/(tam_calles+tam_manzana)
+            frm += calles_recorridas / v_coches * 24
+            inserta((0, 1), frm)
+
+        if fin_ciudad_x < pos_ini_x:
+            x = fin_ciudad_x
+            calles_recorridas = (pos_ini_x - fin_ciudad_x)/(tam_calles+tam_manzana)
+            frm += calles_recorridas / v_coches * 24
+            inserta((0, 1), frm)
+
+        giro = 0    # Contador de giros
+
+        while(giro <= n_giros):
+            band = rng.randint(1, 2)      # bandera para decidir a que lado moverse de forma aleatoria
+
+            # Se alterna un giro en cada eje: X en los giros impares e Y en los pares
+            if giro%2!=0:
+                # Girar en una calle aleatoria
+                dist_rand = rng.randint(1, calles_x)
+                if band == 1:
+                    x += dist_rand*(tam_calles+tam_manzana)
+                else:
+                    x -= dist_rand*(tam_calles+tam_manzana)
+            else:
+                dist_rand = rng.randint(1, calles_y)
+                if band == 1:
+                    y += dist_rand*(tam_calles+tam_manzana)
+                else:
+                    y -= dist_rand*(tam_calles+tam_manzana)
+            frm += (dist_rand/v_coches)*24
+            inserta((0, 1), frm)
+            giro+=1
+
+    # Si el paso de keyframes y la frecuencia son distintos de cero, se producirá movimiento vertical (eje Z)
+    if paso_kf != 0 and freq !=0:
+        z = aux_z + A
+        for i in range(start, int(frm), paso_kf):
+            inserta((2,), i)
+        z = aux_z
+        for i in range(start+int(paso_kf/2), int(frm), paso_kf):
+            inserta((2,), i)
+    else:
+        inserta((2,), start)
+        inserta((2,), frm)
+
+    # Fotogramas clave de cada eje ordenados por fotograma
+    resultado = []
+    for eje in range(3):
+        frames = np.array(sorted(claves[eje]), dtype=np.float64)
+        valores = np.array([claves[eje][f] for f in frames.tolist()], dtype=np.float64)
+        resultado.append((frames, valores))
+    return resultado
+
+
+def semillas_coches(semilla, n):
+    """
+    Función que deriva de la semilla maestra una semilla independiente para cada vehículo, de forma que la
+    ruta de cada vehículo no depende del orden ni del proceso en que se genere.
+
+    Args:
+        semilla (int): Semilla maestra
+        n (int): Número de vehículos
+
+    Returns:
+        semillas (List): Semilla de cada vehículo
+    """
+    return [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(semilla).spawn(n)]
+
+
+def trayectoria_coche(claves):
+    """
+    Función que crea la trayectoria precompilada de un vehículo a partir de sus fotogramas clave, con los
+    mismos manejadores que calcula Blender al escribirlos en las fcurves.
+
+    Args:
+        claves (List): Para cada eje, una tupla (frames, valores) (ver planifica_ruta)
+
+    Returns:
+        tray (Trayectoria): Trayectoria precompilada del vehículo
+    """
+    return Trayectoria(None, [f for f, v in claves], [v for f, v in claves],
+                       [velocidades_manejadores(f, v) for f, v in claves])
+
+
+def genera_coche(semilla, parametros, n_materiales, distancias=True):
+    """
+    Función que genera un vehículo sin utilizar Blender: su posición inicial, su tamaño, su material, su ruta
+    y su curva de distancia recorrida. Se ejecuta en los procesos de genera_coches.
+
+    Args:
+        semilla (int): Semilla del vehículo
+        parametros (Parametros): Parámetros de la ciudad (ver core.Parametros)
+        n_materiales (int): Número de materiales disponibles para los vehículos
+        distancias (bool): Si es False no se calcula la curva de distancia recorrida ('frames' y 'distancias'
+                           son None), que no se utiliza en el modo de instancias
+
+    Returns:
+        coche (dict): Diccionario con la posición inicial ('pos_ini'), el tamaño ('tam_coche'), el índice del
+                      material ('material', -1 si no hay materiales), los fotogramas clave de cada eje
+                      ('claves') y la distancia recorrida ('frames' y 'distancias')
+    """
+    rng = random.Random(semilla)
+    calles_x = parametros.calles_x
+    calles_y = parametros.calles_y
+    tam_manzana = parametros.tam_manzana
+    tam_calles = parametros.tam_calles
+    p = parametros.origen
+
+    # Calculamos la posición inicial del coche, tamaño y altura de vuelo
+    calle_ini = rng.randint(-calles_y//4, calles_y+calles_y//2)
+    tam_coche = (tam_calles * 0.4) / 2
+    h_vuelo = rng.uniform(tam_coche / 2, parametros.alt_edificios_max)
+
+    if n_materiales > 0:
+        material = rng.randint(0, n_materiales-1)
+    else:
+        material = -1
+
+    rand_calle_ini = rng.randint(-calles_x//4, calles_x+calles_x//4)
+    pos_x = p[0]+(rand_calle_ini-1)*(tam_calles+tam_manzana)+(tam_calles/2+tam_manzana)
+    pos_ini = [pos_x, p[1] + (calle_ini - 0.5) * tam_calles + tam_manzana * calle_ini, p[2] + h_vuelo]
+
+    claves = planifica_ruta(pos_ini, parametros.frame_start, parametros.v_coches, calles_x, calles_y,
+                            tam_manzana, tam_calles, p[0], parametros.n_giros, parametros.a_desplazamiento,
+                            parametros.f_desplazamiento, rng)
+
+    # Las fcurves guardan los fotogramas clave en precisión simple
+    claves = [(f.astype(np.float32).astype(np.float64), v.astype(np.float32).astype(np.float64)) for f, v in claves]
+
+    # Distancia recorrida en todos los fotogramas de la animación
+    frames = None
+    if distancias:
+        frames = np.arange(0, parametros.frame_end+1, dtype=np.float64)
+        distancias = trayectoria_coche(claves).distancia_recorrida(frames, parametros.interpolation_method,
+                                                                   parametros.tau_value)
+    else:
+        distancias = None
+
+    return {'pos_ini': pos_ini, 'tam_coche': tam_coche, 'material': material, 'claves': claves,
+            'frames': frames, 'distancias': distancias}
+
+
+def genera_coches(parametros, semillas, n_materiales, n_procesos=1, distancias=True):
+    """
+    Función que genera los vehículos en paralelo en un conjunto de procesos. Como cada vehículo tiene su propia
+    semilla, el resultado es el mismo para cualquier número de procesos.
+
+    Args:
+        parametros (Parametros): Parámetros de la ciudad (ver core.Parametros)
+        semillas (List): Semilla de cada vehículo
+        n_materiales (int): Número de materiales disponibles para los vehículos
+        n_procesos (int): Número de procesos (0 para utilizar todos los núcleos y 1 para no crear procesos)
+        distancias (bool): Si se calcula la curva de distancia recorrida de cada vehículo (ver genera_coche)
+
+    Returns:
+        coches (List): Vehículos generados (ver genera_coche), en el mismo orden que las semillas
+    """
+    return list(itera_coches(parametros, semillas, n_materiales, n_procesos, distancias))
+
+
+def itera_coches(parametros, semillas, n_materiales, n_procesos=1, distancias=True, bloque=None):
+    """
+    Generador que devuelve los vehículos a medida que se generan en el conjunto de procesos, en el mismo orden
+    que las semillas. Si se deja de iterar antes de terminar (p. ej. al cancelar la generación), se descartan
+    los vehículos que los procesos aún no han empezado.
+
+    Args:
+        parametros (Parametros): Parámetros de la ciudad (ver core.Parametros)
+        semillas (List): Semilla de cada vehículo
+        n_materiales (int): Número de materiales disponibles para los vehículos
+        n_procesos (int): Número de procesos (0 para utilizar todos los núcleos y 1 para no crear procesos)
+        distancias (bool): Si se calcula la curva de distancia recorrida de cada vehículo (ver genera_coche)
+        bloque (int): Número de vehículos que se envían juntos a cada proceso. Con bloques pequeños los
+                      primeros vehículos llegan antes (por defecto se reparten en 4 bloques por proceso)
+
+    Returns:
+        coche (dict): Cada vehículo generado (ver genera_coche)
+    """
+    if n_procesos == 1 or len(semillas) < 2:
+        for semilla in semillas:
+            yield genera_coche(semilla, parametros, n_materiales, distancias)
+        return
+
+    # Se utiliza spawn porque no es seguro duplicar el proceso de Blender con fork
+    n_procesos = n_procesos or multiprocessing.cpu_count()
+    n = len(semillas)
+    if bloque is None:
+        bloque = max(1, n // (4 * n_procesos))
+    pool = ProcessPoolExecutor(max_workers=n_procesos, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        yield from pool.map(genera_coche, semillas, [parametros] * n, [n_materiales] * n, [distancias] * n,
+                            chunksize=bloque)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,144 @@
+# Autores: Alberto Jativa, Jordi Beltran, Carlos Izquierdo, Enrique Alcover
+# version ='1.0'
+# -------------------------------------------------------------------------------
+""" Script que contiene la medición de los tiempos de las etapas de la generación de la ciudad"""
+# -------------------------------------------------------------------------------
+# Imports
+# -------------------------------------------------------------------------------
+import json
+import time
+from contextlib import contextmanager
+from functools import wraps
+# -------------------------------------------------------------------------------
+
+# Medición en curso: tramos registrados (en orden de inicio) y pila de los tramos abiertos. Los tramos solo
+# se registran entre inicia() y termina(), de forma que fuera de la generación no tienen coste
+_medicion = {'activa': False, 'inicio': 0.0, 'tramos': [], 'pila': []}
+
+def inicia():
+    """
+    Función que empieza una nueva medición, descartando los tramos de la anterior.
+    """
+    _medicion.update(activa=True, inicio=time.perf_counter(), tramos=[], pila=[])
+
+def termina():
+    """
+    Función que termina la medición en curso.
+    Returns:
+        tramos (List): Tramos registrados en la medición (ver tramo)
+    """
+    _medicion['activa'] = False
+    _medicion['pila'] = []
+    return _medicion['tramos']
+
+def ultimos_tramos():
+    """
+    Función que devuelve los tramos de la última medición (vacío si no se ha hecho ninguna).
+    """
+    return _medicion['tramos']
+
+@contextmanager
+def tramo(nombre):
+    """
+    Gestor de contexto que registra el tiempo de un tramo de la generación. Los tramos se anidan: un tramo
+    que empieza dentro de otro es su hijo.
+
+    Cada tramo es un diccionario con su nombre, su ruta (los nombres de sus antecesores y el suyo), su inicio
+    y su duración en segundos desde el inicio de la medición, y sus contadores (ver cuenta).
+    Args:
+        nombre (String): Nombre del tramo
+    """
+    if not _medicion['activa']:
+        yield None
+        return
+
+    pila = _medicion['pila']
+    registro = {'nombre': nombre, 'ruta': (pila[-1]['ruta'] if pila else ()) + (nombre,),
+                'inicio': time.perf_counter() - _medicion['inicio'], 'duracion': 0.0, 'contadores': {}}
+    _medicion['tramos'].append(registro)
+    pila.append(registro)
+    try:
+        yield registro
+    finally:
+        registro['duracion'] = time.perf_counter() - _medicion['inicio'] - registro['inicio']
+        pila.pop()
+
+def medido(funcion):
+    """
+    Decorador que registra cada llamada a una función como un tramo con el nombre de la función.
+    """
+    @wraps(funcion)
+    def envoltura(*args, **kwargs):
+        with tramo(funcion.__name__):
+            return funcion(*args, **kwargs)
+    return envoltura
+
+def cuenta(nombre, n=1):
+    """
+    Función que suma una cantidad a un contador (p. ej. objetos o fotogramas clave creados) del tramo abierto.
+    Args:
+        nombre (String): Nombre del contador
+        n (int): Cantidad que se suma
+    """
+    if _medicion['activa'] and _medicion['pila']:
+        contadores = _medicion['pila'][-1]['contadores']
+        contadores[nombre] = contadores.get(nombre, 0) + n
+
+def resumen(tramos, profundidad=None):
+    """
+    Función que agrupa los tramos con la misma ruta (p. ej. todas las llamadas a setVehicleProperties dentro
+    de CreateVehicles). Los tiempos y los contadores de cada grupo incluyen los de sus tramos hijos.
+    Args:
+        tramos (List): Tramos de una medición
+        profundidad (int): Número máximo de niveles del resumen (todos si no se indica)
+    Returns:
+        grupos (List): Diccionarios con la ruta, el número de llamadas, la duración total y los contadores de
+                       cada grupo, en el orden en que empiezan
+    """
+    grupos = {}
+    for registro in tramos:
+        ruta = registro['ruta']
+        if ruta not in grupos:
+            grupos[ruta] = {'ruta': ruta, 'llamadas': 0, 'duracion': 0.0, 'contadores': {}}
+        grupo = grupos[ruta]
+        grupo['llamadas'] += 1
+        grupo['duracion'] += registro['duracion']
+
+        # Los contadores se suman también a los antecesores
+        for nivel in range(1, len(ruta) + 1):
+            antecesor = grupos.get(ruta[:nivel])
+            if antecesor is None:
+                continue
+            for nombre, n in registro['contadores'].items():
+                antecesor['contadores'][nombre] = antecesor['contadores'].get(nombre, 0) + n
+
+    return [grupo for grupo in grupos.values() if profundidad is None or len(grupo['ruta']) <= profundidad]
+
+def formatea(grupo):
+    """
+    Función que describe un grupo del resumen en una línea de texto.
+    Args:
+        grupo (dict): Grupo del resumen (ver resumen)
+    Returns:
+        texto (String): Nombre, duración, número de llamadas y contadores del grupo
+    """
+    texto = "{}{}: {:.1f} ms".format("  " * (len(grupo['ruta']) - 1), grupo['ruta'][-1], grupo['duracion'] * 1000)
+    if grupo['llamadas'] > 1:
+        texto += " ({}x)".format(grupo['llamadas'])
+    if grupo['contadores']:
+        texto += ", " + ", ".join("{} {}".format(n, nombre) for nombre, n in sorted(grupo['contadores'].items()))
+    return texto
+
+def escribe_traza(tramos, ruta):
+    """
+    Función que escribe los tramos de una medición en formato Chrome trace (JSON), que se puede abrir en
+    chrome://tracing o en Perfetto.
+    Args:
+        tramos (List): Tramos de una medición
+        ruta (String): Ruta del fichero
+    """
+    eventos = [{'name': registro['nombre'], 'ph': 'X', 'pid': 0, 'tid': 0,
+                'ts': registro['inicio'] * 1e6, 'dur': registro['duracion'] * 1e6, 'args': registro['contadores']}
+               for registro in tramos]
+    with open(ruta, 'w') as fichero:
+        json.dump({'traceEvents': eventos, 'displayTimeUnit': 'ms'}, fichero)
@@ -0,0 +1,509 @@
+# Autores: Alberto Jativa, Jordi Beltran
+# version ='1.0'
+# --------------------------------------------------------------------------------------
+""" Script que contiene las estructuras precompiladas con las trayectorias de los vehiculos """
+# --------------------------------------------------------------------------------------
+# Imports
+# --------------------------------------------------------------------------------------
+from bisect import bisect_left
+
+import numpy as np
+
+from interpola import coeficientes_curva, coeficientes_tramos, evalua_polinomio, interpola_lineal
+# --------------------------------------------------------------------------------------
+
+def clave_coeficientes(metodo, tau):
+    """
+    Devuelve la clave de la que dependen los coeficientes de los tramos (tau solo afecta a Catmull-Rom).
+    Args:
+        metodo (String): Método de interpolación ('LINEAL', 'HERMITE' o 'CATMULL')
+        tau (float): Tensión de la curva Catmull-Rom
+    """
+    return (metodo, tau if metodo == 'CATMULL' else None)
+
+
+def velocidades_manejadores(tiempos, valores, inicio=None):
+    """
+    Calcula sin Blender las velocidades de Hermite que se obtendrían de los manejadores de una fcurve con
+    manejadores automáticos limitados (AUTO_CLAMPED) y extrapolación constante, siguiendo el cálculo de
+    Blender: los extremos de la curva y los máximos y mínimos locales tienen manejadores horizontales y el
+    resto no pueden sobrepasar en altura a los fotogramas clave vecinos.
+
+    Si se indica inicio, los arrays son las curvas de varios vehículos concatenadas (formato CSR, ver
+    TablaFlota) y se calculan las velocidades de todas ellas de una sola vez.
+
+    Args:
+        tiempos (array): Tiempos de los fotogramas clave (ordenados)
+        valores (array): Valores de los fotogramas clave
+        inicio (array): Posición del primer fotograma clave de cada curva, más el total (opcional)
+
+    Returns:
+        velocidades (array): Velocidad de Hermite de cada fotograma clave (15 veces la diferencia de altura
+                             de sus manejadores, igual que al leerlas de la fcurve)
+    """
+    # Blender calcula los manejadores en precisión simple
+    t = np.asarray(tiempos, dtype=np.float32)
+    x = np.asarray(valores, dtype=np.float32)
+    n = len(x)
+    velocidades = np.zeros(n, dtype=np.float64)
+    if n < 3:
+        return velocidades
+
+    p = x[1:-1]
+    ant = x[:-2]
+    sig = x[2:]
+    dt_a = t[1:-1] - t[:-2]
+    dt_b = t[2:] - t[1:-1]
+    len_a = np.where(dt_a == 0, np.float32(1), dt_a)
+    len_b = np.where(dt_b == 0, np.float32(1), dt_b)
+
+    # Dirección de los manejadores a partir de las pendientes de los dos tramos
+    tvec_x = dt_b / len_b + dt_a / len_a
+    tvec_y = (sig - p) / len_b + (p - ant) / len_a
+    longitud = tvec_x * np.float32(2.5614)
+    validos = longitud != 0
+    longitud = np.where(validos, longitud, np.float32(1))
+
+    # Longitud de los manejadores (uno no puede ser más de 5 veces mayor que el otro)
+    len_a = np.minimum(len_a, np.float32(5) * len_b)
+    len_b = np.minimum(len_b, np.float32(5) * len_a)
+    h1_x = -tvec_x * (len_a / longitud)
+    h2_x = tvec_x * (len_b / longitud)
+    h1 = p - tvec_y * (len_a / longitud)
+    h2 = p + tvec_y * (len_b / longitud)
+
+    # Los máximos y mínimos locales tienen manejadores horizontales
+    ydiff1 = ant - p
+    ydiff2 = sig - p
+    extremo = ((ydiff1 <= 0) & (ydiff2 <= 0)) | ((ydiff1 >= 0) & (ydiff2 >= 0))
+
+    # El resto de manejadores no pueden sobrepasar la altura de los fotogramas clave vecinos
+    viola_izq = ~extremo & np.where(ydiff1 <= 0, ant > h1, ant < h1)
+    viola_der = ~extremo & np.where(ydiff1 <= 0, sig < h2, sig > h2)
+    h1 = np.where(viola_izq, ant, h1)
+    h2 = np.where(viola_der, sig, h2)
+
+    # Si uno de los manejadores se ha limitado, el otro se alinea con él
+    h2 = np.where(viola_izq, p + ((p - h1) / h1_x) * -h2_x, h2)
+    h1 = np.where(viola_der & ~viola_izq, p + ((p - h2) / -h2_x) * h1_x, h1)
+
+    h1 = np.where(extremo, p, h1)
+    h2 = np.where(extremo, p, h2)
+    velocidades[1:-1] = np.where(validos, 15*(h2.astype(np.float64) - h1), 0)
+
+    # Los extremos de cada curva concatenada tienen manejadores horizontales
+    if inicio is not None:
+        inicio = np.asarray(inicio)
+        no_vacias = inicio[1:] > inicio[:-1]
+        velocidades[inicio[:-1][no_vacias]] = 0
+        velocidades[inicio[1:][no_vacias] - 1] = 0
+    return velocidades
+
+
+def error_manejadores(emulada, real):
+    """
+    Calcula la mayor diferencia entre las velocidades de Hermite de dos trayectorias con los mismos fotogramas
+    clave, por ejemplo las emuladas sin Blender con velocidades_manejadores y las leídas de las fcurves.
+
+    Args:
+        emulada (Trayectoria): Trayectoria con las velocidades emuladas
+        real (Trayectoria): Trayectoria con las velocidades leídas de las fcurves
+
+    Returns:
+        error (float): Mayor diferencia absoluta (infinito si los fotogramas clave no coinciden)
+    """
+    error = 0.0
+    for eje in range(len(emulada.velocidades)):
+        if emulada.velocidades[eje].shape != real.velocidades[eje].shape:
+            return float('inf')
+        if len(emulada.velocidades[eje]) > 0:
+            error = max(error, float(np.max(np.abs(emulada.velocidades[eje] - real.velocidades[eje]))))
+    return error
+
+
+class Trayectoria:
+    """
+    Trayectoria precompilada de un vehículo. Guarda, para cada eje, los tiempos y valores de los
+    fotogramas clave y las velocidades de Hermite obtenidas de los manejadores como arrays de NumPy,
+    de forma que no sea necesario recorrer los fotogramas clave a través de RNA en cada evaluación.
+
+    Cada tramo se convierte en los coeficientes de su polinomio cúbico, que solo se vuelven a calcular
+    cuando cambian el método de interpolación o la tensión (si cambian los fotogramas clave se crea
+    una nueva trayectoria).
+    """
+
+    def __init__(self, firma, tiempos, valores, velocidades):
+        """
+        Args:
+            firma: Valor que identifica los datos a partir de los que se ha creado la trayectoria
+                   (si cambian, la trayectoria deja de ser válida)
+            tiempos (List): Array de tiempos de los fotogramas clave de cada eje
+            valores (List): Array de valores de los fotogramas clave de cada eje
+            velocidades (List): Array de velocidades de Hermite de los fotogramas clave de cada eje
+        """
+        self.firma = firma
+        self.tiempos = [np.asarray(t, dtype=np.float64) for t in tiempos]
+        self.valores = [np.asarray(v, dtype=np.float64) for v in valores]
+        self.velocidades = [np.asarray(v, dtype=np.float64) for v in velocidades]
+
+        # Copias en listas para la evaluación escalar (más rápida que indexar arrays de NumPy)
+        self._tiempos = [t.tolist() for t in self.tiempos]
+        self._clave_coef = None
+        self.coef = None
+        self._coef = None
+
+    def n_claves(self, eje):
+        """
+        Devuelve el número de fotogramas clave de un eje.
+
+        Args:
+            eje (int): Índice del eje (0 para X, 1 para Y, 2 para Z)
+        """
+        return len(self.tiempos[eje])
+
+    def segmento(self, eje, frame):
+        """
+        Busca mediante búsqueda binaria el primer fotograma clave cuyo tiempo no es menor que frame.
+        Es equivalente a recorrer los fotogramas clave desde el principio mientras su tiempo sea menor.
+
+        Args:
+            eje (int): Índice del eje (0 para X, 1 para Y, 2 para Z)
+            frame (float): Fotograma que se quiere evaluar
+
+        Returns:
+            i (int): Índice del fotograma clave siguiente a frame (0 si está antes del primero y
+                     n_claves si está después del último)
+        """
+        return bisect_left(self._tiempos[eje], frame)
+
+    def coeficientes(self, metodo, tau):
+        """
+        Devuelve los coeficientes de los tramos de los tres ejes, calculándolos si ha cambiado el
+        método de interpolación o la tensión.
+
+        Args:
+            metodo (String): Método de interpolación ('LINEAL', 'HERMITE' o 'CATMULL')
+            tau (float): Tensión de la curva Catmull-Rom
+
+        Returns:
+            coef (List): Array (n_claves, 4) de coeficientes de cada eje
+        """
+        clave = clave_coeficientes(metodo, tau)
+        if self._clave_coef != clave:
+            self.coef = [coeficientes_curva(metodo, self.valores[eje], self.velocidades[eje], tau) for eje in range(3)]
+            self._coef = [c.tolist() for c in self.coef]
+            self._clave_coef = clave
+        return self.coef
+
+    def evalua(self, eje, frame, metodo, tau):
+        """
+        Evalúa la posición de un eje en un fotograma: búsqueda binaria del tramo y un paso de Horner.
+
+        Args:
+            eje (int): Índice del eje (0 para X, 1 para Y, 2 para Z)
+            frame (float): Fotograma que se quiere evaluar
+            metodo (String): Método de interpolación ('LINEAL', 'HERMITE' o 'CATMULL')
+            tau (float): Tensión de la curva Catmull-Rom
+
+        Returns:
+            pos (float): Posición en el fotograma
+        """
+        self.coeficientes(metodo, tau)
+        t = self._tiempos[eje]
+        coef = self._coef[eje]
+        n = len(t)
+        i = self.segmento(eje, frame)
+
+        # Fuera del intervalo de los fotogramas clave se toma el primer o el último valor
+        if i <= 0:
+            return coef[0][0]
+        if i >= n:
+            return coef[n-1][0]
+
+        c0, c1, c2, c3 = coef[i-1]
+        u = (frame - t[i-1]) / (t[i] - t[i-1])
+        return c0 + u * (c1 + u * (c2 + u * c3))
+
+    def muestrea(self, frames, metodo, tau):
+        """
+        Evalúa de forma vectorizada la posición de los tres ejes en un array de fotogramas, con el mismo
+        tratamiento de los extremos que evalua.
+
+        Args:
+            frames (array): Fotogramas que se quieren evaluar
+            metodo (String): Método de interpolación ('LINEAL', 'HERMITE' o 'CATMULL')
+            tau (float): Tensión de la curva Catmull-Rom
+
+        Returns:
+            pos (array): Array (m, 3) con las posiciones
+        """
+        frames = np.asarray(frames, dtype=np.float64)
+        pos = np.empty((len(frames), 3), dtype=np.float64)
+        coeficientes = self.coeficientes(metodo, tau)
+
+        for eje in range(3):
+            t = self.tiempos[eje]
+            x = self.valores[eje]
+            n = len(t)
+            i = np.searchsorted(t, frames, side='left')
+
+            # Fuera del intervalo de los fotogramas clave se toma el primer o el último valor
+            res = np.where(i <= 0, x[0], x[n - 1])
+            tramo = (i > 0) & (i < n)
+            if tramo.any():
+                a = i[tramo] - 1
+                res[tramo] = evalua_polinomio(coeficientes[eje][a], t[a], t[a + 1], frames[tramo])
+            pos[:, eje] = res
+        return pos
+
+    def distancia_recorrida(self, frames, metodo, tau):
+        """
+        Calcula la distancia acumulada recorrida a lo largo de la trayectoria en un array de fotogramas,
+        como la suma de los módulos de los desplazamientos entre fotogramas consecutivos.
+
+        Args:
+            frames (array): Fotogramas ordenados en los que se muestrea la trayectoria
+            metodo (String): Método de interpolación ('LINEAL', 'HERMITE' o 'CATMULL')
+            tau (float): Tensión de la curva Catmull-Rom
+
+        Returns:
+            distancias (array): Distancia recorrida hasta cada fotograma (0 en el primero)
+        """
+        posiciones = self.muestrea(frames, metodo, tau)
+        distancias = np.zeros(len(posiciones), dtype=np.float64)
+        np.cumsum(np.linalg.norm(np.diff(posiciones, axis=0), axis=1), out=distancias[1:])
+        return distancias
+
+
+class TablaFlota:
+    """
+    Tabla con las trayectorias de toda la flota de vehículos. Para cada eje concatena los fotogramas
+    clave de todos los vehículos (formato CSR: el vehículo i ocupa las posiciones inicio[i]:inicio[i+1])
+    de forma que las posiciones de todos los vehículos se pueden evaluar en una única pasada vectorizada.
+    """
+
+    def __init__(self, trayectorias):
+        """
+        Args:
+            trayectorias (List): Trayectorias (Trayectoria) de los vehículos de la flota
+        """
+        self._crea([[tray.tiempos[eje] for tray in trayectorias] for eje in range(3)],
+                   [[tray.valores[eje] for tray in trayectorias] for eje in range(3)],
+                   [[tray.velocidades[eje] for tray in trayectorias] for eje in range(3)])
+
+    @classmethod
+    def desde_claves(cls, claves):
+        """
+        Crea la tabla directamente a partir de los fotogramas clave de los vehículos, sin crear una Trayectoria
+        por vehículo. Las velocidades de los manejadores de toda la flota se calculan de una sola vez.
+
+        Args:
+            claves (List): Fotogramas clave de cada vehículo (para cada eje una tupla (frames, valores), ver
+                           rutas.planifica_ruta)
+
+        Returns:
+            tabla (TablaFlota): Tabla de trayectorias de la flota
+        """
+        tiempos = [[clave[eje][0] for clave in claves] for eje in range(3)]
+        valores = [[clave[eje][1] for clave in claves] for eje in range(3)]
+        velocidades = []
+        for eje in range(3):
+            if not claves:
+                velocidades.append([])
+                continue
+            inicio = np.zeros(len(claves) + 1, dtype=np.int64)
+            np.cumsum([len(t) for t in tiempos[eje]], out=inicio[1:])
+            v = velocidades_manejadores(np.concatenate(tiempos[eje]), np.concatenate(valores[eje]), inicio)
+            velocidades.append(np.split(v, inicio[1:-1]))
+
+        tabla = cls.__new__(cls)
+        tabla._crea(tiempos, valores, velocidades)
+        return tabla
+
+    def _crea(self, tiempos_ejes, valores_ejes, velocidades_ejes):
+        """
+        Concatena los fotogramas clave de todos los vehículos e inicializa la tabla.
+
+        Args:
+            tiempos_ejes (List): Para cada eje, los tiempos de los fotogramas clave de cada vehículo
+            valores_ejes (List): Para cada eje, los valores de los fotogramas clave de cada vehículo
+            velocidades_ejes (List): Para cada eje, las velocidades de Hermite de cada vehículo
+        """
+        self.n_vehiculos = len(tiempos_ejes[0])
+        self.inicio = []
+        self.tiempos = []
+        self.valores = []
+        self.velocidades = []
+        self.clave = []
+        self.span = []
+        self._clave_coef = None
+        self.coef = None
+        for eje in range(3):
+            longitudes = np.array([len(t) for t in tiempos_ejes[eje]], dtype=np.int64)
+            inicio = np.zeros(self.n_vehiculos + 1, dtype=np.int64)
+            np.cumsum(longitudes, out=inicio[1:])
+            n = self.n_vehiculos
+            tiempos = np.concatenate(tiempos_ejes[eje]).astype(np.float64) if n else np.zeros(0)
+            valores = np.concatenate(valores_ejes[eje]).astype(np.float64) if n else np.zeros(0)
+            velocidades = np.concatenate(velocidades_ejes[eje]).astype(np.float64) if n else np.zeros(0)
+
+            # Clave de búsqueda: tiempo relativo desplazado según el vehículo, para poder buscar el
+            # segmento de todos los vehículos con una única búsqueda binaria sobre el array concatenado
+            t_min = tiempos.min() if len(tiempos) else 0.0
+            span = (tiempos.max() - t_min + 2) if len(tiempos) else 2.0
+            fila = np.repeat(np.arange(self.n_vehiculos), longitudes)
+
+            self.inicio.append(inicio)
+            self.tiempos.append(tiempos)
+            self.valores.append(valores)
+            self.velocidades.append(velocidades)
+            self.clave.append((tiempos - t_min + fila * span, t_min))
+            self.span.append(span)
+
+    def coeficientes(self, metodo, tau):
+        """
+        Devuelve los coeficientes de los tramos de toda la flota (una fila por fotograma clave, alineada
+        con los arrays concatenados), calculándolos de una sola vez si ha cambiado el método o la tensión.
+
+        Args:
+            metodo (String): Método de interpolación ('LINEAL', 'HERMITE' o 'CATMULL')
+            tau (float): Tensión de la curva Catmull-Rom
+
+        Returns:
+            coef (List): Array (claves, 4) de coeficientes de cada eje
+        """
+        clave = clave_coeficientes(metodo, tau)
+        if self._clave_coef != clave:
+            self.coef = []
+            for eje in range(3):
+                inicio = self.inicio[eje]
+                valores = self.valores[eje]
+                longitudes = np.diff(inicio)
+                n = np.repeat(longitudes, longitudes)
+                local = np.arange(len(valores)) - np.repeat(inicio[:-1], longitudes)
+
+                # La última fila de cada vehículo es el valor constante de su último fotograma clave
+                coef = np.zeros((len(valores), 4), dtype=np.float64)
+                coef[:, 0] = valores
+                a = np.nonzero(local < n - 1)[0]
+                if len(a):
+                    coef[a] = coeficientes_tramos(metodo, valores, a, local[a] + 1, n[a], self.velocidades[eje], tau)
+                self.coef.append(coef)
+            self._clave_coef = clave
+        return self.coef
+
+    def segmentos(self, eje, filas, frames):
+        """
+        Busca el segmento de cada par (vehículo, fotograma) con una única búsqueda binaria.
+
+        Args:
+            eje (int): Índice del eje (0 para X, 1 para Y, 2 para Z)
+            filas (array): Índices de los vehículos
+            frames (array): Fotogramas que se quieren evaluar
+
+        Returns:
+            i (array): Índice local del primer fotograma clave cuyo tiempo no es menor que el fotograma
+            n (array): Número de fotogramas clave de cada vehículo
+            base (array): Posición del primer fotograma clave de cada vehículo en los arrays concatenados
+        """
+        clave, t_min = self.clave[eje]
+        span = self.span[eje]
+        consulta = np.clip(frames - t_min, 0, span - 1) + filas * span
+        base = self.inicio[eje][filas]
+        n = self.inicio[eje][filas + 1] - base
+        i = np.searchsorted(clave, consulta, side='left') - base
+        return i, n, base
+
+    def posiciones(self, filas, frames, metodo, tau):
+        """
+        Evalúa las posiciones de varios vehículos en varios fotogramas, con el mismo tratamiento de
+        los extremos que get_posicion.
+
+        Args:
+            filas (array): Índices de los vehículos
+            frames (array): Fotogramas que se quieren evaluar (mismo tamaño que filas)
+            metodo (String): Método de interpolación ('LINEAL', 'HERMITE' o 'CATMULL')
+            tau (float): Tensión de la curva Catmull-Rom
+
+        Returns:
+            pos (array): Array (m, 3) con las posiciones
+        """
+        filas = np.asarray(filas, dtype=np.int64)
+        frames = np.asarray(frames, dtype=np.float64)
+        pos = np.empty((len(filas), 3), dtype=np.float64)
+        coeficientes = self.coeficientes(metodo, tau)
+
+        for eje in range(3):
+            t = self.tiempos[eje]
+            x = self.valores[eje]
+            i, n, base = self.segmentos(eje, filas, frames)
+
+            # Fuera del intervalo de los fotogramas clave se toma el primer o el último valor
+            res = np.where(i <= 0, x[base], x[np.maximum(base + n - 1, 0)])
+            tramo = (i > 0) & (i < n)
+            if tramo.any():
+                # Un paso de Horner por tramo con los coeficientes precalculados
+                a = (base + i)[tramo] - 1
+                res[tramo] = evalua_polinomio(coeficientes[eje][a], t[a], t[a + 1], frames[tramo])
+            pos[:, eje] = res
+        return pos
+
+
+class IndiceDistancia:
+    """
+    Índice monótono de la distancia recorrida de un vehículo a lo largo de su trayectoria, que permite
+    obtener por búsqueda binaria el fotograma de la trayectoria en el que se alcanza una distancia
+    (reparametrización por longitud de arco) en lugar de recorrer los fotogramas clave de la curva.
+    """
+
+    def __init__(self, firma, frames, distancias):
+        """
+        Args:
+            firma: Valor que identifica los datos a partir de los que se ha creado el índice
+            frames (array): Fotogramas de los fotogramas clave de la curva de distancia recorrida
+            distancias (array): Distancia recorrida en cada fotograma clave (no decreciente)
+        """
+        self.firma = firma
+        self.frames = np.asarray(frames, dtype=np.float64)
+        self.distancias = np.asarray(distancias, dtype=np.float64)
+        self._frames = self.frames.tolist()
+        self._distancias = self.distancias.tolist()
+
+    def frame(self, distancia):
+        """
+        Obtiene el fotograma de la trayectoria en el que se ha recorrido una distancia. Equivale a
+        recorrer los fotogramas clave mientras su distancia sea menor e interpolar linealmente.
+
+        Args:
+            distancia (float): Distancia recorrida
+
+        Returns:
+            frame (float): Fotograma de la trayectoria
+        """
+        d = self._distancias
+        f = self._frames
+        i = bisect_left(d, distancia)
+        if i >= len(d):
+            return f[-1]
+        return interpola_lineal(d[i-1], d[i], f[i-1], f[i], distancia)
+
+    def frames_de(self, distancias):
+        """
+        Versión vectorizada de frame para un array de distancias.
+
+        Args:
+            distancias (array): Distancias recorridas
+
+        Returns:
+            frames (array): Fotogramas de la trayectoria
+        """
+        distancias = np.asarray(distancias, dtype=np.float64)
+        d = self.distancias
+        f = self.frames
+        i = np.searchsorted(d, distancias, side='left')
+        dentro = i < len(d)
+        res = np.full(len(distancias), f[-1], dtype=np.float64)
+        if dentro.any():
+            b = i[dentro]
+            res[dentro] = interpola_lineal(d[b-1], d[b], f[b-1], f[b], distancias[dentro])
+        return res
@@ -7,245 +7,431 @@
 # -------------------------------------------------------------------------------
 import bpy
 import math
-import random
 import os
 import sys
+import time
 import numpy as np
 import mathutils
+from bpy.app.handlers import persistent
 
-from city import Materials
-from interpola import interpola_catmull_rom, interpola_hermite, interpola_lineal
+from city import Materials, cache_escena
+from trayectoria import Trayectoria, TablaFlota, IndiceDistancia, error_manejadores
+from core import Parametros, calcula_flota, calcula_poses, itera_flota, tabla_coches
+from rutas import trayectoria_coche
+from orientacion import euler_xyz
+from delete import ETIQUETA, etiqueta
+from jerarquia import crea_vacio, emparenta, enlaza
+from modelo import firma_malla
+from pasos import agota
+from tiempos import cuenta, medido, tramo
+from perfil import PerfilDrivers
+from almacen import AlmacenTrayectorias
 
 dir = os.path.dirname(os.path.realpath(__file__))
 if not dir in sys.path:
     sys.path.append(dir)
 # -------------------------------------------------------------------------------
 
-def setVehicleProperties(obj, pos_ini, tam_coche, material):
+# Mayor diferencia admitida entre las velocidades de Hermite emuladas y las de las fcurves (por encima del
+# redondeo de la precisión simple con la que Blender calcula los manejadores)
+TOLERANCIA_MANEJADORES = 1.0e-2
+
+# Caché de trayectorias precompiladas, indexada por el puntero de cada objeto
+_cache_trayectorias = {}
+
+# Caché de índices de distancia recorrida para la reparametrización, indexada por el puntero de cada objeto
+_cache_distancias = {}
+
+# Memoria de poses por fotograma, indexada por el puntero de cada objeto y el fotograma
+_memo_poses = {}
+
+# Tabla con las trayectorias de la flota que utiliza el handler de reproducción (se reconstruye cuando es None) y
+# colección con sus vehículos en el orden de la tabla, para escribir sus poses de una sola vez (ver coleccion_flota)
+_flota = {'coches': [], 'tabla': None, 'coleccion': None, 'coleccion_coches': None}
+
+# Tabla con las trayectorias de la flota de instancias, indexada por el puntero de su objeto (se reconstruye
+# cuando es None, por ejemplo al cargar un fichero)
+_instancias = {'puntero': None, 'tabla': None}
+
+# Almacén externo de trayectorias abierto y vehículos que se animan con él, en el orden de sus filas (se vuelve
+# a abrir cuando cambia la ruta del almacén o se elimina algún vehículo; la ruta None indica que hay que buscarlos).
+# Si no se ha podido abrir se guarda el motivo, que se muestra en el panel y en los operadores que lo utilizan
+_almacen = {'ruta': None, 'almacen': None, 'coches': [], 'filas': None, 'error': None, 'coleccion': None,
+            'coleccion_coches': None}
+
+# Estadísticas del perfilador de drivers (solo se recogen con el perfilador activado, ver activa_perfil)
+_perfil = PerfilDrivers()
+
+@medido
+def setVehicleProperties(obj, coche, material):
     """
     Función para asignar las propiedades de los vehiculos de la escena.
     Estas propiedades son: posición inicial, tamaño, material y movimiento.
     
     Args:
         obj (object): Objeto del que se estan modificando las propiedades
-        pos_ini (float): Posición en la que se encuentra el vehiculo inicialmente
-        tam_coche (int): Tamaño del vehiculo
+        coche (dict): Vehículo generado con rutas.genera_coche (posición inicial, tamaño, ruta y distancia recorrida)
         material (mat): Material del vehiculo
     """
-    # Propiedades del objeto
-    A = bpy.context.scene.a_desplazamiento
-    freq = bpy.context.scene.f_desplazamiento
-    v_coches = bpy.context.scene.v_coches
-    calles_x = bpy.context.scene.calles_x
-    calles_y = bpy.context.scene.calles_y
-    tam_manzana = bpy.context.scene.tam_manzana
-    tam_calles = bpy.context.scene.tam_calles
-    p = bpy.context.scene.cursor.location
-    
-    n_giros = bpy.context.scene.n_giros
-    
+    tam_coche = coche['tam_coche']
+
     # Creación del vehículo
-    obj.location = pos_ini
+    obj.location = coche['pos_ini']
     obj.scale = (tam_coche*10, tam_coche*10, tam_coche*10)
 
     # Asignación del material
     if material != -1:
-        obj.data.materials.pop()
-        obj.data.materials.append(material)
+        asigna_material(obj, material)
 
-    aux_z = obj.location.z
+    # Escribimos los fotogramas clave de la ruta de cada eje de una sola vez
+    if obj.animation_data is None:
+        obj.animation_data_create()
+    if obj.animation_data.action is None:
+        obj.animation_data.action = bpy.data.actions.new(obj.name + 'Action')
+        etiqueta('coches', obj.animation_data.action)
+    with tramo('claves_ruta'):
+        for ind, (frames, valores) in enumerate(coche['claves']):
+            escribe_fcurve(obj.animation_data.action, 'location', ind, frames, valores, 'Object Transforms')
 
-    # Si la frecuencia es distinta de 0 se calcula la cantidad de fotogramas que
-    # deben insertarse en la animación para completar un ciclo de movimiento en
-    # función de la frecuencia
-    if freq != 0:
-        paso_kf = int(24/freq)
-    else:
-        paso_kf = 0
-
-    # Creamos el primer fotograma de la escena
-    start = bpy.context.scene.frame_start
-    frm = start
-    # Insertamos un fotograma clave en la posición del objeto en el eje X (index = 0) en el fotograma de la escena (frame = start)
-    obj.keyframe_insert(data_path="location", index=0, frame=start)
-    obj.keyframe_insert(data_path="location", index=1, frame=start)
-    
-    pos_ini_x = obj.location.x
-
-    # Calculamos el inicio y final de la ciudad en el eje X
-    ini_ciudad_x = p[0] - tam_calles/2
-    fin_ciudad_x = p[0] + ((calles_x + 1) * (tam_manzana + tam_calles))
-    
-    # Si en el panel de las propiedades asignamos un numero de giros igual a 0, los coches se moverán en linea recta
-    if n_giros == 0:
-        #Los que están fuera de la ciudad que entren y la crucen por ambos lados (if y elif)
-        if pos_ini_x > fin_ciudad_x:
-            # Establecemos la posición final del vehiculo en 
-            obj.location.x = pos_ini_x-(fin_ciudad_x - ini_ciudad_x)*1.25
-            # Calculamos donde tenemos que insertar el último fotograma de la animación. 
-            # Se calcula usando la fórmula de la velocidad en el MRU (x/t)
-            frm += calles_x*1.25/v_coches*24
-            # Insertamos un fotograma clave en la posición del objeto en el eje X (index = 0) en el fotograma de la escena (frame = end)
-            obj.keyframe_insert(data_path="location", index=0, frame=frm)
-        elif pos_ini_x < ini_ciudad_x:
-            obj.location.x = pos_ini_x+(fin_ciudad_x - ini_ciudad_x)*1.25
-            frm += calles_x*1.25/v_coches*24
-            obj.keyframe_insert(data_path="location", index=0, frame=frm)
-        # Los que están dentro de la ciudad, que se muevan a uno de los lados
-        else:
-            # Decidir a que lado moverse de forma aleatoria
-            band = random.randint(1, 2)
-            #Derecha
-            if band == 1:
-                obj.location.x = pos_ini_x+(fin_ciudad_x - ini_ciudad_x)*1.25
-                frm += calles_x*1.25/v_coches*24
-                obj.keyframe_insert(data_path="location", index=0, frame=frm)
-
-            #Izquierda
-            else:
-                obj.location.x = pos_ini_x-(fin_ciudad_x - ini_ciudad_x)*1.25
-                frm += calles_x*1.25/v_coches*24
-
-    # Si el número de giros es distinto de 0, los coches se moveran realizando giros
-    else:
-        #Si no están dentro de la ciudad, les hacemos entrar antes de que giren
-        if ini_ciudad_x > pos_ini_x:
-            obj.location.x = ini_ciudad_x
-            calles_recorridas = (ini_ciudad_x - pos_ini_x)/(tam_calles+tam_manzana)
-            frm+=  calles_recorridas / v_coches * 24
-            obj.keyframe_insert(data_path="location", index=0, frame=frm)
-            obj.keyframe_insert(data_path="location", index=1, frame=frm)
-            
-        if fin_ciudad_x < pos_ini_x:
-            obj.location.x = fin_ciudad_x
-            calles_recorridas = (pos_ini_x - fin_ciudad_x)/(tam_calles+tam_manzana)
-            frm+=  calles_recorridas / v_coches * 24
-            obj.keyframe_insert(data_path="location", index=0, frame=frm)
-            obj.keyframe_insert(data_path="location", index=1, frame=frm)
-        
-        giro = 0    # Contador de giros
-
-        while(giro <= n_giros): 
-            band = random.randint(1, 2)      # bandera para decidir a que lado moverse de forma aleatoria
-            
-            # Este condicional permitirá realizar 1 giro 
-            # en cada eje de forma repetitiva
-            
-            #Movimiento en el eje x
-            if giro%2!=0:
-                # Girar en una calle aleatoria
-                dist_rand = random.randint(1, calles_x)
-                # Se mueven de izquierda a derecha
-                if band == 1:
-                    obj.location.x+=dist_rand*(tam_calles+tam_manzana)
-                # Se mueven de derecha a izquierda
-                else:
-                    obj.location.x-=dist_rand*(tam_calles+tam_manzana)
-                frm += (dist_rand/v_coches)*24
-                obj.keyframe_insert(data_path="location", index=0, frame=frm)
-                obj.keyframe_insert(data_path="location", index=1, frame=frm)
-                
-            #Giros en el eje y
-            else:
-                dist_rand = random.randint(1, calles_y)
-                if band == 1:
-                    obj.location.y+=dist_rand*(tam_calles+tam_manzana)
-                else:
-                    obj.location.y-=dist_rand*(tam_calles+tam_manzana)
-                frm += (dist_rand/v_coches)*24
-                obj.keyframe_insert(data_path="location", index=0, frame=frm)
-                obj.keyframe_insert(data_path="location", index=1, frame=frm)
-            giro+=1
-      
-    
-    # Si el paso de keyframes y la frecuencia son distintos de cero, se producirá movimiento vertical (eje Z)
-    if paso_kf != 0 and freq !=0:
-        for i in range(start, int(frm), paso_kf):
-            obj.location.z = aux_z + A 
-            obj.keyframe_insert(data_path="location", index=2, frame=i)
-        for i in range(start+int(paso_kf/2), int(frm), paso_kf):
-            obj.location.z = aux_z 
-            obj.keyframe_insert(data_path="location", index=2, frame=i)
-    else:
-        obj.keyframe_insert(data_path="location", index=2, frame=start)
-        obj.keyframe_insert(data_path="location", index=2, frame=frm)
-    
-    ObtenerCurvaDistancia_Recorrida(obj)
+    invalidar_trayectorias(obj)
+    with tramo('distancia_recorrida'):
+        escribe_distancia_recorrida(obj, coche['frames'], distancias_comprobadas(obj, coche))
                     
     InicializarDistancia_Deseada(obj)
 
+def distancias_comprobadas(obj, coche):
+    """
+    Función que comprueba la distancia recorrida calculada en los procesos. Para calcularla sin Blender se
+    emulan los manejadores automáticos de las fcurves (ver trayectoria.velocidades_manejadores), pero los
+    drivers evalúan las fcurves reales: si sus manejadores no coinciden (p. ej. con otro tipo de manejador por
+    defecto en las preferencias o en otra versión de Blender), se vuelve a calcular con los de las fcurves.
+    Args:
+        obj (Object): Vehículo con las fcurves de la ruta ya escritas
+        coche (dict): Vehículo generado con rutas.genera_coche
+    Returns:
+        distancias (array): Distancia recorrida en cada fotograma de coche['frames']
+    """
+    real = obtener_trayectoria(obj)
+    if error_manejadores(trayectoria_coche(coche['claves']), real) <= TOLERANCIA_MANEJADORES:
+        return coche['distancias']
+    cuenta('distancias_recalculadas')
+    scene = bpy.context.scene
+    return real.distancia_recorrida(coche['frames'], scene.interpolation_method, scene.tau_value)
+
+def asigna_material(obj, material):
+    """
+    Función que asigna un material al objeto y no a su malla, que comparten todos los vehículos y se
+    conserva entre ejecuciones.
+    Args:
+        obj (Object): Objeto al que se asigna el material
+        material (Material): Material
+    """
+    if len(obj.material_slots) == 0:
+        obj.data.materials.append(None)
+    obj.material_slots[0].link = 'OBJECT'
+    obj.material_slots[0].material = material
+
+@medido
 def CreateVehicles():
     """
     Función que genera todos los vehiculos que estarán en la escena de Blender. Esta función obtiene los valores
     de las variables de la interfaz implementada.
 
-    Mediante un bucle for creamos cada vehiculo individualmente. De forma aleatoria seleccionamos la calle en la
-    que se ubicará el coche, calculamos el tamaño del coche según el tamaño de las calles y calculamos una altura
-    aleatoria para cada coche en función del tamaño del vehiculo y la altura máxima que puede tener un edificio.
-    """
-    #Propiedades del panel
-    calles_y = bpy.context.scene.calles_y
-    calles_x = bpy.context.scene.calles_x
-    tam_manzana = bpy.context.scene.tam_manzana
-    tam_calles = bpy.context.scene.tam_calles
-    p = bpy.context.scene.cursor.location
-    n_vehicles = bpy.context.scene.n_coches
-    
-    #Creacion objeto vacio
-    bpy.ops.object.empty_add(location=[0, 0, 0])
-    vehicles = bpy.context.active_object
-    vehicles.name = 'coches'
+    La posición inicial, el tamaño, el material, la ruta y la distancia recorrida de cada vehículo se calculan
+    sin Blender en un conjunto de procesos (core.calcula_flota), con una semilla por vehículo derivada de la
+    semilla maestra, de forma que el resultado no depende del número de procesos. Después, en el hilo principal,
+    se enlaza cada coche a la ciudad y se escriben sus fotogramas clave.
+    """
+    agota(CreateVehiclesPasos())
 
+def CreateVehiclesPasos(bloque=None):
+    """
+    Versión por pasos de CreateVehicles (ver pasos.py): devuelve el avance después de escribir cada vehículo.
+    Args:
+        bloque (int): Si se indica, los vehículos se escriben a medida que llegan de los procesos, que los
+                      generan en bloques de este tamaño (ver core.itera_flota). Si no, se espera a toda la flota
+    """
+    scene = bpy.context.scene
+    
     # Buscar coleccion 'ciudad'
     city = bpy.data.collections.get('ciudad')
-    
-    # Enlazar a coleccion ciudad
-    city.objects.link(vehicles)
-    bpy.context.collection.objects.unlink(vehicles)
+
+    #Creacion objeto vacio en la coleccion ciudad
+    vehicles = crea_vacio('coches', city)
+    etiqueta('coches', vehicles)
     
     # Creacion de materiales
     vehicles_materials = Materials('vehicle')
     
-    # Obtencion de la coleccion de las copias de los coches
+    # Obtencion de la coleccion de las copias de los coches (se copia la lista porque se desenlazan en el bucle)
     vehiclesCollection = bpy.data.collections.get('copias_ModeloCoche')
+    cars = [obj for obj in vehiclesCollection.objects if obj.name.startswith('ModeloCoche')]
 
-    # Bucle for para crear los coches, calculamos la posición inicial y el tamaño del coche y llamamos a CreateVehicle
-    i = 0 # Contador de coches
-    for obj in vehiclesCollection.objects:
-        # Si el objeto es un coche, lo guardamos en la variable car
-        if obj.name.startswith('ModeloCoche'):
-            car = obj
-            car.name = 'coche.{:03d}'.format(i)
-
-            # Enlazamos al objeto vacío
-            bpy.context.view_layer.objects.active = vehicles
-            vehicles.select_set(True)
-            bpy.ops.object.parent_set(type='OBJECT')
-            bpy.ops.object.select_all(action='DESELECT')
-            car.select_set(True)
-            bpy.ops.object.parent_set(type='OBJECT', keep_transform=True)
-
-            # Enlazamos el coche a la colección de la ciudad
-            city.objects.link(car)
-            vehiclesCollection.objects.unlink(car)
-
-            # Calculamos la posición inicial del coche, tamaño y altura de vuelo
-            calle_ini = random.randint(-calles_y//4, calles_y+calles_y//2)
-            tam_coche = (tam_calles * 0.4) / 2
-            h_vuelo = random.uniform(tam_coche / 2, bpy.context.scene.alt_edificios_max)
-            
-            if(len(vehicles_materials) > 0):
-                material = vehicles_materials[random.randint(0, len(vehicles_materials)-1)]
-            else:
-                material=-1
-                
-            rand_calle_ini=random.randint(-calles_x//4, calles_x+calles_x//4)
-            pos_x = p[0]+(rand_calle_ini-1)*(tam_calles+tam_manzana)+(tam_calles/2+tam_manzana)
-            pos_ini = [pos_x, p[1] + (calle_ini - 0.5) * tam_calles + tam_manzana * calle_ini, p[2] + h_vuelo]
-            setVehicleProperties(car, pos_ini, tam_coche, material)
-            i += 1
+    # Generación en paralelo de los vehículos
+    parametros = Parametros.desde_escena(scene)
+    modelo = firma_malla(cars[0].data) if cars else None
+    if bloque is None:
+        with tramo('calcula_flota'):
+            coches = calcula_flota(parametros, len(vehicles_materials), len(cars), cache=cache_escena(scene),
+                                   modelo=modelo)
+    else:
+        coches = itera_flota(parametros, len(vehicles_materials), len(cars), bloque=bloque,
+                             cache=cache_escena(scene), modelo=modelo)
+
+    # Bucle for para enlazar los coches y escribir sus propiedades
+    for i, (car, coche) in enumerate(zip(cars, coches)):
+        car.name = 'coche.{:03d}'.format(i)
+        cuenta('objetos')
+
+        # Enlazamos al objeto vacío
+        emparenta(car, vehicles)
+
+        # Enlazamos el coche a la colección de la ciudad
+        enlaza(car, city)
+
+        if coche['material'] != -1:
+            material = vehicles_materials[coche['material']]
+        else:
+            material = -1
+
+        setVehicleProperties(car, coche, material)
+        yield (i + 1) / len(cars)
         
+@medido
+def CreateFleetInstances(malla):
+    """
+    Función que genera la flota como una nube de puntos en lugar de un objeto por vehículo. Se crea un único
+    objeto 'flota' con un vértice por vehículo, que guarda en atributos su rotación ('rotacion', en ángulos
+    de Euler), su escala ('escala') y la variante del modelo ('variante', una por material). Un modificador
+    de nodos de geometría instancia el modelo en los puntos, y el handler de reproducción (actualiza_flota)
+    escribe en cada fotograma las posiciones y rotaciones de todos los vehículos de una sola vez.
+    Args:
+        malla (Mesh): Malla del modelo de los vehículos
+    """
+    agota(CreateFleetInstancesPasos(malla))
+
+def CreateFleetInstancesPasos(malla, bloque=None):
+    """
+    Versión por pasos de CreateFleetInstances (ver pasos.py): devuelve el avance a medida que llegan los
+    vehículos de los procesos. La nube de puntos y la tabla de la flota se crean en el último paso.
+    Args:
+        malla (Mesh): Malla del modelo de los vehículos
+        bloque (int): Si se indica, número de vehículos que se envían juntos a cada proceso (ver
+                      core.itera_flota). Si no, se espera a toda la flota
+    """
+    scene = bpy.context.scene
+    parametros = Parametros.desde_escena(scene)
+    city = bpy.data.collections.get('ciudad')
+
+    # Generación en paralelo de los vehículos (sin curvas de distancia, no hay reparametrización por vehículo)
+    vehicles_materials = Materials('vehicle')
+    if bloque is None:
+        with tramo('calcula_flota'):
+            coches = calcula_flota(parametros, len(vehicles_materials), distancias=False,
+                                   cache=cache_escena(scene), modelo=firma_malla(malla))
+    else:
+        coches = []
+        for coche in itera_flota(parametros, len(vehicles_materials), distancias=False, bloque=bloque,
+                                 cache=cache_escena(scene), modelo=firma_malla(malla)):
+            coches.append(coche)
+            yield 0.9 * len(coches) / parametros.n_coches
+
+    # Variantes del modelo: un objeto por material, en una colección que no se enlaza a la escena
+    variantes = bpy.data.collections.new('variantes_coche')
+    etiqueta('coches', variantes)
+    for i, material in enumerate(vehicles_materials or [None]):
+        obj = bpy.data.objects.new('variante_coche.{:03d}'.format(i), malla)
+        etiqueta('coches', obj)
+        variantes.objects.link(obj)
+        if material is not None:
+            asigna_material(obj, material)
+
+    # Nube de puntos con un vértice por vehículo y sus atributos
+    n = len(coches)
+    cuenta('instancias', n)
+    mesh = bpy.data.meshes.new('flota')
+    mesh.vertices.add(n)
+    mesh.vertices.foreach_set('co', np.array([coche['pos_ini'] for coche in coches], dtype=np.float32).ravel())
+    mesh.attributes.new('rotacion', 'FLOAT_VECTOR', 'POINT')
+    escala = mesh.attributes.new('escala', 'FLOAT', 'POINT')
+    escala.data.foreach_set('value', np.array([coche['tam_coche']*10 for coche in coches], dtype=np.float32))
+    variante = mesh.attributes.new('variante', 'INT', 'POINT')
+    variante.data.foreach_set('value', np.array([max(coche['material'], 0) for coche in coches], dtype=np.int32))
+
+    # Parámetros con los que se han generado las rutas, para reconstruir la tabla al cargar el fichero
+    mesh['parametros'] = {nombre: getattr(parametros, nombre) for nombre in Parametros.CAMPOS}
+    mesh['n_materiales'] = len(vehicles_materials)
+    # Fichero del modelo, que forma parte de la clave de la flota en la caché (no se guarda con los nombres de
+    # firma_malla para que obtener_malla no confunda la nube de puntos con la malla del modelo)
+    ruta_modelo, mtime_modelo = firma_malla(malla)
+    if ruta_modelo is not None:
+        mesh['modelo'] = {'ruta': ruta_modelo, 'mtime': mtime_modelo}
+
+    obj = bpy.data.objects.new('flota', mesh)
+    etiqueta('coches', obj, mesh)
+    city.objects.link(obj)
+    modificador = obj.modifiers.new('instancias', 'NODES')
+    modificador.node_group = crea_nodos_instancias(variantes)
+
+    with tramo('tabla_coches'):
+        _instancias['puntero'] = obj.as_pointer()
+        _instancias['tabla'] = tabla_coches(coches)
+    escribe_instancias(scene)
+    yield 1.0
+
+def crea_nodos_instancias(variantes):
+    """
+    Función que crea el grupo de nodos de geometría que instancia las variantes del modelo en los puntos
+    de la flota (Instance on Points), con la variante, la rotación y la escala de los atributos de cada punto.
+    Args:
+        variantes (Collection): Colección con un objeto por variante del modelo
+    Returns:
+        arbol (GeometryNodeTree): Grupo de nodos creado
+    """
+    arbol = bpy.data.node_groups.new('instancias_coches', 'GeometryNodeTree')
+    etiqueta('coches', arbol)
+
+    # Sockets de entrada y salida del grupo (la API cambió en Blender 4.0)
+    if hasattr(arbol, 'interface'):
+        arbol.interface.new_socket('Geometry', in_out='INPUT', socket_type='NodeSocketGeometry')
+        arbol.interface.new_socket('Geometry', in_out='OUTPUT', socket_type='NodeSocketGeometry')
+    else:
+        arbol.inputs.new('NodeSocketGeometry', 'Geometry')
+        arbol.outputs.new('NodeSocketGeometry', 'Geometry')
+
+    nodos = arbol.nodes
+    enlaces = arbol.links
+    entrada = nodos.new('NodeGroupInput')
+    salida = nodos.new('NodeGroupOutput')
+
+    # Cada objeto de la colección es una instancia que se puede elegir por su índice
+    coleccion = nodos.new('GeometryNodeCollectionInfo')
+    coleccion.inputs['Collection'].default_value = variantes
+    coleccion.inputs['Separate Children'].default_value = True
+    coleccion.inputs['Reset Children'].default_value = True
+
+    instancias = nodos.new('GeometryNodeInstanceOnPoints')
+    instancias.inputs['Pick Instance'].default_value = True
+    enlaces.new(entrada.outputs[0], instancias.inputs['Points'])
+    enlaces.new(coleccion.outputs[0], instancias.inputs['Instance'])
+
+    for nombre, tipo, socket in (('variante', 'INT', 'Instance Index'), ('rotacion', 'FLOAT_VECTOR', 'Rotation'),
+                                 ('escala', 'FLOAT', 'Scale')):
+        atributo = nodos.new('GeometryNodeInputNamedAttribute')
+        atributo.data_type = tipo
+        atributo.inputs['Name'].default_value = nombre
+        # En versiones anteriores a la 4.0 hay una salida por tipo de dato y solo está activa la del tipo elegido
+        enlaces.new(next(s for s in atributo.outputs if s.enabled), instancias.inputs[socket])
+
+    enlaces.new(instancias.outputs[0], salida.inputs[0])
+    return arbol
+
+def flota_instancias():
+    """
+    Función que devuelve el objeto con la nube de puntos de la flota de instancias, si existe.
+    Returns:
+        obj (Object): Objeto 'flota' (None si no hay flota de instancias)
+    """
+    obj = bpy.data.objects.get('flota')
+    if obj is None or obj.get(ETIQUETA) is None:
+        return None
+    return obj
+
+def firma_instancias(obj):
+    """
+    Función que devuelve el valor que identifica el modelo con el que se generó la flota de instancias
+    (ver modelo.firma_malla).
+    Args:
+        obj (Object): Objeto con la nube de puntos de la flota
+    Returns:
+        firma (tuple): Ruta absoluta y fecha de modificación del fichero (None si no se conocen)
+    """
+    modelo = obj.data.get('modelo')
+    if modelo is None:
+        return (None, None)
+    return (modelo['ruta'], modelo['mtime'])
+
+def obtener_tabla_instancias(obj):
+    """
+    Función que devuelve la tabla de trayectorias de la flota de instancias. Si no está en memoria (por
+    ejemplo tras cargar el fichero) se vuelven a generar las rutas con los parámetros guardados en la malla:
+    como cada vehículo tiene su propia semilla, se obtienen las mismas rutas (o se leen de la caché en disco).
+    Args:
+        obj (Object): Objeto con la nube de puntos de la flota
+    Returns:
+        tabla (TablaFlota): Tabla de trayectorias de la flota
+    """
+    if _instancias['tabla'] is None or _instancias['puntero'] != obj.as_pointer():
+        valores = {nombre: tuple(valor) if hasattr(valor, 'to_list') else valor
+                   for nombre, valor in obj.data['parametros'].items()}
+        coches = calcula_flota(Parametros(**valores), obj.data['n_materiales'], len(obj.data.vertices),
+                               distancias=False, cache=cache_escena(bpy.context.scene),
+                               modelo=firma_instancias(obj))
+        _instancias['puntero'] = obj.as_pointer()
+        _instancias['tabla'] = tabla_coches(coches)
+    return _instancias['tabla']
+
+def escribe_instancias(scene):
+    """
+    Función que evalúa de forma vectorizada las posiciones y orientaciones de la flota de instancias en el
+    fotograma actual y las escribe de una sola vez en los vértices y en el atributo de rotación de la nube
+    de puntos.
+    Args:
+        scene (Scene): Escena con las propiedades de la animación
+    """
+    obj = flota_instancias()
+    if obj is None or len(obj.data.vertices) == 0:
+        return
+
+    tabla = obtener_tabla_instancias(obj)
+    alabeo = np.zeros(tabla.n_vehiculos, dtype=bool)
+    pos, q = calcula_poses(Parametros.desde_escena(scene), tabla, scene.frame_current_final, alabeo)
+
+    mesh = obj.data
+    mesh.vertices.foreach_set('co', pos[0].astype(np.float32).ravel())
+    mesh.attributes['rotacion'].data.foreach_set('vector', euler_xyz(q[0]).astype(np.float32).ravel())
+    mesh.update()
+
 def get_posicion(self, frame, ind):
+    """
+    Driver de la posición del objeto. La posición de los tres ejes se calcula una sola vez por objeto
+    y fotograma (o subfotograma) y se guarda en la memoria de poses, de forma que el resto de drivers
+    del objeto (y get_quaternion) la reutilizan.
+
+    Args:
+        self (Object): Referencia al objeto desde el que se llama el método.
+        frame (float): Número del fotograma en el que estamos calculando la posición del objeto
+        ind (int): Índice del eje que queramos tratar (0 para X, 1 para Y, 2 para Z).
+    Returns:
+        pos (float): Posición en que se encuentra el objeto en el frame deseado.
+    """
+    pose = get_pose(self, frame)
+    if 'posicion' not in pose:
+        pose['posicion'] = tuple(calcula_posicion(self, frame, j) for j in range(3))
+    return pose['posicion'][ind]
+
+def get_pose(obj, frame):
+    """
+    Devuelve la entrada de la memoria de poses de un objeto en un fotograma. La entrada es un diccionario
+    en el que se guardan, según se van calculando, la posición ('posicion') y el cuaternion de orientación
+    ('cuaternion').
+
+    La memoria se vacía cada vez que cambia el fotograma o se modifican los datos de la escena.
+    Args:
+        obj (Object): Objeto del que se quiere obtener la pose
+        frame (float): Fotograma (o subfotograma) de la pose
+    Returns:
+        pose (dict): Entrada de la memoria de poses
+    """
+    poses = _memo_poses.get(obj.as_pointer())
+    if poses is None:
+        poses = _memo_poses[obj.as_pointer()] = {}
+    pose = poses.get(frame)
+    if pose is None:
+        pose = poses[frame] = {}
+    return pose
+
+def calcula_posicion(self, frame, ind):
     """
     Calcula la posición de nuestro objeto en un fotograma especifico de la animación,
     dados unos fotogramas clave, utilizando el algoritmo de interpolación lineal implementado
@@ -264,127 +450,256 @@ def get_posicion(self, frame, ind):
     # Si quieren reparametrizar
     if obj.utilizar:
         if obj.animation_data and obj.animation_data.action:
-            # Obtenemos la curva del fotograma que contiene la información del eje especificado con
-            # la variable ind. Location indica que estamos buscando información sobre la ubicación del objeto.
-            curva_recorrida = obj.animation_data.action.fcurves.find('dist_recorrida')
-            curva_deseada = obj.animation_data.action.fcurves.find('dist_deseada')
-            #Obtenemos la distancia deseada
-            distancia = curva_deseada.evaluate(frame)
-            iterator = 0
-            while (iterator < len(curva_recorrida.keyframe_points) and curva_recorrida.keyframe_points[iterator].co[1] < distancia):
-                iterator = iterator + 1
-
-            if iterator < len(curva_recorrida.keyframe_points):
-                #Obtenemos el frame donde se encuentra la distancia en la curva de distancia recorrida 
-                frame = interpola_lineal(curva_recorrida.keyframe_points[iterator-1].co[1],
-                             curva_recorrida.keyframe_points[iterator].co[1], 
-                             curva_recorrida.keyframe_points[iterator-1].co[0],
-                             curva_recorrida.keyframe_points[iterator].co[0], distancia)
-            else:
-                frame = curva_recorrida.keyframe_points[-1].co[0]
-            
-            
-    # Obtenemos la curva del fotograma que contiene la información del eje especificado con
-    # la variable ind. Location indica que estamos buscando información sobre la ubicación del objeto.
-    curva = obj.animation_data.action.fcurves.find('location', index=ind)
-    
-    i = 0 # Empezamos a mirar desde el fotograma principal
-    # Bucle para encontrar el par de fotogramas entre los que se encuentra el fotograma deseado
-    while i < len(curva.keyframe_points) and curva.keyframe_points[i].co[0] < frame:
-        i = i + 1
-    
-    if interpolation_method == 'CATMULL':
-        # Si solo hay dos keyframes
-        if len(curva.keyframe_points) == 2:
-            if i<=0:
-                # Caso 1: El fotograma deseado esta antes que el primer fotograma clave y se toma la posición del primer fotograma clave
-                pos = curva.keyframe_points[0].co[1] 
-            elif i >= len(curva.keyframe_points):
-                # Caso 2: El fotograma deseado esta después del ultimo fotograma clave y se toma la posición del último fotograma clave
-                pos = curva.keyframe_points[i-1].co[1]
-            else:
-                pos = interpola_catmull_rom(
-                    bpy.context.scene.tau_value,      # Tensión de la curva
-                    curva.keyframe_points[i-1].co[0], # Tiempo del fotograma anterior
-                    curva.keyframe_points[i].co[0],   # Tiempo del fotograma siguiente
-                    curva.keyframe_points[i-1].co[1], # Posición del fotograma anterior (no hay otro previo)
-                    curva.keyframe_points[i-1].co[1], # Posición del fotograma anterior
-                    curva.keyframe_points[i].co[1],   # Posición del fotograma siguiente
-                    curva.keyframe_points[i].co[1],   # Posición del fotograma siguiente (no hay otro después)
-                    frame                             # El fotograma deseado para el cálculo
-                    )
-        else:
-            if i<=0:
-                # Caso 1: El fotograma deseado esta antes que el primer fotograma clave y se toma la posición del primer fotograma clave
-                pos = curva.keyframe_points[0].co[1] 
-            elif i >= len(curva.keyframe_points):
-                # Caso 2: El fotograma deseado esta después del ultimo fotograma clave y se toma la posición del último fotograma clave
-                pos = curva.keyframe_points[i-1].co[1] 
-            elif i < 2:
-                # Caso 3: Como no hay fotograma previo al anterior, se coge el anterior
-                pos = interpola_catmull_rom(
-                    bpy.context.scene.tau_value,      # Valor de la tensión
-                    curva.keyframe_points[i-1].co[0], # Tiempo del fotograma anterior
-                    curva.keyframe_points[i].co[0],   # Tiempo del fotograma siguiente
-                    curva.keyframe_points[i-1].co[1], # Posición del fotograma anterior (no hay otro previo)
-                    curva.keyframe_points[i-1].co[1], # Posición del fotograma anterior
-                    curva.keyframe_points[i].co[1],   # Posición del fotograma siguiente
-                    curva.keyframe_points[i+1].co[1], # Posición del fotograma siguiente siguiente
-                    frame                             # El fotograma deseado para el cálculo
-                    )
-            elif i > len(curva.keyframe_points)-3:
-                # Caso 4: Como no hay fotograma posterior al siguiente, se utiliza el siguiente
-                pos = interpola_catmull_rom(
-                    bpy.context.scene.tau_value,      # Tensión de la curva
-                    curva.keyframe_points[i-1].co[0], # Tiempo del fotograma anterior
-                    curva.keyframe_points[i].co[0],   # Tiempo del fotograma siguiente
-                    curva.keyframe_points[i-2].co[1], # Posición del fotograma anterior del anterior
-                    curva.keyframe_points[i-1].co[1], # Posición del fotograma anterior
-                    curva.keyframe_points[i].co[1],   # Posición del fotograma siguiente 
-                    curva.keyframe_points[i].co[1],   # Posición del fotograma siguiente (no hay otro después)
-                    frame                             # El fotograma deseado para el cálculo
-                    )
-            else:
-                # Caso general: Se calcula con interpolación Catmull-Rom la posición del fotograma
-                pos = interpola_catmull_rom(
-                    bpy.context.scene.tau_value,      # Tensión de la curva
-                    curva.keyframe_points[i-1].co[0], # Tiempo del fotograma anterior
-                    curva.keyframe_points[i].co[0],   # Tiempo del fotograma siguiente
-                    curva.keyframe_points[i-2].co[1], # Posición del fotograma anterior del anterior
-                    curva.keyframe_points[i-1].co[1], # Posición del fotograma anterior
-                    curva.keyframe_points[i].co[1],   # Posición del fotograma siguiente
-                    curva.keyframe_points[i+1].co[1], # Posición del fotograma siguiente del siguiente
-                    frame                             # El fotograma deseado para el cálculo
-                    )
-    elif interpolation_method == 'HERMITE':
-        if i==0:
-            pos = curva.keyframe_points[0].co[1]
-        elif i == len(curva.keyframe_points):
-            pos = curva.keyframe_points[i-1].co[1]
-        else:
-            v1 = 15*(curva.keyframe_points[i-1].handle_right[1] - curva.keyframe_points[i-1].handle_left[1])
-            v2 = 15*(curva.keyframe_points[i].handle_right[1] - curva.keyframe_points[i].handle_left[1])
-
-            pos = interpola_hermite(curva.keyframe_points[i-1].co[0], curva.keyframe_points[i].co[0], curva.keyframe_points[i-1].co[1], curva.keyframe_points[i].co[1], v1, v2, frame)    
-    elif interpolation_method == 'LINEAL':
-        if i==0:
-            pos = curva.keyframe_points[0].co[1]
-        elif i == len(curva.keyframe_points):
-            pos = curva.keyframe_points[i-1].co[1]
-        else:
-            pos = interpola_lineal(curva.keyframe_points[i-1].co[0], curva.keyframe_points[i].co[0], curva.keyframe_points[i-1].co[1], curva.keyframe_points[i].co[1], frame)
-    return pos
+            frame = frame_reparametrizado(obj, frame)
+
+    # Obtenemos la trayectoria precompilada del objeto y evaluamos el eje especificado con la
+    # variable ind: búsqueda binaria del tramo y un paso de Horner con sus coeficientes precalculados
+    # (la tensión y los casos de los extremos de Catmull-Rom ya están incluidos en los coeficientes)
+    tray = obtener_trayectoria(obj)
+    pos = tray.evalua(ind, frame, interpolation_method, bpy.context.scene.tau_value)
+    return float(pos)
+
+def frame_reparametrizado(obj, frame):
+    """
+    Obtiene el fotograma de la trayectoria en el que el objeto ha recorrido la distancia deseada
+    en un fotograma de la animación (reparametrización por longitud de arco).
+    Args:
+        obj (Object): Objeto con las curvas de distancia recorrida y deseada
+        frame (float): Fotograma de la animación
+    Returns:
+        frame (float): Fotograma de la trayectoria que corresponde a la distancia deseada
+    """
+    #Obtenemos la distancia deseada
+    curva_deseada = obj.animation_data.action.fcurves.find('dist_deseada')
+    distancia = curva_deseada.evaluate(frame)
+
+    #Obtenemos por búsqueda binaria el frame donde se encuentra la distancia en la curva de distancia recorrida
+    return obtener_indice_distancia(obj).frame(distancia)
+
+def obtener_indice_distancia(obj):
+    """
+    Devuelve el índice de distancia recorrida de un objeto, guardado en una caché indexada por objeto.
+    Si el objeto no está en la caché, o su acción ha cambiado, se vuelve a leer de la curva dist_recorrida.
+    Args:
+        obj (Object): Objeto del que se quiere obtener el índice
+    Returns:
+        indice (IndiceDistancia): Índice de distancia recorrida del objeto
+    """
+    accion = obj.animation_data.action
+    firma = accion.as_pointer()
+    indice = _cache_distancias.get(obj.as_pointer())
+
+    if indice is None or indice.firma != firma:
+        puntos = accion.fcurves.find('dist_recorrida').keyframe_points
+        co = np.empty(2*len(puntos), dtype=np.float32)
+        puntos.foreach_get('co', co)
+        indice = IndiceDistancia(firma, co[0::2], co[1::2])
+        _cache_distancias[obj.as_pointer()] = indice
+    return indice
+
+def obtener_trayectoria(obj):
+    """
+    Devuelve la trayectoria precompilada de un objeto, guardada en una caché indexada por objeto.
+    Si el objeto no está en la caché, o su acción ha cambiado, se vuelve a leer de sus fcurves.
+    Args:
+        obj (Object): Objeto del que se quiere obtener la trayectoria
+    Returns:
+        tray (Trayectoria): Trayectoria precompilada del objeto
+    """
+    accion = obj.animation_data.action
+    firma = accion.as_pointer()
+    tray = _cache_trayectorias.get(obj.as_pointer())
+
+    if tray is None or tray.firma != firma:
+        tray = lee_trayectoria(accion)
+        _cache_trayectorias[obj.as_pointer()] = tray
+    return tray
+
+def lee_trayectoria(accion):
+    """
+    Lee de una sola vez con foreach_get los fotogramas clave de las fcurves de posición de una acción
+    y crea su trayectoria precompilada.
+    Args:
+        accion (Action): Acción con las fcurves de posición del vehículo
+    Returns:
+        tray (Trayectoria): Trayectoria precompilada
+    """
+    tiempos = []
+    valores = []
+    velocidades = []
+    for ind in range(3):
+        puntos = accion.fcurves.find('location', index=ind).keyframe_points
+        n = len(puntos)
+        co = np.empty(2*n, dtype=np.float32)
+        izq = np.empty(2*n, dtype=np.float32)
+        der = np.empty(2*n, dtype=np.float32)
+        puntos.foreach_get('co', co)
+        puntos.foreach_get('handle_left', izq)
+        puntos.foreach_get('handle_right', der)
+
+        tiempos.append(co[0::2])
+        valores.append(co[1::2])
+        # Velocidad de Hermite a partir de la diferencia de altura de los manejadores
+        velocidades.append(15*(der[1::2].astype(np.float64) - izq[1::2]))
+    return Trayectoria(accion.as_pointer(), tiempos, valores, velocidades)
+
+def invalidar_trayectorias(obj=None, accion=None):
+    """
+    Elimina trayectorias de la caché, junto con sus poses memorizadas. Sin argumentos se vacía la
+    caché completa.
+    Args:
+        obj (Object): Objeto cuya trayectoria se elimina
+        accion (Action): Acción cuyas trayectorias se eliminan
+    """
+    _flota['tabla'] = None
+    if obj is not None:
+        _cache_trayectorias.pop(obj.as_pointer(), None)
+        _cache_distancias.pop(obj.as_pointer(), None)
+        _memo_poses.pop(obj.as_pointer(), None)
+    elif accion is not None:
+        firma = accion.as_pointer()
+        for clave in [c for c, tray in _cache_trayectorias.items() if tray.firma == firma]:
+            del _cache_trayectorias[clave]
+            _memo_poses.pop(clave, None)
+        for clave in [c for c, indice in _cache_distancias.items() if indice.firma == firma]:
+            del _cache_distancias[clave]
+    else:
+        _cache_trayectorias.clear()
+        _cache_distancias.clear()
+        _memo_poses.clear()
+        _instancias['tabla'] = None
+
+@persistent
+def actualiza_caches(scene, depsgraph=None):
+    """
+    Handler de Blender que se ejecuta cuando se modifican los datos de la escena. Vacía la memoria de
+    poses (pueden haber cambiado propiedades como el método de interpolación o el alabeo) e invalida
+    las trayectorias de las acciones que se han modificado (por ejemplo al editar los fotogramas
+    clave en el editor de gráficas).
+    """
+    _memo_poses.clear()
+    if depsgraph is None:
+        return
+    for update in depsgraph.updates:
+        if isinstance(update.id, bpy.types.Action):
+            invalidar_trayectorias(accion=update.id.original)
+        elif isinstance(update.id, bpy.types.Collection):
+            # Pueden haberse añadido o eliminado vehículos de la flota
+            _flota['tabla'] = None
+
+@persistent
+def limpia_memo_poses(scene, depsgraph=None):
+    """
+    Handler de Blender que vacía la memoria de poses cuando cambia el fotograma.
+    """
+    _memo_poses.clear()
+
+@persistent
+def limpia_cache_trayectorias(*args):
+    """
+    Handler de Blender que vacía la caché de trayectorias y cierra el almacén de trayectorias al cargar un
+    fichero.
+    """
+    invalidar_trayectorias()
+    cierra_almacen()
 
 def get_quaternion(self, frame, axis):
+    """
+    Driver de la rotación del objeto. La orientación se calcula una sola vez por objeto y fotograma
+    (o subfotograma) con calcula_orientacion y se guarda en la memoria de poses, de forma que los
+    cuatro componentes del cuaternion la reutilizan.
+    Args:
+        self (Object): Referencia al objeto desde el que se llama el método.
+        frame (float): Número del fotograma en el que estamos calculando la posición del objeto
+        axis (int): Índice del componente del cuaternion (0 para W, 1 para X, 2 para Y, 3 para Z).
+    Returns:
+        qFinal (float): Componente del quaternion de rotación del objeto en el frame deseado.
+    """
+    pose = get_pose(self, frame)
+    if 'cuaternion' not in pose:
+        _, qFinal, _ = calcula_orientacion(self, frame)
+        pose['cuaternion'] = tuple(qFinal)
+    return pose['cuaternion'][axis]
+
+def perfila_driver(funcion, canal, clave_memo):
+    """
+    Crea la versión perfilada de un driver de los vehículos: mide la duración de cada llamada y comprueba, antes
+    de llamarlo, si la pose ya está en la memoria de poses y si la trayectoria y el índice de distancia del
+    vehículo están en sus cachés.
+    Args:
+        funcion (function): Driver original (get_posicion o get_quaternion)
+        canal (String): Propiedad animada por el driver
+        clave_memo (String): Entrada de la memoria de poses que calcula el driver
+    Returns:
+        driver (function): Driver perfilado, con los mismos argumentos que el original
+    """
+    def driver(self, frame, ind):
+        puntero = self.as_pointer()
+        acierto = clave_memo in _memo_poses.get(puntero, {}).get(frame, {})
+        if not acierto:
+            firma = self.animation_data.action.as_pointer()
+            tray = _cache_trayectorias.get(puntero)
+            _perfil.cuenta('trayectorias', tray is not None and tray.firma == firma)
+            if self.utilizar:
+                indice = _cache_distancias.get(puntero)
+                _perfil.cuenta('distancias', indice is not None and indice.firma == firma)
+
+        inicio = time.perf_counter()
+        valor = funcion(self, frame, ind)
+        duracion = time.perf_counter() - inicio
+
+        if self.name not in _perfil.atributos:
+            _perfil.atributos[self.name] = {'reparametrizado': self.utilizar,
+                                            'alabeo': self.utilizar_alabeo or bpy.context.scene.activar_alabeo}
+        _perfil.registra(self.name, '{}[{}]'.format(canal, ind), frame, duracion, acierto)
+        return valor
+    return driver
+
+def activa_perfil(activar):
+    """
+    Activa o desactiva el perfilador de drivers sustituyendo las funciones registradas en driver_namespace
+    por sus versiones perfiladas (o restaurando las originales). Las estadísticas anteriores se descartan.
+    Args:
+        activar (bool): True para activar el perfilador
+    """
+    _perfil.reinicia()
+    if activar:
+        bpy.app.driver_namespace['get_pos'] = perfila_driver(get_posicion, 'location', 'posicion')
+        bpy.app.driver_namespace['get_quat'] = perfila_driver(get_quaternion, 'rotation_quaternion', 'cuaternion')
+    else:
+        bpy.app.driver_namespace['get_pos'] = get_posicion
+        bpy.app.driver_namespace['get_quat'] = get_quaternion
+
+def cambia_perfil(self, context):
+    """
+    Función que se ejecuta al activar o desactivar el perfilador de drivers en el panel.
+    """
+    activa_perfil(self.perfilar_drivers)
+
+@persistent
+def restaura_perfil(*args):
+    """
+    Handler de Blender que activa el perfilador de drivers al cargar un fichero en el que estaba activado.
+    """
+    activa_perfil(bpy.context.scene.perfilar_drivers)
+
+def perfil_drivers():
+    """
+    Devuelve las estadísticas del perfilador de drivers (ver perfil.PerfilDrivers).
+    """
+    return _perfil
+
+def calcula_orientacion(obj, frame):
     """
     Calcula el quaternion de rotación del objeto determinando un vector con las posiciones actual
     y anterior del objeto y otro vector con la dirección tangente deseada.
     Args:
-        self (Object): Referencia al objeto desde el que se llama el método.
-        frame (int): Número del fotograma en el que estamos calculando la posición del objeto
-        axis (int): Índice del eje que queramos tratar (0 para X, 1 para Y, 2 para Z).
+        obj (Object): Objeto del que se calcula la orientación.
+        frame (float): Número del fotograma en el que estamos calculando la posición del objeto
     Returns:
-        qFinal (float): Quaternion de rotación del objeto en el frame deseado.
+        vTangente (Vector): Vector tangente (normalizado) de la trayectoria en el frame deseado.
+        qFinal (Quaternion): Quaternion de rotación del objeto en el frame deseado.
+        alabeo (float): Ángulo de alabeo aplicado (en radianes).
     """
     # Vector que marca la dirección inicial del objeto vehículo
     vDirector = mathutils.Vector(bpy.context.scene.v_director)
@@ -392,12 +707,12 @@ def get_quaternion(self, frame, axis):
     ## Obtención de las posiciones que forman el vector tangente
     # Para el primer fotograma se calcula la trayectoria entre el primer keyframe y el siguiente (ya que no hay keyframe anterior)
     if frame == bpy.context.scene.frame_start:
-        v1 = mathutils.Vector([get_posicion(self, frame+1, 0), get_posicion(self, frame+1, 1), get_posicion(self, frame+1, 2)])
-        v0 = mathutils.Vector([get_posicion(self, frame, 0), get_posicion(self, frame, 1), get_posicion(self, frame, 2)])
+        v1 = mathutils.Vector([get_posicion(obj, frame+1, 0), get_posicion(obj, frame+1, 1), get_posicion(obj, frame+1, 2)])
+        v0 = mathutils.Vector([get_posicion(obj, frame, 0), get_posicion(obj, frame, 1), get_posicion(obj, frame, 2)])
     # Para el resto de fotogramas la trayectoria se calcula con el keyframe anterior y el actual.
     else:
-        v0 = mathutils.Vector([get_posicion(self, frame-1, 0), get_posicion(self, frame-1, 1), get_posicion(self, frame-1, 2)])
-        v1 = mathutils.Vector([get_posicion(self, frame, 0), get_posicion(self, frame, 1), get_posicion(self, frame, 2)])
+        v0 = mathutils.Vector([get_posicion(obj, frame-1, 0), get_posicion(obj, frame-1, 1), get_posicion(obj, frame-1, 2)])
+        v1 = mathutils.Vector([get_posicion(obj, frame, 0), get_posicion(obj, frame, 1), get_posicion(obj, frame, 2)])
 
     # Vector tangente de la trayectoria
     vTangente = v1 - v0
@@ -428,20 +743,23 @@ def get_quaternion(self, frame, axis):
         qFinal =  q180y @ qFinal
     
     ## Aplicación de una rotación adicional
-    if self.utilizar_alabeo == True or bpy.context.scene.activar_alabeo == True:
+    if obj.utilizar_alabeo == True or bpy.context.scene.activar_alabeo == True:
             
         # Calculo del vector tangente anterior (necesario para el cuaternion de alabeo)
         if frame == bpy.context.scene.frame_start or frame == bpy.context.scene.frame_start + 1:
             vTangenteAnterior = mathutils.Vector([0, 0, 0])
         else:
-            v0 = mathutils.Vector([get_posicion(self, frame-2, 0), get_posicion(self, frame-2, 1), get_posicion(self, frame-2, 2)])
-            v1 = mathutils.Vector([get_posicion(self, frame-1, 0), get_posicion(self, frame-1, 1), get_posicion(self, frame-1, 2)])
+            v0 = mathutils.Vector([get_posicion(obj, frame-2, 0), get_posicion(obj, frame-2, 1), get_posicion(obj, frame-2, 2)])
+            v1 = mathutils.Vector([get_posicion(obj, frame-1, 0), get_posicion(obj, frame-1, 1), get_posicion(obj, frame-1, 2)])
             vTangenteAnterior = v1 - v0
         
-        qAlabeo = get_quat_alabeo(vTangenteSinNormalizar, vTangenteAnterior)
+        alabeo = get_angulo_alabeo(vTangenteSinNormalizar, vTangenteAnterior)
+        qAlabeo = mathutils.Quaternion(vTangenteSinNormalizar, alabeo)
         qFinal = qAlabeo @ qFinal
+    else:
+        alabeo = 0.0
 
-    return qFinal[axis]
+    return vTangente, qFinal, alabeo
 
 def get_quat_from_vecs(e, t):
     """
@@ -505,6 +823,19 @@ def get_quat_alabeo(t, tAnt):
     Returns:
         q (float): Quaternion de alabeo del objeto en el frame deseado.
     """
+    # Calculamos el cuaternion de alabeo
+    q = mathutils.Quaternion(t, get_angulo_alabeo(t, tAnt))
+    return q
+
+def get_angulo_alabeo(t, tAnt):
+    """
+    Función que recibe los vectores tangentes actual y anterior para calcular el ángulo de alabeo.
+    Args:
+        t (Vector): Vector tangente del objeto
+        tAnt (Vector): Vector tangente anterior del objeto
+    Returns:
+        angle (float): Ángulo de alabeo del objeto en el frame deseado (en radianes).
+    """
     # Obtenemos el vector lateral de la trayectoria
     l = get_lat_vec(t)
 
@@ -523,43 +854,59 @@ def get_quat_alabeo(t, tAnt):
     angle = min(max(-45, angle), 45)
     
     # Convertimos el ángulo a radianes
-    angle = math.radians(angle)
-
-    # Calculamos el cuaternion de alabeo
-    q = mathutils.Quaternion(t, angle)
-    return q
+    return math.radians(angle)
 
+@medido
 def ObtenerCurvaDistancia_Recorrida(obj):
     """
     Función que crea la curva con la distancia total recorrida del objeto
     Args:
         obj (Object): Objeto del que se estan modificando las propiedades
     """
-    # Cuando quieren recalcular, borramos la curva
-    if obj.animation_data.action.fcurves.find('dist_recorrida'):
-        obj.animation_data.action.fcurves.remove(obj.animation_data.action.fcurves.find('dist_recorrida'))    
+    # La trayectoria precompilada puede estar desactualizada si se han modificado los fotogramas clave
+    invalidar_trayectorias(obj)
 
-    distancia = 0
+    # Muestreamos la trayectoria en todos los fotogramas de la animación de una sola vez y acumulamos
+    # los módulos de los desplazamientos entre fotogramas
+    scene = bpy.context.scene
+    frames = np.arange(0, scene.frame_end+1, dtype=np.float64)
+    distancias = obtener_trayectoria(obj).distancia_recorrida(frames, scene.interpolation_method, scene.tau_value)
+    escribe_distancia_recorrida(obj, frames, distancias)
 
-    #Insertamos kf en frame = 0
-    obj.dist_recorrida = distancia
-    obj.keyframe_insert(data_path="dist_recorrida", frame=0)
-    
-    #Para el resto de frames calculamos la distancia recorrida
-    for i in range(1, bpy.context.scene.frame_end+1):
-        #Obtenemos un vector con la distancia entre puntos por coordenadas
-        p = mathutils.Vector([get_posicion(obj, i, j) - get_posicion(obj, i-1, j) for j in range(3)])
-        #Hacemos el modulo para sacar la distancia y la sumamos
-        distancia += p.length
-        obj.dist_recorrida = distancia
-        obj.keyframe_insert(data_path="dist_recorrida", frame=i)
-
-    # Convertimos la interpolacion de blender a lineal
-    set_interpolation_to_linear(obj, 'dist_recorrida')
+def escribe_distancia_recorrida(obj, frames, distancias):
+    """
+    Función que escribe en una sola pasada la curva de distancia recorrida del objeto, con interpolación lineal
+    (sustituyendo la anterior si quieren recalcular).
+    Args:
+        obj (Object): Objeto del que se estan modificando las propiedades
+        frames (array): Fotogramas de la curva
+        distancias (array): Distancia recorrida en cada fotograma
+    """
+    obj.dist_recorrida = distancias[-1]
+    escribe_fcurve(obj.animation_data.action, 'dist_recorrida', 0, frames, distancias, interpolacion='LINEAR')
 
-        
-    
+    # El índice de distancia de la reparametrización se reconstruye a partir de la nueva curva
+    _cache_distancias.pop(obj.as_pointer(), None)
+
+@medido
+def RecalculaDistancias():
+    """
+    Función que vuelve a calcular la curva de distancia recorrida de todos los vehículos de la flota, por
+    ejemplo al cambiar el método de interpolación o la tensión sin volver a generar la ciudad. Las curvas
+    de distancia deseada no se modifican.
+    """
+    agota(RecalculaDistanciasPasos())
+
+def RecalculaDistanciasPasos():
+    """
+    Versión por pasos de RecalculaDistancias (ver pasos.py): devuelve el avance después de cada vehículo.
+    """
+    coches = coches_flota()
+    for i, obj in enumerate(coches):
+        ObtenerCurvaDistancia_Recorrida(obj)
+        yield (i + 1) / len(coches)
 
+@medido
 def InicializarDistancia_Deseada(obj):
     """
     Función que inicializa la distancia deseada del objeto en cada fotograma de la animación.
@@ -577,7 +924,7 @@ def InicializarDistancia_Deseada(obj):
 
         if curva:
             #Insertamos 2 kf para inicializar la curva
-            bpy.context.object.dist_deseada = curva.keyframe_points[0].co[1]
+            obj.dist_deseada = curva.keyframe_points[0].co[1]
             obj.keyframe_insert(data_path="dist_deseada", frame=curva.keyframe_points[0].co[0])
             obj.dist_deseada = curva.keyframe_points[bpy.context.scene.frame_end].co[1]
             obj.keyframe_insert(data_path="dist_deseada", frame=bpy.context.scene.frame_end)
@@ -597,5 +944,420 @@ def set_interpolation_to_linear(obj, data_path):
         if fcurve:
             for keyframe in fcurve.keyframe_points:
                 keyframe.interpolation = 'LINEAR'
-    
-    
\ No newline at end of file
+
+@medido
+def CreateDrivers(obj):
+    """
+    Función que añade al vehículo los drivers de posición (3) y de rotación (4) que calculan su
+    movimiento con get_posicion y get_quaternion.
+    Args:
+        obj (Object): Vehículo al que se añaden los drivers
+    """
+    for ind in (2, 1, 0):
+        drv = obj.driver_add('location', ind).driver
+        drv.use_self = True
+        drv.expression = "get_pos(self, frame, {})".format(ind)
+
+    obj.rotation_mode = 'QUATERNION'
+    for ind in range(4):
+        drv = obj.driver_add('rotation_quaternion', ind).driver
+        drv.use_self = True
+        drv.expression = "get_quat(self, frame, {})".format(ind)
+    cuenta('drivers', 7)
+
+def RemoveDrivers(obj):
+    """
+    Función que elimina los drivers de posición y rotación del vehículo.
+    Args:
+        obj (Object): Vehículo del que se eliminan los drivers
+    """
+    obj.driver_remove('location')
+    obj.driver_remove('rotation_quaternion')
+
+def silencia_curvas_posicion(obj, silenciar=True):
+    """
+    Función que silencia (o vuelve a activar) las fcurves de posición del vehículo. En el modo de
+    reproducción por handler las fcurves solo guardan los fotogramas clave de la ruta, y no deben
+    sobrescribir la posición calculada por el handler.
+    Args:
+        obj (Object): Vehículo
+        silenciar (bool): True para silenciar las fcurves, False para activarlas
+    """
+    if obj.animation_data and obj.animation_data.action:
+        for fcurve in obj.animation_data.action.fcurves:
+            if fcurve.data_path == 'location':
+                fcurve.mute = silenciar
+
+def coches_flota():
+    """
+    Función que devuelve los vehículos de la ciudad que tienen una trayectoria animada (sin hornear ni exportar
+    al almacén de trayectorias).
+    Returns:
+        coches (List): Vehículos de la flota
+    """
+    city = bpy.data.collections.get('ciudad')
+    if city is None:
+        return []
+    return [obj for obj in city.objects
+            if obj.name.startswith('coche') and obj.type != 'EMPTY' and not obj.horneado and obj.fila_almacen < 0
+            and obj.animation_data and obj.animation_data.action]
+
+def obtener_tabla_flota():
+    """
+    Función que devuelve la tabla con las trayectorias de toda la flota, creándola si no existe o
+    si se ha invalidado.
+    Returns:
+        coches (List): Vehículos de la flota (en el orden de las filas de la tabla)
+        tabla (TablaFlota): Tabla de trayectorias de la flota
+    """
+    if _flota['tabla'] is not None:
+        try:
+            [obj.name for obj in _flota['coches']]
+        except ReferenceError:
+            # Algún vehículo se ha eliminado desde que se creó la tabla: se reconstruye
+            _flota['tabla'] = None
+
+    if _flota['tabla'] is None:
+        coches = coches_flota()
+        _flota['coches'] = coches
+        _flota['tabla'] = TablaFlota([obtener_trayectoria(obj) for obj in coches])
+    return _flota['coches'], _flota['tabla']
+
+def poses_flota(scene, coches, tabla, frames):
+    """
+    Función que evalúa de forma vectorizada las posiciones y orientaciones de toda la flota en varios
+    fotogramas con core.calcula_poses, a partir de las propiedades de la escena y de los vehículos.
+    Args:
+        scene (Scene): Escena con las propiedades de la animación
+        coches (List): Vehículos de la flota
+        tabla (TablaFlota): Tabla de trayectorias de la flota
+        frames (array): Fotogramas que se quieren evaluar
+    Returns:
+        pos (array): Array (fotogramas, vehículos, 3) con las posiciones
+        q (array): Array (fotogramas, vehículos, 4) con los cuaterniones de rotación
+    """
+    alabeo = [obj.utilizar_alabeo for obj in coches]
+
+    # Los vehículos reparametrizados convierten los fotogramas de la animación con sus curvas de distancia
+    reparametrizacion = {fila: frames_reparametrizados(obj) for fila, obj in enumerate(coches) if obj.utilizar}
+
+    return calcula_poses(Parametros.desde_escena(scene), tabla, frames, alabeo, reparametrizacion)
+
+def frames_reparametrizados(obj):
+    """
+    Devuelve la función que convierte un array de fotogramas de la animación en los fotogramas de la
+    trayectoria del objeto en los que ha recorrido la distancia deseada.
+    Args:
+        obj (Object): Objeto con las curvas de distancia recorrida y deseada
+    Returns:
+        funcion (function): Función de conversión de los fotogramas
+    """
+    deseada = obj.animation_data.action.fcurves.find('dist_deseada')
+    indice = obtener_indice_distancia(obj)
+    return lambda muestras: indice.frames_de([deseada.evaluate(f) for f in muestras.tolist()])
+
+@persistent
+def actualiza_flota(scene, depsgraph=None):
+    """
+    Handler de Blender (frame_change_pre) que anima toda la flota sin drivers. Evalúa de forma vectorizada
+    las posiciones y orientaciones de todos los vehículos en el fotograma actual a partir de la tabla de
+    trayectorias, y las escribe en los objetos (o en la nube de puntos en el modo de instancias).
+    """
+    if scene.modo_animacion == 'INSTANCES':
+        escribe_instancias(scene)
+        return
+
+    # Los vehículos exportados al almacén de trayectorias se animan con él en los modos con objetos
+    anima_almacen(scene)
+    if scene.modo_animacion != 'HANDLER':
+        return
+
+    coches, tabla = obtener_tabla_flota()
+    if len(coches) == 0:
+        return
+
+    pos, q = poses_flota(scene, coches, tabla, scene.frame_current_final)
+    escribe_transformaciones(coleccion_flota(_flota, 'flota_handler'), coches, pos[0], q[0])
+
+def coleccion_flota(estado, nombre):
+    """
+    Función que devuelve una colección con los vehículos de estado['coches'] en el mismo orden, para escribir sus
+    poses de una sola vez con escribe_transformaciones. La colección no se enlaza a la escena (los vehículos
+    siguen en la colección de la ciudad) y solo se comprueba cuando cambia la lista de vehículos.
+    Args:
+        estado (dict): Estado de la flota (_flota o _almacen) en el que se guarda la colección
+        nombre (String): Nombre de la colección
+    Returns:
+        coleccion (Collection): Colección con los vehículos
+    """
+    coches = estado['coches']
+    if estado['coleccion'] is not None and estado['coleccion_coches'] is coches:
+        try:
+            estado['coleccion'].name
+            return estado['coleccion']
+        except ReferenceError:
+            pass
+
+    coleccion = bpy.data.collections.get(nombre)
+    if coleccion is None:
+        coleccion = bpy.data.collections.new(nombre)
+        etiqueta('coches', coleccion)
+    if list(coleccion.objects) != coches:
+        for obj in list(coleccion.objects):
+            coleccion.objects.unlink(obj)
+        for obj in coches:
+            coleccion.objects.link(obj)
+    estado.update(coleccion=coleccion, coleccion_coches=coches)
+    return coleccion
+
+def escribe_transformaciones(coleccion, coches, pos, q):
+    """
+    Función que escribe las posiciones y rotaciones de varios vehículos de una sola vez, con un foreach_set
+    por propiedad sobre los objetos de su colección, en lugar de asignarlas objeto a objeto.
+    Args:
+        coleccion (Collection): Colección con los vehículos en el orden de las poses (ver coleccion_flota)
+        coches (List): Vehículos de la colección
+        pos (array): Array (vehículos, 3) con las posiciones
+        q (array): Array (vehículos, 4) con los cuaterniones de rotación
+    """
+    coleccion.objects.foreach_set('location', np.ascontiguousarray(pos, dtype=np.float32).ravel())
+    coleccion.objects.foreach_set('rotation_quaternion', np.ascontiguousarray(q, dtype=np.float32).ravel())
+
+    # foreach_set no avisa al depsgraph de los cambios (como al escribir los vértices de una malla), y no hay
+    # forma de marcar varios objetos a la vez: se marca cada uno, que es mucho más barato que asignar sus
+    # propiedades (sin convertir las poses en listas de Python ni las comprobaciones de cada asignación)
+    for obj in coches:
+        obj.update_tag(refresh={'OBJECT'})
+
+def escribe_fcurve(accion, data_path, index, frames, valores, grupo=None, interpolacion=None):
+    """
+    Función que crea (o sustituye) una fcurve y escribe todos sus fotogramas clave de una sola vez
+    con keyframe_points.add y foreach_set, en lugar de insertarlos uno a uno con keyframe_insert.
+    Args:
+        accion (Action): Acción en la que se crea la fcurve
+        data_path (String): Propiedad animada por la fcurve
+        index (int): Índice de la propiedad (0 si no es un vector)
+        frames (array): Fotogramas de los fotogramas clave
+        valores (array): Valores de los fotogramas clave
+        grupo (String): Grupo de la fcurve en la acción (opcional)
+        interpolacion (String): Interpolación de los fotogramas clave (opcional, p. ej. 'LINEAR')
+    Returns:
+        fcurve (FCurve): fcurve creada
+    """
+    fcurve = accion.fcurves.find(data_path, index=index)
+    if fcurve:
+        accion.fcurves.remove(fcurve)
+    if grupo:
+        fcurve = accion.fcurves.new(data_path, index=index, action_group=grupo)
+    else:
+        fcurve = accion.fcurves.new(data_path, index=index)
+
+    n = len(frames)
+    co = np.empty(2*n, dtype=np.float32)
+    co[0::2] = frames
+    co[1::2] = valores
+
+    puntos = fcurve.keyframe_points
+    puntos.add(n)
+    cuenta('claves', n)
+    puntos.foreach_set('co', co)
+    if interpolacion is not None:
+        valor = bpy.types.Keyframe.bl_rna.properties['interpolation'].enum_items[interpolacion].value
+        puntos.foreach_set('interpolation', np.full(n, valor, dtype=np.int32))
+
+    # Ordena los fotogramas clave y recalcula los manejadores
+    fcurve.update()
+    return fcurve
+
+def BakeFleet():
+    """
+    Función que hornea la animación de todos los vehículos en fcurves normales. Evalúa de forma vectorizada
+    toda la flota entre frame_start y frame_end, escribe una fcurve densa por canal de posición y de rotación
+    y elimina los drivers y las curvas de distancia. La escena horneada se reproduce sin ejecutar Python.
+    Los vehículos exportados al almacén de trayectorias se hornean con las poses del almacén.
+    """
+    scene = bpy.context.scene
+    coches, tabla = obtener_tabla_flota()
+    if len(coches) > 0:
+        frames = np.arange(scene.frame_start, scene.frame_end + 1, dtype=np.float64)
+        pos, q = poses_flota(scene, coches, tabla, frames)
+        for fila, obj in enumerate(coches):
+            escribe_poses(obj, frames, pos[:, fila], q[:, fila])
+
+    coches, almacen = obtener_almacen(scene)
+    if almacen is not None:
+        for obj in coches:
+            poses = np.asarray(almacen.datos[:, obj.fila_almacen], dtype=np.float64)
+            escribe_poses(obj, almacen.frames, poses[:, :3], poses[:, 3:])
+            obj.fila_almacen = -1
+        cierra_almacen()
+
+    invalidar_trayectorias()
+
+def limpia_curvas(obj):
+    """
+    Función que elimina los drivers de un vehículo y las curvas de su ruta y de la reparametrización.
+    Args:
+        obj (Object): Vehículo
+    """
+    RemoveDrivers(obj)
+    if obj.animation_data and obj.animation_data.action:
+        accion = obj.animation_data.action
+        for fcurve in [fc for fc in accion.fcurves
+                       if fc.data_path in ('location', 'rotation_quaternion', 'dist_recorrida', 'dist_deseada')]:
+            accion.fcurves.remove(fcurve)
+
+def escribe_poses(obj, frames, pos, q):
+    """
+    Función que hornea las poses de un vehículo en fcurves densas de posición y rotación, sustituyendo sus
+    drivers y sus curvas.
+    Args:
+        obj (Object): Vehículo
+        frames (array): Fotogramas
+        pos (array): Array (fotogramas, 3) con las posiciones
+        q (array): Array (fotogramas, 4) con los cuaterniones
+    """
+    limpia_curvas(obj)
+    if obj.animation_data is None:
+        obj.animation_data_create()
+    accion = obj.animation_data.action
+    if accion is None:
+        accion = obj.animation_data.action = bpy.data.actions.new(obj.name + 'Action')
+        etiqueta('coches', accion)
+
+    obj.rotation_mode = 'QUATERNION'
+    for ind in range(3):
+        escribe_fcurve(accion, 'location', ind, frames, pos[:, ind], 'Object Transforms', 'LINEAR')
+    for ind in range(4):
+        escribe_fcurve(accion, 'rotation_quaternion', ind, frames, q[:, ind], 'Object Transforms', 'LINEAR')
+    obj.horneado = True
+
+@medido
+def ExportTrajectoryStore(ruta, lote=64):
+    """
+    Función que exporta la animación de la flota a un almacén externo de trayectorias (ver almacen.py). Evalúa
+    de forma vectorizada las poses de toda la flota entre frame_start y frame_end, por lotes de fotogramas para
+    no tener todo el resultado en memoria, y las escribe en el fichero. Después elimina los drivers y las
+    curvas de los vehículos (y sus acciones si quedan vacías), que pasan a animarse desde el almacén: el
+    fichero .blend ya no guarda las rutas ni las curvas de distancia de cada fotograma.
+    Args:
+        ruta (String): Ruta del fichero del almacén
+        lote (int): Número de fotogramas que se evalúan a la vez
+    Returns:
+        n (int): Número de vehículos exportados
+    """
+    scene = bpy.context.scene
+    coches, tabla = obtener_tabla_flota()
+    if len(coches) == 0:
+        return 0
+
+    # Se suelta el almacén anterior antes de sustituir su fichero
+    cierra_almacen()
+
+    frames = np.arange(scene.frame_start, scene.frame_end + 1, dtype=np.float64)
+    almacen = AlmacenTrayectorias.crea(ruta, scene.frame_start, len(frames), len(coches))
+    for inicio in range(0, len(frames), lote):
+        with tramo('poses_flota'):
+            pos, q = poses_flota(scene, coches, tabla, frames[inicio:inicio + lote])
+        almacen.escribe(inicio, pos, q)
+    almacen.cierra()
+    cuenta('poses', len(frames) * len(coches))
+
+    for fila, obj in enumerate(coches):
+        limpia_curvas(obj)
+        accion = obj.animation_data.action
+        if accion is not None and len(accion.fcurves) == 0:
+            obj.animation_data.action = None
+            bpy.data.actions.remove(accion)
+        obj.rotation_mode = 'QUATERNION'
+        obj.fila_almacen = fila
+
+    invalidar_trayectorias()
+    return len(coches)
+
+def obtener_almacen(scene):
+    """
+    Función que devuelve el almacén de trayectorias de la escena y los vehículos que se animan con él,
+    abriéndolo si no está abierto o si ha cambiado su ruta.
+    Args:
+        scene (Scene): Escena con la ruta del almacén
+    Returns:
+        coches (List): Vehículos del almacén, en el orden de sus filas
+        almacen (AlmacenTrayectorias): Almacén abierto (None si no hay almacén o no se puede abrir)
+    """
+    ruta = bpy.path.abspath(scene.ruta_almacen) if scene.ruta_almacen else None
+    try:
+        [obj.name for obj in _almacen['coches']]
+    except ReferenceError:
+        # Algún vehículo se ha eliminado desde que se abrió el almacén
+        cierra_almacen()
+
+    # Los vehículos del almacén solo se buscan cuando cambia la ruta o tras cerrarlo, de forma que sin
+    # vehículos exportados no se recorren los objetos en cada fotograma
+    if _almacen['ruta'] != ruta:
+        cierra_almacen()
+        _almacen['ruta'] = ruta
+        city = bpy.data.collections.get('ciudad')
+        coches = [obj for obj in city.objects if obj.fila_almacen >= 0] if city and ruta else []
+        if not coches:
+            return [], None
+        try:
+            almacen = AlmacenTrayectorias.abre(ruta)
+        except (OSError, ValueError) as error:
+            _almacen['error'] = "Cannot open the trajectory store: {}".format(error)
+            return [], None
+        if max(obj.fila_almacen for obj in coches) >= almacen.datos.shape[1]:
+            almacen.cierra()
+            _almacen['error'] = "The trajectory store {} has fewer vehicles than the scene".format(ruta)
+            return [], None
+        coches.sort(key=lambda obj: obj.fila_almacen)
+        _almacen.update(almacen=almacen, coches=coches, filas=np.array([obj.fila_almacen for obj in coches]))
+    return _almacen['coches'], _almacen['almacen']
+
+def cierra_almacen():
+    """
+    Función que cierra el almacén de trayectorias abierto.
+    """
+    if _almacen['almacen'] is not None:
+        _almacen['almacen'].cierra()
+    _almacen.update(ruta=None, almacen=None, coches=[], filas=None, error=None)
+
+def error_almacen():
+    """
+    Función que devuelve el motivo por el que no se ha podido abrir el almacén de trayectorias de la escena.
+    Returns:
+        error (String): Mensaje de error (None si se ha abierto o no hay almacén)
+    """
+    return _almacen['error']
+
+def anima_almacen(scene):
+    """
+    Función que escribe en los vehículos del almacén de trayectorias sus poses en el fotograma actual. Solo se
+    leen del disco los datos de este fotograma (y del siguiente en los subfotogramas).
+    Args:
+        scene (Scene): Escena
+    """
+    coches, almacen = obtener_almacen(scene)
+    if almacen is None:
+        return
+    pos, q = almacen.poses(scene.frame_current_final, _almacen['filas'])
+    escribe_transformaciones(coleccion_flota(_almacen, 'flota_almacen'), coches, pos, q)
+
+def cambia_modo_animacion(self, context):
+    """
+    Función que se ejecuta al cambiar el modo de animación de los vehículos. Convierte los vehículos
+    existentes al nuevo modo: con drivers por vehículo o con el handler de toda la flota. Los vehículos no se
+    pueden convertir en instancias (ni al revés): hay que volver a generarlos.
+    """
+    if self.modo_animacion == 'INSTANCES':
+        return
+    for obj in coches_flota():
+        if self.modo_animacion == 'HANDLER':
+            RemoveDrivers(obj)
+            silencia_curvas_posicion(obj, True)
+            obj.rotation_mode = 'QUATERNION'
+        else:
+            silencia_curvas_posicion(obj, False)
+            CreateDrivers(obj)
+    _flota['tabla'] = None
+    actualiza_flota(self)
@@ -0,0 +1,389 @@
+# Autores: Alberto Jativa, Jordi Beltran, Carlos Izquierdo, Enrique Alcover
+# version ='1.0'
+# -------------------------------------------------------------------------------
+"""
+Banco de pruebas de rendimiento de la generación y la reproducción de la ciudad. Mide los tiempos de cada
+etapa variando los parámetros uno a uno alrededor de una configuración base, guarda los resultados en JSON
+y los compara con una base de referencia guardada anteriormente.
+
+Con Blender (o el módulo bpy) se miden las funciones del addon:
+    blender --background --factory-startup --python-exit-code 1 --python benchmarks/benchmark.py -- [opciones]
+
+Sin bpy se miden las mismas etapas en el núcleo independiente de Blender (core.py):
+    python benchmarks/benchmark.py [opciones]
+
+Opciones principales: --barrido (rapido o completo), --repeticiones, --salida, --base y --tolerancia.
+
+Bases de referencia: benchmarks/base_casos_nucleo.json (núcleo, barrido rápido, 7 repeticiones) se guarda
+en el repositorio, con el equipo y las versiones con las que se midió en su campo 'entorno'. Como los tiempos
+dependen del equipo, antes de buscar regresiones conviene crear una base propia con la versión de referencia y comparar
+con ella las siguientes mediciones en el mismo equipo:
+    python benchmarks/benchmark.py --repeticiones 7 --salida benchmarks/base_casos_nucleo.json
+    python benchmarks/benchmark.py --repeticiones 7 --base benchmarks/base_casos_nucleo.json
+Con Blender la base es benchmarks/base_casos_blender.json. Las bases se miden con un solo proceso en la
+generación de los vehículos (--procesos 1, por defecto), para que no dependan del número de núcleos.
+"""
+# -------------------------------------------------------------------------------
+# Imports
+# -------------------------------------------------------------------------------
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import numpy as np
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADDON = os.path.join(RAIZ, 'Procedural-City')
+if not ADDON in sys.path:
+    sys.path.append(ADDON)
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+from core import Parametros, calcula_ciudad, calcula_flota, calcula_poses, tabla_coches
+from rutas import trayectoria_coche
+from trayectoria import error_manejadores
+# -------------------------------------------------------------------------------
+
+# Configuración base y valores de cada parámetro en los barridos (se varía un parámetro cada vez)
+BASE = {'calles': 20, 'n_coches': 400, 'n_giros': 20, 'frame_end': 250, 'interpolation_method': 'LINEAL'}
+
+BARRIDOS = {
+    'rapido': {
+        'calles': [10, 20],
+        'n_coches': [50, 200],
+        'n_giros': [5, 20],
+        'frame_end': [100, 250],
+        'interpolation_method': ['LINEAL', 'HERMITE', 'CATMULL'],
+    },
+    'completo': {
+        'calles': [10, 20, 40, 80],
+        'n_coches': [100, 400, 1600, 6400],
+        'n_giros': [5, 20, 80],
+        'frame_end': [250, 1000, 4000],
+        'interpolation_method': ['LINEAL', 'HERMITE', 'CATMULL'],
+    },
+}
+
+# Comprobaciones de exactitud hechas durante las mediciones en Blender (se guardan con los resultados)
+comprobaciones = []
+
+def configuraciones(barrido):
+    """
+    Función que obtiene las configuraciones de un barrido: la base y, para cada parámetro, la base con cada
+    uno de sus valores (sin repetir configuraciones).
+    Args:
+        barrido (dict): Valores de cada parámetro
+    Returns:
+        configuraciones (List): Diccionarios con los valores de los parámetros de BASE
+    """
+    resultado = [dict(BASE)]
+    for nombre, valores in barrido.items():
+        for valor in valores:
+            config = dict(BASE, **{nombre: valor})
+            if config not in resultado:
+                resultado.append(config)
+    return resultado
+
+def mide(funcion, repeticiones, prepara=None):
+    """
+    Función que mide el tiempo de ejecución de una función varias veces.
+    Args:
+        funcion (function): Función que se mide
+        repeticiones (int): Número de mediciones
+        prepara (function): Función que se ejecuta (sin medir) antes de cada medición (opcional)
+    Returns:
+        tiempos (List): Tiempo de cada medición en segundos
+        valor: Valor devuelto por la función en la última medición
+    """
+    tiempos = []
+    valor = None
+    for _ in range(repeticiones):
+        if prepara is not None:
+            prepara()
+        inicio = time.perf_counter()
+        valor = funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return tiempos, valor
+
+def resultado(caso, config, tiempos, **extra):
+    """
+    Función que crea el registro de una medición.
+    Args:
+        caso (String): Nombre de la etapa medida
+        config (dict): Parámetros de la medición
+        tiempos (List): Tiempos medidos en segundos
+        extra: Parámetros adicionales de la medición (p. ej. el modo de animación)
+    Returns:
+        registro (dict): Registro con el caso, los parámetros, los tiempos, la mediana y el mínimo
+    """
+    return {'caso': caso, 'parametros': dict(config, **extra), 'tiempos': tiempos,
+            'mediana': statistics.median(tiempos), 'minimo': min(tiempos)}
+
+def parametros_config(config, procesos):
+    """
+    Función que crea los parámetros del núcleo de una configuración.
+    Args:
+        config (dict): Valores de los parámetros de BASE
+        procesos (int): Número de procesos de la generación de los vehículos
+    Returns:
+        parametros (Parametros): Parámetros de la configuración
+    """
+    return Parametros(calles_x=config['calles'], calles_y=config['calles'], n_coches=config['n_coches'],
+                      n_giros=config['n_giros'], frame_end=config['frame_end'],
+                      interpolation_method=config['interpolation_method'], n_procesos=procesos)
+
+def casos_nucleo(config, args):
+    """
+    Función que mide las etapas en el núcleo independiente de Blender: la distribución de los edificios, la
+    generación de los vehículos, las curvas de distancia recorrida y la evaluación de las poses de la flota
+    en cada fotograma.
+    Args:
+        config (dict): Valores de los parámetros de BASE
+        args (Namespace): Opciones del banco de pruebas
+    Returns:
+        resultados (List): Registros de las mediciones
+    """
+    parametros = parametros_config(config, args.procesos)
+    resultados = []
+
+    tiempos, _ = mide(lambda: calcula_ciudad(parametros, 3, np.random.default_rng(parametros.semilla)),
+                      args.repeticiones)
+    resultados.append(resultado('calcula_ciudad', config, tiempos))
+
+    tiempos, coches = mide(lambda: calcula_flota(parametros, 3, distancias=False), args.repeticiones)
+    resultados.append(resultado('calcula_flota', config, tiempos))
+
+    frames = np.arange(0, parametros.frame_end + 1, dtype=np.float64)
+    trayectorias = [trayectoria_coche(coche['claves']) for coche in coches]
+    tiempos, _ = mide(lambda: [tray.distancia_recorrida(frames, parametros.interpolation_method, parametros.tau_value)
+                               for tray in trayectorias], args.repeticiones)
+    resultados.append(resultado('distancia_recorrida', config, tiempos))
+
+    # Tiempo medio por fotograma (la primera evaluación calcula los coeficientes de la tabla y no se mide)
+    tabla = tabla_coches(coches)
+    alabeo = np.zeros(tabla.n_vehiculos, dtype=bool)
+    calcula_poses(parametros, tabla, parametros.frame_start, alabeo)
+    n = min(args.fotogramas, parametros.frame_end)
+    fotogramas = range(parametros.frame_start, parametros.frame_start + n)
+    tiempos, _ = mide(lambda: [calcula_poses(parametros, tabla, f, alabeo) for f in fotogramas], args.repeticiones)
+    tiempos = [t / n for t in tiempos]
+    resultados.append(resultado('calcula_poses', config, tiempos))
+    return resultados
+
+def carga_addon():
+    """
+    Función que carga el addon como paquete (sus módulos usan importaciones relativas) y lo registra si no
+    está registrado ya en Blender.
+    Returns:
+        addon (module): Paquete del addon
+    """
+    if 'procedural_city' in sys.modules:
+        return sys.modules['procedural_city']
+    spec = importlib.util.spec_from_file_location('procedural_city', os.path.join(ADDON, '__init__.py'),
+                                                  submodule_search_locations=[ADDON])
+    addon = importlib.util.module_from_spec(spec)
+    sys.modules['procedural_city'] = addon
+    spec.loader.exec_module(addon)
+    if not hasattr(bpy.types.Scene, 'calles_x'):
+        addon.register()
+
+    # Los drivers con expresiones de Python solo se evalúan si está activada la ejecución automática
+    bpy.context.preferences.filepaths.use_scripts_auto_execute = True
+    return addon
+
+def casos_blender(config, args):
+    """
+    Función que mide las etapas del addon en Blender: CreateCity, CreateVehicles,
+    ObtenerCurvaDistancia_Recorrida de toda la flota y la evaluación de un fotograma con drivers y con
+    el handler de la flota. Además comprueba los manejadores emulados (ver comprueba_manejadores).
+    Args:
+        config (dict): Valores de los parámetros de BASE
+        args (Namespace): Opciones del banco de pruebas
+    Returns:
+        resultados (List): Registros de las mediciones
+    """
+    addon = carga_addon()
+    import modelo
+    from crea_copias import crea_copias
+    city, vehicles, delete = addon.city, addon.vehicles, addon.delete
+
+    scene = bpy.context.scene
+    scene.modo_animacion = 'DRIVERS'
+    scene.calles_x = scene.calles_y = config['calles']
+    scene.n_coches = config['n_coches']
+    scene.n_giros = config['n_giros']
+    scene.frame_end = config['frame_end']
+    scene.interpolation_method = config['interpolation_method']
+    scene.n_procesos = args.procesos
+    resultados = []
+
+    tiempos, _ = mide(city.CreateCity, args.repeticiones, prepara=delete.DeleteGenerated)
+    resultados.append(resultado('CreateCity', config, tiempos))
+
+    def prepara_vehiculos():
+        # Modelo y copias de los coches, igual que GenerateCityOperator.crea_vehiculos
+        delete.DeleteGenerated('coches')
+        delete.DeleteCollections('copias_ModeloCoche')
+        obj = bpy.data.objects.new("ModeloCoche", modelo.obtener_malla(args.modelo))
+        scene.collection.objects.link(obj)
+        delete.etiqueta('coches', obj)
+        delete.etiqueta('coches', crea_copias(obj, bpy.context))
+
+    tiempos, _ = mide(vehicles.CreateVehicles, args.repeticiones, prepara=prepara_vehiculos)
+    resultados.append(resultado('CreateVehicles', config, tiempos))
+    delete.DeleteCollections('copias_ModeloCoche')
+    delete.DeleteObjects('ModeloCoche')
+
+    coches = vehicles.coches_flota()
+    comprueba_manejadores(vehicles, coches, config)
+    tiempos, _ = mide(lambda: [vehicles.ObtenerCurvaDistancia_Recorrida(obj) for obj in coches], args.repeticiones)
+    resultados.append(resultado('ObtenerCurvaDistancia_Recorrida', config, tiempos))
+
+    # Tiempo medio por fotograma con cada modo de animación (el cambio de modo convierte los vehículos)
+    for obj in coches:
+        vehicles.CreateDrivers(obj)
+    n = min(args.fotogramas, scene.frame_end)
+    fotogramas = range(scene.frame_start, scene.frame_start + n)
+    for modo in ('DRIVERS', 'HANDLER'):
+        scene.modo_animacion = modo
+        scene.frame_set(scene.frame_start)
+        tiempos, _ = mide(lambda: [scene.frame_set(f) for f in fotogramas], args.repeticiones)
+        tiempos = [t / n for t in tiempos]
+        resultados.append(resultado('fotograma', config, tiempos, modo_animacion=modo))
+    scene.modo_animacion = 'DRIVERS'
+    return resultados
+
+def comprueba_manejadores(vehicles, coches, config):
+    """
+    Función que comprueba que los manejadores emulados sin Blender (trayectoria.velocidades_manejadores), con los
+    que los procesos calculan la distancia recorrida, coinciden con los que Blender ha calculado en las fcurves
+    escritas con escribe_fcurve (handle_left y handle_right de sus fotogramas clave).
+    Args:
+        vehicles (module): Módulo vehicles del addon
+        coches (List): Vehículos creados
+        config (dict): Valores de los parámetros de BASE
+    """
+    error = 0.0
+    for obj in coches:
+        real = vehicles.lee_trayectoria(obj.animation_data.action)
+        emulada = trayectoria_coche(list(zip(real.tiempos, real.valores)))
+        error = max(error, error_manejadores(emulada, real))
+    correcto = error <= vehicles.TOLERANCIA_MANEJADORES
+    comprobaciones.append({'caso': 'manejadores', 'parametros': config, 'error': error, 'correcto': correcto})
+    print("{:<34} {:<70} {:>10.2e}{}".format('manejadores', json.dumps(config, sort_keys=True), error,
+                                             '' if correcto else '  MISMATCH'))
+
+def entorno():
+    """
+    Función que describe el equipo y las versiones con las que se han hecho las mediciones.
+    Returns:
+        entorno (dict): Descripción del entorno
+    """
+    return {'plataforma': platform.platform(), 'procesador': platform.processor(), 'nucleos': os.cpu_count(),
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'blender': bpy.app.version_string if bpy is not None else None,
+            'fecha': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+def clave(registro):
+    """
+    Función que obtiene la clave con la que se emparejan las mediciones y las de la base de referencia.
+    """
+    return registro['caso'], json.dumps(registro['parametros'], sort_keys=True)
+
+def compara(resultados, base, tolerancia):
+    """
+    Función que compara los tiempos mínimos de las mediciones con los de la base de referencia (el mínimo es
+    el valor menos afectado por el resto de procesos del equipo) y muestra una tabla con el cociente de cada
+    medición.
+    Args:
+        resultados (List): Registros de las mediciones
+        base (List): Registros de la base de referencia
+        tolerancia (float): Aumento relativo del tiempo a partir del cual se considera una regresión
+    Returns:
+        regresiones (List): Registros cuyo tiempo supera el de la base en más de la tolerancia
+    """
+    referencia = {clave(registro): registro for registro in base}
+    regresiones = []
+    for registro in resultados:
+        anterior = referencia.get(clave(registro))
+        if anterior is None:
+            continue
+        cociente = registro['minimo'] / anterior['minimo'] if anterior['minimo'] > 0 else float('inf')
+        registro['cociente_base'] = cociente
+        marca = ''
+        if cociente > 1 + tolerancia:
+            regresiones.append(registro)
+            marca = '  REGRESSION'
+        print("{:<34} {:<70} {:>10.2f} ms {:>10.2f} ms {:>6.2f}x{}".format(
+            registro['caso'], clave(registro)[1], registro['minimo'] * 1000, anterior['minimo'] * 1000,
+            cociente, marca))
+    return regresiones
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Procedural City benchmarks")
+    parser.add_argument('--barrido', choices=sorted(BARRIDOS), default='rapido', help="Parameter sweep")
+    parser.add_argument('--repeticiones', type=int, default=3, help="Measurements per case")
+    parser.add_argument('--fotogramas', type=int, default=24, help="Frames evaluated in the per-frame cases")
+    parser.add_argument('--procesos', type=int, default=1,
+                        help="Vehicle generation workers (default 1 for reproducible baselines, 0 = all cores)")
+    parser.add_argument('--modelo', default=os.path.join(RAIZ, 'car.obj'), help="Car model (.obj)")
+    parser.add_argument('--nucleo', action='store_true', help="Measure only the bpy-free core")
+    parser.add_argument('--salida', default='resultados.json', help="JSON file for the results")
+    parser.add_argument('--base', help="JSON baseline to compare against (e.g. benchmarks/base_casos_nucleo.json)")
+    parser.add_argument('--tolerancia', type=float, default=0.25, help="Allowed relative slowdown")
+    args = parser.parse_args(argv)
+
+    casos = casos_nucleo if bpy is None or args.nucleo else casos_blender
+
+    # La base de referencia se comprueba antes de medir, para no esperar a las mediciones si no sirve
+    base = None
+    if args.base:
+        if not os.path.isfile(args.base):
+            print("Baseline {} not found. Create it with a reference build on this machine:\n"
+                  "    python benchmarks/benchmark.py --barrido {} --salida {}".format(args.base, args.barrido, args.base))
+            return 2
+        with open(args.base) as fichero:
+            base = json.load(fichero)
+        if (base.get('modo'), base.get('barrido'), base.get('procesos')) != (casos.__name__, args.barrido, args.procesos):
+            print("Baseline {} was measured with {} ({} sweep, {} workers), not {} ({} sweep, {} workers)".format(
+                args.base, base.get('modo'), base.get('barrido'), base.get('procesos'), casos.__name__, args.barrido,
+                args.procesos))
+            return 2
+        print("Baseline measured on {plataforma}, {nucleos} cores, Python {python}, NumPy {numpy}".format(
+            **base['entorno']))
+
+    resultados = []
+    for config in configuraciones(BARRIDOS[args.barrido]):
+        for registro in casos(config, args):
+            print("{:<34} {:<70} {:>10.2f} ms".format(registro['caso'], clave(registro)[1], registro['mediana'] * 1000))
+            resultados.append(registro)
+
+    regresiones = []
+    if base is not None:
+        print("\nComparison with", args.base)
+        regresiones = compara(resultados, base['resultados'], args.tolerancia)
+        print("{} regression(s) above {:.0%}".format(len(regresiones), args.tolerancia))
+
+    with open(args.salida, 'w') as fichero:
+        json.dump({'modo': casos.__name__, 'barrido': args.barrido, 'procesos': args.procesos,
+                   'repeticiones': args.repeticiones, 'entorno': entorno(), 'resultados': resultados,
+                   'comprobaciones': comprobaciones},
+                  fichero, indent=1)
+    print("Results written to", args.salida)
+    errores = [comprobacion for comprobacion in comprobaciones if not comprobacion['correcto']]
+    if errores:
+        print("{} configuration(s) where the emulated handles differ from Blender's".format(len(errores)))
+    return 1 if regresiones or errores else 0
+
+if __name__ == "__main__":
+    # En Blender los argumentos del script van detrás de '--'
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else sys.argv[1:]
+    sys.exit(main(argv))